@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from Transport import Address
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+# Adapts a backend independent NodeProtocol to an asyncio protocol. Also acts as the transport
+# handed to the NodeProtocol, offering the write/getPeer/loseConnection calls it expects.
+class _AsyncioProtocol(asyncio.Protocol):
+    def __init__(self, node_protocol):
+        self.node_protocol = node_protocol
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.node_protocol.makeConnection(self)
+
+    def data_received(self, data):
+        self.node_protocol.dataReceived(data)
+
+    def connection_lost(self, exc):
+        self.node_protocol.connectionLost(exc)
+
+    # Flow control of the transport's write buffer
+    def pause_writing(self):
+        self.node_protocol.pauseProducing()
+
+    def resume_writing(self):
+        self.node_protocol.resumeProducing()
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def getPeer(self):
+        host, port = self.transport.get_extra_info('peername')[:2]
+        return Address(host, port)
+
+    def loseConnection(self):
+        self.transport.close()
+
+
+class AsyncioTransport:
+    name = 'asyncio'
+
+    def __init__(self, loop=None):
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+        self.loop = loop
+        self.servers = []
+        # Keeps references to pending connection attempts so they are not garbage collected
+        self.tasks = set()
+
+    def spawn(self, coro):
+        task = self.loop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    # Returns a listener handle for stopListening
+    def listen(self, port, factory):
+        return self.spawn(self.startServer(port, factory))
+
+    async def startServer(self, port, factory):
+        server = await self.loop.create_server(lambda: _AsyncioProtocol(factory.buildProtocol(None)), port=port)
+        self.servers.append(server)
+        return server
+
+    def stopListening(self, listener):
+        if not listener.done():
+            listener.cancel()
+        elif listener.exception() is None:
+            server = listener.result()
+            server.close()
+            self.servers.remove(server)
+
+    # Calls callback(protocol, *args) once connected, or callback(None, *args) if the connection
+    # failed (refused, unreachable, timed out or the host name did not resolve)
+    def connect(self, addr, port, protocol, callback, *args):
+        return self.spawn(self.startConnection(addr, port, protocol, callback, *args))
+
+    async def startConnection(self, addr, port, protocol, callback, *args):
+        try:
+            await self.loop.create_connection(lambda: _AsyncioProtocol(protocol), addr, port)
+        except OSError as e:
+            logging.debug(f"Connection to {addr}:{port} failed: {e}")
+            protocol = None
+        callback(protocol, *args)
+
+    def callLater(self, delay, f, *args, **kwargs):
+        return self.loop.call_later(delay, lambda: f(*args, **kwargs))
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.loop.call_soon_threadsafe(lambda: f(*args, **kwargs))
+
+    def run(self, installSignalHandlers=True):
+        # Signals are left to the default KeyboardInterrupt handling of the loop
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,99 @@
+from hashlib import blake2b
+from time import time
+
+
+# Bit indexes of a key in a filter of size bits, by double hashing one 128 bit digest
+def indexes(key, size, hashes):
+    digest = blake2b(key.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return [(h1 + i * h2) % size for i in range(hashes)]
+
+
+class BloomFilter:
+    def __init__(self, size=1 << 16, hashes=4):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray((size + 7) // 8)
+        self.count = 0
+
+    def add(self, key):
+        for i in indexes(key, self.size, self.hashes):
+            self.bits[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        for i in indexes(key, self.size, self.hashes):
+            if not self.bits[i >> 3] & (1 << (i & 7)):
+                return False
+        return True
+
+    def clear(self):
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+
+
+# Set of recently seen keys backed by rotating Bloom filters. A key is remembered for at least
+# lifetime seconds and at most lifetime plus one rotation period.
+class DeadNonceList:
+    def __init__(self, lifetime=6, generations=2, size=1 << 16, hashes=4):
+        self.period = lifetime / (generations - 1)
+        self.filters = [BloomFilter(size, hashes) for _ in range(generations)]
+        self.rotated = time()
+
+    def rotate(self):
+        t = time()
+        while t - self.rotated >= self.period:
+            oldest = self.filters.pop()
+            oldest.clear()
+            self.filters.insert(0, oldest)
+            self.rotated += self.period
+            # Long idle, every filter is out of date
+            if t - self.rotated >= self.period * len(self.filters):
+                for f in self.filters:
+                    f.clear()
+                self.rotated = t
+
+    def add(self, key):
+        self.rotate()
+        self.filters[0].add(key)
+
+    def __contains__(self, key):
+        self.rotate()
+        for f in self.filters:
+            if key in f:
+                return True
+        return False
+
+
+# Bloom filter with a counter per position, so keys can be removed again
+class CountingBloomFilter:
+    def __init__(self, size=1 << 10, hashes=3):
+        self.size = size
+        self.hashes = hashes
+        self.counters = bytearray(size)
+
+    def add(self, key):
+        for i in indexes(key, self.size, self.hashes):
+            # Saturated counters stay set for good rather than wrapping around
+            if self.counters[i] < 255:
+                self.counters[i] += 1
+
+    def remove(self, key):
+        for i in indexes(key, self.size, self.hashes):
+            if 0 < self.counters[i] < 255:
+                self.counters[i] -= 1
+
+    def __contains__(self, key):
+        for i in indexes(key, self.size, self.hashes):
+            if self.counters[i] == 0:
+                return False
+        return True
+
+    # Plain Bloom filter of the keys currently in this one
+    def toBloomFilter(self):
+        f = BloomFilter(self.size, self.hashes)
+        for i, c in enumerate(self.counters):
+            if c:
+                f.bits[i >> 3] |= 1 << (i & 7)
+        return f
@@ -0,0 +1,87 @@
+from abc import ABC, abstractmethod
+import random
+
+# Policy names
+LCE = 'lce'
+LCD = 'lcd'
+PROB = 'prob'
+BTW = 'btw'
+POP = 'pop'
+
+
+# On-path caching decisions, made by every relay a DATA message passes through. hops is the
+# number of links the data has travelled from its source (producer or cache), path the length
+# of the path the request took to that source and betweenness the highest centrality seen on it.
+class CachePolicy(ABC):
+    name = None
+
+    # Whether the relay node caches the data it is forwarding
+    @abstractmethod
+    def admit(self, node, data_name, hops, path, betweenness):
+        pass
+
+
+# Leave copy everywhere: every relay caches
+class LeaveCopyEverywhere(CachePolicy):
+    name = LCE
+
+    def admit(self, node, data_name, hops, path, betweenness):
+        return True
+
+
+# Leave copy down: only the relay one hop below the source caches, so popular content moves
+# one level towards the requesters with each hit
+class LeaveCopyDown(CachePolicy):
+    name = LCD
+
+    def admit(self, node, data_name, hops, path, betweenness):
+        return hops is None or hops == 1
+
+
+# ProbCache (Psaras et al.): caches with a probability that grows towards the requester and
+# with the caching capacity left on the path, t_tw being the target time window
+class ProbCache(CachePolicy):
+    name = PROB
+
+    def __init__(self, t_tw=10):
+        self.t_tw = t_tw
+
+    def admit(self, node, data_name, hops, path, betweenness):
+        if hops is None or not path:
+            return True
+        times_in = (path - hops + 1) / self.t_tw
+        cache_weight = (hops / path) ** path
+        return random.random() < times_in * cache_weight
+
+
+# Cache "less for more" (Chai et al.): only the relay with the highest centrality on the path
+# caches. Centrality is approximated by the number of peers a node has.
+class Betweenness(CachePolicy):
+    name = BTW
+
+    def admit(self, node, data_name, hops, path, betweenness):
+        return betweenness is None or centrality(node) >= betweenness
+
+
+# Admits names requested through this relay at least min_rate times per second
+class Popularity(CachePolicy):
+    name = POP
+
+    def __init__(self, min_rate=0.1):
+        self.min_rate = min_rate
+
+    def admit(self, node, data_name, hops, path, betweenness):
+        return node.rates.rate(data_name) >= self.min_rate
+
+
+def centrality(node):
+    return len(node.peers)
+
+
+POLICIES = {p.name: p for p in [LeaveCopyEverywhere, LeaveCopyDown, ProbCache, Betweenness, Popularity]}
+
+
+def getPolicy(name=LCE):
+    if name not in POLICIES:
+        raise ValueError(f"Unknown cache policy {name}, expected one of {list(POLICIES)}")
+    return POLICIES[name]()
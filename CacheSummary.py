@@ -0,0 +1,74 @@
+from Bloom import BloomFilter, CountingBloomFilter
+import base64
+
+# Seconds between summary updates sent to peers
+SUMMARY_INTERVAL = 2
+# Every this many intervals the full summary is sent instead of the changes
+FULL_EVERY = 10
+SUMMARY_BITS = 512
+SUMMARY_HASHES = 3
+
+# Summary message contents
+VER = 'version'
+BASE = 'base'
+BITS = 'bits'
+SET = 'set'
+CLR = 'clear'
+
+
+# Summary of a node's cache contents, kept up to date by the cache table. Peers get the full
+# Bloom filter once and then only the bit positions that changed between versions.
+class CacheSummary:
+    def __init__(self, size=SUMMARY_BITS, hashes=SUMMARY_HASHES):
+        self.counts = CountingBloomFilter(size, hashes)
+        self.version = 0
+        # Filter as of the last version sent
+        self.sent = BloomFilter(size, hashes)
+        self.updates = 0
+
+    def added(self, data_name):
+        self.counts.add(data_name)
+
+    def removed(self, data_name):
+        self.counts.remove(data_name)
+
+    def full(self):
+        return {VER: self.version, BITS: base64.b64encode(bytes(self.sent.bits)).decode()}
+
+    # Returns the message content for the next update, or None if nothing changed
+    def update(self):
+        self.updates += 1
+        current = self.counts.toBloomFilter()
+        changed = [i for i in range(len(current.bits)) if current.bits[i] != self.sent.bits[i]]
+        if not changed:
+            if self.updates % FULL_EVERY == 0:
+                return self.full()
+            return None
+        set_bits, clear_bits = [], []
+        for byte in changed:
+            diff = current.bits[byte] ^ self.sent.bits[byte]
+            for bit in range(8):
+                if diff & (1 << bit):
+                    (set_bits if current.bits[byte] & (1 << bit) else clear_bits).append(byte * 8 + bit)
+        base = self.version
+        self.version += 1
+        self.sent = current
+        if self.updates % FULL_EVERY == 0:
+            return self.full()
+        return {VER: self.version, BASE: base, SET: set_bits, CLR: clear_bits}
+
+
+# Applies a summary message to the filter held for a peer. Returns the new (filter, version), or
+# (None, None) if the changes do not apply to the version held.
+def applySummary(summary, version, content):
+    if BITS in content:
+        f = BloomFilter(SUMMARY_BITS, SUMMARY_HASHES)
+        f.bits = bytearray(base64.b64decode(content[BITS]))
+        return f, content[VER]
+    if summary is None or version != content[BASE]:
+        return None, None
+    for i in content[SET]:
+        summary.bits[i >> 3] |= 1 << (i & 7)
+    for i in content[CLR]:
+        summary.bits[i >> 3] &= ~(1 << (i & 7))
+    return summary, content[VER]
@@ -0,0 +1,70 @@
+import zlib
+
+# Frames shorter than this (in bytes) are always sent raw
+COMPRESS_THRESHOLD = 128
+
+# Compressed frames start with this marker followed by a codec id byte. Raw frames are JSON
+# text and therefore never start with a NUL byte.
+FRAME_MARKER = b'\x00'
+
+ZLIB = 'zlib'
+ZLIB_DICT = 'zlib-icn1'
+
+# Preset dictionary for ZLIB_DICT, built from the strings that appear in nearly every ICN
+# message. zlib favours matches near the end of the dictionary, so the most frequent strings
+# come last. Changing this requires a new codec name since both ends must use the same bytes.
+ZDICT = (
+    b'temperatures_amsterdam_beijing_capetown_doha_dublin_losangeles_stockholm_sydney_tokyo_toronto'
+    b'_temp_per_hum_bar_cloud_snow_water_wind'
+    b'{\\"port\\": \\"{\\"fallback\\": localhost:127.0.0.1:NO_ADDRESS'
+    b'"type": "ANNOUNCE""type": "ACKNOWLEDGE""type": "FAIL""type": "DIRECT_REQUEST""type": "REQUEST"'
+    b', \\"time_to_wait\\": , \\"location\\": \\"'
+    b', \\"time_to_use\\": '
+    b'"type": "DATA", "content": "{\\"data_name\\": \\"'
+    b', \\"data_val\\": \\"gAAAAAB'
+    b'{"id": "Pi'
+)
+
+# Codecs in order of preference
+CODECS = [ZLIB_DICT, ZLIB]
+CODEC_IDS = {ZLIB_DICT: b'\x02', ZLIB: b'\x01'}
+CODEC_NAMES = {v: k for k, v in CODEC_IDS.items()}
+
+
+def negotiate(offered):
+    # Picks the first codec offered by the peer that this node supports, or None
+    if offered is None:
+        return None
+    if isinstance(offered, str):
+        offered = [offered]
+    for codec in offered:
+        if codec in CODEC_IDS:
+            return codec
+    return None
+
+
+def compress(data, codec):
+    if codec is None or len(data) < COMPRESS_THRESHOLD:
+        return data
+    if codec == ZLIB_DICT:
+        c = zlib.compressobj(zlib.Z_BEST_COMPRESSION, zdict=ZDICT)
+    else:
+        c = zlib.compressobj(zlib.Z_BEST_COMPRESSION)
+    frame = FRAME_MARKER + CODEC_IDS[codec] + c.compress(data) + c.flush()
+    # Not worth it (e.g. already compact payloads), send as is
+    if len(frame) >= len(data):
+        return data
+    return frame
+
+
+def decompress(data):
+    if not data.startswith(FRAME_MARKER):
+        return data
+    codec = CODEC_NAMES.get(data[1:2])
+    if codec == ZLIB_DICT:
+        d = zlib.decompressobj(zdict=ZDICT)
+    elif codec == ZLIB:
+        d = zlib.decompressobj()
+    else:
+        raise ValueError(f"Unknown compression codec id {data[1:2]!r}")
+    return d.decompress(data[2:]) + d.flush()
@@ -0,0 +1,212 @@
+from collections import defaultdict
+from time import time
+import argparse
+import json
+import struct
+
+# Events
+SEND = 0
+RECV = 1
+# Request made by this node
+ISSUE = 2
+# Request answered from this node's own data, from its cache, or with a stale cached copy
+PRODUCE = 3
+HIT = 4
+STALE_HIT = 5
+# Data for a request made by this node arrived, or the request failed
+DELIVER = 6
+FAILED = 7
+EVENTS = ['send', 'recv', 'issue', 'produce', 'hit', 'stale_hit', 'deliver', 'failed']
+
+# Message types by id, 255 for none. New types go at the end so older traces keep their ids.
+MSG_TYPES = ['ANNOUNCE', 'ACKNOWLEDGE', 'REQUEST', 'DIRECT_REQUEST', 'FAIL', 'DATA', 'ADVERTISE', 'SUMMARY', 'FIND',
+             'FOUND', 'REGISTER']
+MSG_TYPE_IDS = {m: i for i, m in enumerate(MSG_TYPES)}
+NO_MSG_TYPE = 255
+# Message types that carry a request along its path
+REQUEST_TYPES = ('REQUEST', 'DIRECT_REQUEST')
+
+# Trace file: magic line, JSON header line, then chunks of a chunk header (length of a JSON list
+# of the strings interned since the last chunk, number of records), the list and the records
+TRACE_MAGIC = b'ICNTRACE1\n'
+CHUNK = struct.Struct('<II')
+# Timestamp, event, message type, data name id, peer id, size (bytes), nonce
+RECORD = struct.Struct('<dBBIIII')
+# Records held before the buffer is written out
+BUFFER_RECORDS = 4096
+# Seconds between flushes of a partly filled buffer
+FLUSH_INTERVAL = 1
+
+
+# Records a node's events as fixed size records in a preallocated buffer that is written to a
+# file whenever it fills up or is flushed. Data and node names are interned as ids.
+class EventRecorder:
+    def __init__(self, path, node_name, capacity=BUFFER_RECORDS):
+        self.file = open(path, 'wb')
+        self.file.write(TRACE_MAGIC)
+        self.file.write(json.dumps({'node': node_name, 'start': time()}).encode() + b'\n')
+        self.buffer = bytearray(capacity * RECORD.size)
+        self.capacity = capacity
+        self.count = 0
+        # Id 0 stands for no name
+        self.ids = {'': 0}
+        self.new_strings = ['']
+
+    def intern(self, s):
+        if s is None:
+            return 0
+        i = self.ids.get(s)
+        if i is None:
+            i = len(self.ids)
+            self.ids[s] = i
+            self.new_strings.append(s)
+        return i
+
+    def record(self, event, msg_type=None, data_name=None, peer=None, size=0, nonce=None):
+        RECORD.pack_into(self.buffer, self.count * RECORD.size, time(), event, MSG_TYPE_IDS.get(msg_type, NO_MSG_TYPE),
+                         self.intern(data_name), self.intern(peer), size, nonce or 0)
+        self.count += 1
+        if self.count == self.capacity:
+            self.flush()
+
+    def flush(self):
+        if self.file is None or (self.count == 0 and not self.new_strings):
+            return
+        strings = json.dumps(self.new_strings).encode()
+        self.file.write(CHUNK.pack(len(strings), self.count))
+        self.file.write(strings)
+        self.file.write(memoryview(self.buffer)[:self.count * RECORD.size])
+        self.file.flush()
+        self.new_strings = []
+        self.count = 0
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+
+# Returns the header and the (timestamp, event, message type, data name, peer, size, nonce)
+# records of a trace file, names resolved
+def readEvents(path):
+    with open(path, 'rb') as f:
+        if f.readline() != TRACE_MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        header = json.loads(f.readline())
+        strings = []
+        events = []
+        while True:
+            head = f.read(CHUNK.size)
+            if len(head) < CHUNK.size:
+                break
+            length, count = CHUNK.unpack(head)
+            strings += json.loads(f.read(length))
+            data = f.read(count * RECORD.size)
+            # A trace cut short by a crash ends with a partial chunk
+            data = data[:len(data) - len(data) % RECORD.size]
+            for t, event, msg_type, name_id, peer_id, size, nonce in RECORD.iter_unpack(data):
+                msg_type = MSG_TYPES[msg_type] if msg_type < len(MSG_TYPES) else None
+                events.append((t, event, msg_type, strings[name_id], strings[peer_id], size, nonce))
+    return header, events
+
+
+# Follows the requests issued in a set of node traces across the nodes they were sent to
+class TraceAnalysis:
+    def __init__(self, traces):
+        # (timestamp, node, data name, nonce) of every issued request
+        self.issued = []
+        # Nonce -> [(timestamp, sender, receiver)] of the REQUEST and DIRECT_REQUEST messages sent
+        self.sent = defaultdict(list)
+        # (nonce, sender, receiver) -> timestamp received
+        self.received = {}
+        # Nonce -> [(timestamp, node, event)] where the request was answered
+        self.served = defaultdict(list)
+        # (node, data name) -> sorted [(timestamp, event)] of deliveries and failures
+        self.outcomes = defaultdict(list)
+        for header, events in traces:
+            node = header['node']
+            for t, event, msg_type, data_name, peer, size, nonce in events:
+                if event == ISSUE:
+                    self.issued.append((t, node, data_name, nonce))
+                elif event == SEND and msg_type in REQUEST_TYPES:
+                    self.sent[nonce].append((t, node, peer))
+                elif event == RECV and msg_type in REQUEST_TYPES:
+                    self.received[(nonce, peer, node)] = t
+                elif event in (PRODUCE, HIT, STALE_HIT):
+                    self.served[nonce].append((t, node, event))
+                elif event in (DELIVER, FAILED):
+                    self.outcomes[(node, data_name)].append((t, event))
+        self.issued.sort()
+        for v in self.outcomes.values():
+            v.sort()
+
+    # Hops (sender, receiver, latency or None if never received) the request was sent along
+    def hops(self, nonce):
+        hops = []
+        for t, sender, receiver in sorted(self.sent.get(nonce, [])):
+            t_recv = self.received.get((nonce, sender, receiver))
+            hops.append((sender, receiver, None if t_recv is None else t_recv - t))
+        return hops
+
+    # First delivery or failure of a request after it was issued: (latency, event), or None
+    def outcome(self, t, node, data_name):
+        for t_out, event in self.outcomes.get((node, data_name), []):
+            if t_out >= t:
+                return t_out - t, event
+        return None
+
+    def requests(self):
+        for t, node, data_name, nonce in self.issued:
+            yield t, node, data_name, self.hops(nonce), self.served.get(nonce, []), self.outcome(t, node, data_name)
+
+    def summary(self):
+        lines = []
+        links = defaultdict(list)
+        answered = defaultdict(int)
+        latencies = []
+        for t, node, data_name, hops, served, outcome in self.requests():
+            for sender, receiver, latency in hops:
+                if latency is not None:
+                    links[(sender, receiver)].append(latency)
+            for t_served, server, event in served:
+                answered[(server, EVENTS[event])] += 1
+            if outcome is not None and outcome[1] == DELIVER:
+                latencies.append(outcome[0])
+        lines.append(f"{len(self.issued)} requests, {len(latencies)} delivered")
+        if latencies:
+            latencies.sort()
+            lines.append(f"Latency p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+        lines.append("Answered by:")
+        for (server, event), count in sorted(answered.items()):
+            lines.append(f"  {server:12} {event:10} {count}")
+        lines.append("Hop latencies:")
+        for (sender, receiver), latency in sorted(links.items()):
+            latency.sort()
+            lines.append(f"  {sender:>8} -> {receiver:8} {len(latency):6} requests, p50 {percentile(latency, 0.5) * 1000:.2f} ms, "
+                         f"p99 {percentile(latency, 0.99) * 1000:.2f} ms")
+        return '\n'.join(lines)
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuilds request paths, hop latencies and cache hits from node traces')
+    parser.add_argument('traces', help='Trace files of the nodes', type=str, nargs='+')
+    parser.add_argument('--requests', help='Also print the path of every request', action='store_true')
+    args = parser.parse_args()
+
+    analysis = TraceAnalysis([readEvents(p) for p in args.traces])
+    if args.requests:
+        for t, node, data_name, hops, served, outcome in analysis.requests():
+            path = ', '.join(f"{s}->{r}" + (f" {l * 1000:.2f}ms" if l is not None else " lost") for s, r, l in hops)
+            answered = ', '.join(f"{EVENTS[e]} at {n}" for _, n, e in served) or 'unanswered'
+            result = f"{EVENTS[outcome[1]]} after {outcome[0] * 1000:.1f} ms" if outcome is not None else 'no outcome'
+            print(f"{t:.3f} {node} {data_name}: [{path}] {answered}; {result}")
+    print(analysis.summary())
+
+
+if __name__ == "__main__":
+    main()
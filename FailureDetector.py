@@ -0,0 +1,69 @@
+from collections import deque
+import math
+
+# Seconds between heartbeats sent to each peer
+HEARTBEAT_INTERVAL = 0.1
+# Suspicion level above which a peer is considered failed
+PHI_THRESHOLD = 8
+# Lower bound of the heartbeat interval std dev, so a very regular peer is not suspected on the
+# first late heartbeat
+MIN_STD_DEV = HEARTBEAT_INTERVAL / 2
+# Delay (e.g. a busy event loop) tolerated on top of the expected heartbeat interval
+ACCEPTABLE_PAUSE = HEARTBEAT_INTERVAL
+# Heartbeat intervals remembered
+WINDOW = 100
+# Until this many intervals are known a fixed timeout is used instead
+MIN_SAMPLES = 5
+HEARTBEAT_TIMEOUT = 1.0
+
+
+# Phi accrual failure detector (Hayashibara et al.): phi grows with the time since a peer was
+# last heard from, relative to the distribution of its heartbeat intervals. phi = 8 means the
+# chance that the peer is alive but this late is about 1e-8.
+class PhiAccrualDetector:
+    def __init__(self, threshold=PHI_THRESHOLD):
+        self.threshold = threshold
+        self.intervals = deque(maxlen=WINDOW)
+        self.last_heartbeat = None
+        # Sums of intervals and squared intervals in the window
+        self.total = 0
+        self.total_sq = 0
+
+    def heartbeat(self, t):
+        if self.last_heartbeat is not None:
+            interval = t - self.last_heartbeat
+            if len(self.intervals) == self.intervals.maxlen:
+                old = self.intervals[0]
+                self.total -= old
+                self.total_sq -= old * old
+            self.intervals.append(interval)
+            self.total += interval
+            self.total_sq += interval * interval
+        self.last_heartbeat = t
+
+    # last_seen is when any message from the peer last arrived, which also shows it is alive
+    def lastHeard(self, last_seen=None):
+        if last_seen is None or (self.last_heartbeat is not None and self.last_heartbeat > last_seen):
+            return self.last_heartbeat
+        return last_seen
+
+    def phi(self, t, last_seen=None):
+        last = self.lastHeard(last_seen)
+        if last is None or len(self.intervals) < MIN_SAMPLES:
+            return None
+        n = len(self.intervals)
+        mean = self.total / n + ACCEPTABLE_PAUSE
+        std_dev = max(MIN_STD_DEV, math.sqrt(max(0, self.total_sq / n - (self.total / n) ** 2)))
+        # -log10 of the probability that a heartbeat arrives even later than now
+        p_later = 0.5 * math.erfc((t - last - mean) / (std_dev * math.sqrt(2)))
+        if p_later <= 0:
+            return float('inf')
+        return -math.log10(p_later)
+
+    def suspect(self, t, last_seen=None):
+        phi = self.phi(t, last_seen)
+        if phi is None:
+            # Fixed threshold until the interval distribution is known
+            last = self.lastHeard(last_seen)
+            return last is not None and t - last > HEARTBEAT_TIMEOUT
+        return phi > self.threshold
@@ -0,0 +1,63 @@
+from threading import Lock
+import fnmatch
+import glob
+import os
+
+ALL = 'all'
+
+
+# Names of the datasets in temps/ matching a glob pattern, all of them for "all"
+def findDatasets(pattern=ALL):
+    paths = glob.glob('./temps/temperatures_*.csv')
+    names = sorted(os.path.basename(p)[len('temperatures_'):-len('.csv')] for p in paths)
+    if pattern == ALL:
+        return names
+    return fnmatch.filter(names, pattern)
+
+
+# Prefixes of the virtual producers for datasets: the dataset name itself, then <dataset>1,
+# <dataset>2, ... for further replicas backed by the same dataset
+def producerNames(datasets, replicas=1):
+    return [d if i == 0 else f"{d}{i}" for d in datasets for i in range(replicas)]
+
+
+# Virtual producers served by one node, each with a sensor of every type under its own prefix
+# (e.g. dublin_temp, dublin1_temp). All sensors are updated together by a Sensor.SensorFarm,
+# which is only created on first use since it needs numpy.
+class ProducerFarm:
+    def __init__(self, pattern, replicas, types, interval):
+        datasets = findDatasets(pattern)
+        if not datasets:
+            raise ValueError(f"No datasets in temps/ match {pattern}")
+        self.producers = producerNames(datasets, replicas)
+        self.datasets = [d for d in datasets for i in range(replicas)]
+        self.types = list(types)
+        self.interval = interval
+        # Data name -> (producer index, type index)
+        self.names = {f"{p}_{t}": (i, j) for i, p in enumerate(self.producers) for j, t in enumerate(self.types)}
+        self.sensors = None
+        self.lock = Lock()
+
+    def __contains__(self, data_name):
+        return data_name in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    def prefixes(self):
+        return [p + '_' for p in self.producers]
+
+    def getSensors(self):
+        with self.lock:
+            if self.sensors is None:
+                import Sensor
+                self.sensors = Sensor.SensorFarm(self.datasets, self.types, self.interval)
+            return self.sensors
+
+    # Returns (value, time to use)
+    def getValue(self, data_name):
+        producer, type_index = self.names[data_name]
+        return self.getSensors().getValue(producer, type_index)
+
+    def update(self):
+        self.getSensors().update()
@@ -0,0 +1,259 @@
+from collections import namedtuple
+from multiprocessing import Process, Pipe
+from multiprocessing.connection import Listener, Client
+from threading import Thread
+import CachePolicy
+import Transport
+import logging
+import argparse
+import os
+import sys
+
+CONTROL_PORT = 33000
+AUTHKEY = b'icn-host'
+# Seconds between starting the first node and the rest, so the first can become the network root
+STAGGER = 3
+
+# Control commands
+STATUS = 'status'
+START = 'start'
+STOP = 'stop'
+SHUTDOWN = 'shutdown'
+
+NodeSpec = namedtuple('NodeSpec', ['name', 'port', 'data_n'])
+
+
+# Parses a node given as NAME:PORT[:DATA_N]
+def parseSpec(spec):
+    parts = spec.split(':')
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Invalid node {spec}, expected NAME:PORT[:DATA_N]")
+    data_n = parts[2] if len(parts) == 3 and parts[2] else None
+    return NodeSpec(parts[0], int(parts[1]), data_n)
+
+
+def nodeStatus(node):
+    return {'name': node.name, 'pid': os.getpid(), 'port': node.icn.ip_node.port, 'running': node.running,
+            'peers': list(node.peers), 'data': sorted(node.sensor_types), 'startup_time': node.startup_time}
+
+
+# Runs in each worker process: hosts its share of the nodes on one event loop and serves
+# commands from the host on conn.
+def runWorker(starts, shared, conn, transport, options, logging_level):
+    logging.basicConfig(level=logging_level, format='%(processName)-16s%(levelname)-8s %(message)s', force=True)
+    if shared:
+        import Sensor
+        Sensor.attachDatasets(shared)
+    reactor = Transport.getTransport(transport)
+    nodes = {}
+    for spec, delay in starts:
+        reactor.callLater(delay, startNode, nodes, spec, reactor, options)
+    th = Thread(target=serveWorker, args=(conn, nodes, reactor, options), daemon=True)
+    th.start()
+    reactor.run(installSignalHandlers=0)
+
+
+# options are keyword arguments for Node, e.g. cache_policy or topology. Replies on conn, if
+# given, whether the node was started.
+def startNode(nodes, spec, reactor, options, conn=None):
+    from Node import Node
+    logging.info(f"Starting {spec.name} on port {spec.port}")
+    try:
+        nodes[spec.name] = Node(spec.name, spec.port, spec.data_n, transport=reactor, **options)
+    except Exception as e:
+        logging.error(f"Could not start {spec.name}: {e!r}")
+    if conn is not None:
+        conn.send(spec.name in nodes)
+
+
+# Stops a node, which also closes its trace. Replies on conn, if given, whether it was hosted here.
+def stopNode(nodes, node_name, conn=None):
+    node = nodes.pop(node_name, None)
+    if node is not None:
+        logging.info(f"Stopping {node_name}")
+        node.stop()
+    if conn is not None:
+        conn.send(node is not None)
+
+
+def stopWorker(nodes, reactor, conn):
+    for node_name in list(nodes):
+        stopNode(nodes, node_name)
+    reactor.stop()
+    conn.send(True)
+
+
+# Commands that change the nodes run on the reactor thread, which also sends the reply so the
+# host only hears back once the change has been made
+def serveWorker(conn, nodes, reactor, options):
+    while True:
+        cmd, arg = conn.recv()
+        if cmd == STATUS:
+            conn.send([nodeStatus(n) for n in list(nodes.values())])
+        elif cmd == START:
+            spec, shared = arg
+            if shared:
+                import Sensor
+                Sensor.attachDatasets(shared)
+            reactor.callFromThread(startNode, nodes, spec, reactor, options, conn)
+        elif cmd == STOP:
+            reactor.callFromThread(stopNode, nodes, arg, conn)
+        elif cmd == SHUTDOWN:
+            reactor.callFromThread(stopWorker, nodes, reactor, conn)
+            return
+
+
+# Runs many nodes across a pool of worker processes, one per CPU by default. The historical
+# datasets are loaded once into shared memory and mapped by every worker.
+class Host:
+    def __init__(self, specs, workers=None, transport=None, logging_level=20, stagger=STAGGER, **options):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, len(specs)))
+        self.shared = {}
+        self.shareDatasets([s.data_n for s in specs])
+        self.placement = {}
+        self.pipes = []
+        self.processes = []
+        for i in range(workers):
+            starts = []
+            for j in range(i, len(specs), workers):
+                starts.append((specs[j], 0 if j == 0 else stagger))
+                self.placement[specs[j].name] = i
+            parent, child = Pipe()
+            p = Process(target=runWorker, args=(starts, self.shared, child, transport, options, logging_level),
+                        name=f"icn-worker-{i}", daemon=True)
+            p.start()
+            self.pipes.append(parent)
+            self.processes.append(p)
+
+    # Shares any datasets not shared yet, returns the descriptors of the new ones
+    def shareDatasets(self, names):
+        names = sorted({n for n in names if n is not None and n not in self.shared})
+        if not names:
+            return {}
+        import Sensor
+        shared = Sensor.shareDatasets(names)
+        self.shared.update(shared)
+        return shared
+
+    def command(self, worker, cmd, arg=None):
+        self.pipes[worker].send((cmd, arg))
+        return self.pipes[worker].recv()
+
+    def status(self):
+        status = []
+        for i in range(len(self.pipes)):
+            status += self.command(i, STATUS)
+        return status
+
+    def start(self, spec):
+        if spec.name in self.placement:
+            return False
+        # Place on the worker hosting the fewest nodes
+        loads = [0] * len(self.pipes)
+        for w in self.placement.values():
+            loads[w] += 1
+        worker = loads.index(min(loads))
+        self.placement[spec.name] = worker
+        started = self.command(worker, START, (spec, self.shareDatasets([spec.data_n])))
+        if not started:
+            self.placement.pop(spec.name)
+        return started
+
+    def stop(self, node_name):
+        if node_name not in self.placement:
+            return False
+        return self.command(self.placement.pop(node_name), STOP, node_name)
+
+    # Stops every worker and frees the shared datasets, also if some worker already died
+    def shutdown(self):
+        try:
+            for i, p in enumerate(self.processes):
+                if p.is_alive():
+                    try:
+                        self.command(i, SHUTDOWN)
+                    except (EOFError, OSError) as e:
+                        logging.warning(f"Worker {i} did not confirm shutdown: {e!r}")
+            for p in self.processes:
+                p.join(5)
+        finally:
+            if self.shared:
+                import Sensor
+                Sensor.unlinkDatasets()
+                self.shared = {}
+
+    # Serves control commands until a stop without a node name is received
+    def serve(self, port=CONTROL_PORT, authkey=AUTHKEY):
+        with Listener(('localhost', port), authkey=authkey) as listener:
+            logging.info(f"Control channel on port {port}")
+            while True:
+                with listener.accept() as conn:
+                    cmd, arg = conn.recv()
+                    if cmd == STATUS:
+                        conn.send(self.status())
+                    elif cmd == START:
+                        conn.send(self.start(parseSpec(arg)))
+                    elif cmd == STOP and arg is not None:
+                        conn.send(self.stop(arg))
+                    elif cmd == STOP:
+                        self.shutdown()
+                        conn.send(True)
+                        return
+                    else:
+                        conn.send(f"Unknown command {cmd}")
+
+
+# Sends a single command to a running host and returns its reply
+def control(cmd, arg=None, port=CONTROL_PORT, authkey=AUTHKEY):
+    with Client(('localhost', port), authkey=authkey) as conn:
+        conn.send((cmd, arg))
+        return conn.recv()
+
+
+def main():
+    from Node import PIT_SIZE, REQUEST_RATE, REQUEST_BURST
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--node', help='Node to host as NAME:PORT[:DATA_N], may be repeated', type=str,
+                        action='append', default=[])
+    parser.add_argument('--workers', help='Number of worker processes, defaults to the CPU count', type=int, default=None)
+    parser.add_argument('--control-port', help='Port of the control channel', type=int, default=CONTROL_PORT)
+    parser.add_argument('--control', help='Send a command to a running host: status, start NAME:PORT[:DATA_N], stop [NAME]',
+                        type=str, nargs='+', default=None)
+    parser.add_argument('--transport', help='Transport backend', choices=Transport.BACKENDS, default=Transport.DEFAULT_BACKEND)
+    parser.add_argument('--cache-policy', help='On-path caching policy', choices=list(CachePolicy.POLICIES), default=CachePolicy.LCE)
+    parser.add_argument('--topology', help='Topology file of emulated link delays, losses and bandwidths', type=str, default=None)
+    parser.add_argument('--resolver', help='Nodes take part in the resolver overlay mapping name prefixes to producers', action='store_true')
+    parser.add_argument('--trace-file', help='Record binary event traces, "{name}" is replaced by each node name', type=str, default=None)
+    parser.add_argument('--pit-size', help='Entries of the PIT and locations tables of each node', type=int, default=PIT_SIZE)
+    parser.add_argument('--request-rate', help='Requests each node accepts from another per second', type=float, default=REQUEST_RATE)
+    parser.add_argument('--request-burst', help='Requests each node accepts from another in a burst', type=int, default=REQUEST_BURST)
+    parser.add_argument('--logging-level', help='Logging level: 10 - Debug, 20 - Info, 30 - Warnings', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.control is not None:
+        cmd = args.control[0]
+        arg = args.control[1] if len(args.control) > 1 else None
+        print(control(cmd, arg, args.control_port))
+        return
+
+    if len(args.node) == 0:
+        print("Please specify at least one node")
+        sys.exit(1)
+
+    logging.basicConfig(level=args.logging_level, format='{0:12}%(levelname)-8s %(message)s'.format('host:'))
+    host = Host([parseSpec(s) for s in args.node], args.workers, args.transport, args.logging_level,
+                cache_policy=args.cache_policy, topology=args.topology, trace_file=args.trace_file,
+                resolver=args.resolver, pit_size=args.pit_size, request_rate=args.request_rate,
+                request_burst=args.request_burst)
+    # Also stops the workers and frees the shared datasets if serving fails, e.g. the control port is in use
+    try:
+        host.serve(args.control_port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        host.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,31 @@
 # Dara, Guo, Milan
-from IPNode import IPNode, LOCAL
+from IPNode import IPNode, LOCAL, HIGH, NORMAL, LOW
+import Compression
+import CachePolicy
+import Routing
+import CacheSummary
+import EventTrace
+import FailureDetector
+import Resolver
 import logging
 import json
-from cryptography.fernet import Fernet
+import random
+from time import time
 
 
 HANDSHAKE_TIME_LIMIT = 10
 NO_ADDR = 'NO_ADDRESS'
+KEY = b'5sb7hUkLx4O9eN0eyFT0rVl1TEXJ6C2Gm1FjGFydCBA='
+REQUEST_TTL = 5
+# Cached copies of hot names are refreshed this many seconds before their TTU
+REFRESH_LEAD = 2
+# Time to wait for a refresh
+REFRESH_TTW = 5
+# Seconds a request whose only upstream failed waits for a new peer before failing
+FAILOVER_WAIT = 1
+# Requests accepted from each peer per second, and in a burst
+REQUEST_RATE = 100
+REQUEST_BURST = 200
 
 # Message types
 ANNOUNCE = 'ANNOUNCE'
@@ -15,6 +34,11 @@ REQUEST = 'REQUEST'
 DIR_REQUEST = 'DIRECT_REQUEST'
 FAIL = 'FAIL'
 DATA = 'DATA'
+ADVERTISE = 'ADVERTISE'
+SUMMARY = 'SUMMARY'
+FIND = 'FIND'
+FOUND = 'FOUND'
+REGISTER = 'REGISTER'
 
 # Content values
 DN = 'data_name'
@@ -25,72 +49,141 @@ LOCN = 'location_name'
 TTW = 'time_to_wait'
 PRT = 'port'
 FB = 'fallback'
+CMP = 'compression'
+HOP = 'hops'
+PATH = 'path'
+BTW = 'betweenness'
+MIN_TTU = 'min_time_to_use'
+STALE = 'stale'
+RTS = 'routes'
+NONCE = 'nonce'
+FBS = 'fallbacks'
+LID = 'lookup'
+LKEY = 'key'
+PFX = 'prefix'
+NODES = 'nodes'
+
+# Send priorities when a peer's connection is congested: replies first, so requests already
+# forwarded can complete, new requests last
+PRIORITIES = {DATA: HIGH, FAIL: HIGH, REQUEST: LOW, DIR_REQUEST: LOW}
 
 
 # Represents ICN protocol
 class ICNProtocol:
     def __init__(self, node, node_id, port):
         self.node = node
-        self.ip_node = IPNode(self, node_id, port)
+        self.fernet = None
+        self.ip_node = IPNode(self, node_id, port, node.reactor)
         logging.info("Looking for other nodes")
-        self.ip_node.search(self.sendMsg(ANNOUNCE, None, json.dumps({PRT: self.ip_node.getPort()}), 2))
+        self.ip_node.search(self.getAnnounce())
+        self.node.reactor.callLater(Routing.ADVERTISE_INTERVAL, self.advertise)
+        self.node.reactor.callLater(CacheSummary.SUMMARY_INTERVAL, self.sendSummaries)
+        self.node.reactor.callLater(FailureDetector.HEARTBEAT_INTERVAL, self.heartbeat)
+
+    # Fernet is created on first use so cryptography is not imported until data is exchanged
+    def getFernet(self):
+        if self.fernet is None:
+            from cryptography.fernet import Fernet
+            self.fernet = Fernet(KEY)
+        return self.fernet
 
     def encrypt_data_val(self,data_val):
-        logging.info("Encrypting data")
-        key = b'5sb7hUkLx4O9eN0eyFT0rVl1TEXJ6C2Gm1FjGFydCBA='
-        f = Fernet(key)
+        logging.debug("Encrypting data")
+        f = self.getFernet()
         token = f.encrypt(bytes(str(data_val),'UTF-8'))
         return token.decode("utf-8")
     
     def decrypt_data_val(self,data_val):
-        logging.info("Decrypting data")
-        key = b'5sb7hUkLx4O9eN0eyFT0rVl1TEXJ6C2Gm1FjGFydCBA='
-        f = Fernet(key)
+        logging.debug("Decrypting data")
+        f = self.getFernet()
         token = f.decrypt(bytes(data_val,'UTF-8'))
         return  token.decode("utf-8")    
 
     # Sends a message with format {id:__, msg_type:__, content:__, ttl:__} where id is the sender's
     # name, msg_type is the message type and content could be a piece of data, a location (node name)
-    # for some data, etc. TTL is time to live, i.e. how many hops for a request.
-    def sendMsg(self, msg_type, node_name, content="", ttl=1):
+    # for some data, etc. TTL is time to live, i.e. how many hops for a request. data_name and nonce
+    # are only used for the event trace, so the content need not be decoded again.
+    def sendMsg(self, msg_type, node_name, content="", ttl=1, data_name=None, nonce=None):
         msg = json.dumps({'id': self.node.name, 'type': msg_type, 'content': content, 'ttl': ttl})
-        logging.debug(f"Message: {msg}")
+        # Logged with lazy arguments since this runs for every message
+        logging.debug("Message: %s", msg)
         if node_name is not None:
-            logging.info(f"[Sending message: {msg_type} to {node_name}] ")
-            self.ip_node.sendMsg(msg, node_name)
+            logging.info("[Sending message: %s to %s] ", msg_type, node_name)
+            if self.node.trace is not None:
+                self.node.trace.record(EventTrace.SEND, msg_type, data_name, node_name, len(msg), nonce)
+            self.ip_node.sendMsg(msg, node_name, priority=PRIORITIES.get(msg_type, NORMAL))
         return msg
 
     # Handles a given message. Decides what to do based on the msg_type.
     def handleMsg(self, msg, source=None):
         logging.debug(msg)
+        size = len(msg)
         msg = json.loads(msg)
         msg_type, node_name, content, ttl = msg['type'], msg['id'], msg['content'], msg['ttl']
         c = json.loads(content)
+        if self.node.trace is not None:
+            self.node.trace.record(EventTrace.RECV, msg_type, c.get(DN), node_name, size, c.get(NONCE))
 
         if msg_type == ANNOUNCE:
-            self.handleAnnounce(node_name, c[PRT], source, ttl)
+            self.handleAnnounce(node_name, c[PRT], source, ttl, c.get(CMP))
 
         elif msg_type == ACKNOWLEDGE:
+            if CMP in c and source is not None:
+                source.codec = Compression.negotiate(c[CMP])
             if FB in c:
                 self.handleAcknowledge(node_name, c[PRT], source, ttl, c[FB])
             else:
                 self.handleAcknowledge(node_name, c[PRT], source, ttl)
 
         elif msg_type == REQUEST:
-            logging.info(f"[Request received from {node_name} for {c[DN]}, {ttl}]")
-            self.handleRequest(node_name, c[DN], c[TTW], ttl)
+            logging.info("[Request received from %s for %s, %s]", node_name, c[DN], ttl)
+            if self.rateLimited(node_name, c[DN], source):
+                return
+            self.handleRequest(node_name, c[DN], c[TTW], ttl, c.get(HOP, 1), c.get(BTW, 0), c.get(MIN_TTU, 0), c.get(NONCE))
 
         elif msg_type == FAIL:
             self.handleFail(node_name, c[DN])
 
         elif msg_type == DATA:
-            logging.info(f"[Data received from {node_name} for {c[DN]} : {c[DV]}]")
-            self.handleData(node_name, c[DN], c[DV], c[TTU], c[LOC])
+            logging.info("[Data received from %s for %s : %s]", node_name, c[DN], c[DV])
+            self.handleData(node_name, c[DN], c[DV], c[TTU], c[LOC], True, c.get(HOP), c.get(PATH), c.get(BTW),
+                            c.get(STALE, False))
 
         elif msg_type == DIR_REQUEST:
-            self.handleDirectRequest(node_name, c[DN], c[TTW], c[PRT], source)
+            if self.rateLimited(node_name, c[DN], source):
+                return
+            self.handleDirectRequest(node_name, c[DN], c[TTW], c[PRT], source, c.get(NONCE))
+
+        elif msg_type == ADVERTISE:
+            self.handleAdvertise(node_name, c[RTS], c.get(FBS))
+
+        elif msg_type == SUMMARY:
+            self.handleSummary(node_name, c)
+
+        # Resolver overlay messages, ignored by nodes not taking part
+        elif self.node.resolver is None:
+            return
+
+        elif msg_type == FIND:
+            self.handleFind(node_name, c, source)
+
+        elif msg_type == FOUND:
+            self.handleFound(node_name, c, source)
+
+        elif msg_type == REGISTER:
+            self.handleRegister(node_name, c, source)
+
+    # Over the node's request rate -> reply with fail without looking the request up. The reply
+    # goes back on the request's connection since a direct requester need not be a peer.
+    def rateLimited(self, node_name, data_name, source):
+        if self.node.peers.allowRequest(node_name, self.node.request_rate, self.node.request_burst):
+            return False
+        logging.debug("[Rate limiting requests from %s]", node_name)
+        msg = self.sendMsg(FAIL, None, json.dumps({DN: data_name}), data_name=data_name)
+        self.ip_node.sendMsg(msg, None, source, priority=HIGH)
+        return True
 
-    def handleAnnounce(self, node_name, port, source, ttl):
+    def handleAnnounce(self, node_name, port, source, ttl, codecs=None):
         if node_name == self.node.name:
             logging.info(f"Connection to self - {node_name} to {self.node.name}; disconnecting...")
             source.disconnect()
@@ -104,10 +197,14 @@ class ICNProtocol:
         logging.info(f"[Announcement received from {node_name}]")
         self.ip_node.addNodeAddr(node_name, port, None, source)
         self.node.reactor.callLater(HANDSHAKE_TIME_LIMIT, self.ip_node.verifyPeer, node_name)
-        content = json.dumps({PRT: self.ip_node.getPort(), FB: self.ip_node.getFallback()})
+        # Pick a codec from the ones offered, the announcer confirms it in its own acknowledgement
+        content = json.dumps({PRT: self.ip_node.getPort(), FB: self.ip_node.getFallback(),
+                              CMP: Compression.negotiate(codecs)})
         self.sendMsg(ACKNOWLEDGE, node_name, content, ttl)
+        self.recordStartup()
 
     def handleAcknowledge(self, node_name, port, source, ttl, fallback=None):
+        self.recordStartup()
         if fallback is not None:
             logging.debug(f"Updating fallback for {node_name}")
             self.ip_node.updateFallback(node_name, fallback)
@@ -118,42 +215,85 @@ class ICNProtocol:
         self.ip_node.addNodeAddr(node_name, port, None, source)
         self.ip_node.addNodeConnection(node_name, source)
         self.node.addPeer(node_name)
+        self.resendOrphaned()
+        if self.node.resolver is not None:
+            self.joinResolver(node_name)
         if fb is not None:
             ttl -= 1
             self.sendFallback(node_name, fb)
         elif ttl > 1:
             ttl -= 1
-            content = json.dumps({PRT: self.ip_node.getPort(), FB: self.ip_node.getFallback()})
+            content = json.dumps({PRT: self.ip_node.getPort(), FB: self.ip_node.getFallback(), CMP: source.codec})
             self.sendMsg(ACKNOWLEDGE, node_name, content, ttl)
+        # Sent after the acknowledgement that makes this node a peer at the other end, which drops
+        # advertisements and summaries from nodes that are not its peers
+        self.sendAdvertisement(node_name)
+        self.sendMsg(SUMMARY, node_name, json.dumps(self.node.cache_summary.full()))
 
-    def handleRequest(self, node_name, data_name, ttw, ttl):
+    # hops is the number of links the request has travelled and btw the highest centrality of
+    # the relays on its path, both echoed in the DATA reply for the on-path caching policy.
+    # Refreshes set min_ttu so that only copies fresher than the one being refreshed answer them.
+    # The nonce, chosen by the requester, identifies copies of the same request on different paths.
+    def handleRequest(self, node_name, data_name, ttw, ttl, hops=1, btw=0, min_ttu=0, nonce=None):
         ttl -= 1
+        # Copy of a request already seen -> it looped, reply with fail so the sender's PIT count drops
+        if nonce is not None:
+            if self.node.seenNonce(data_name, nonce):
+                logging.debug("[Dropping looped request from %s for %s]", node_name, data_name)
+                self.sendMsg(FAIL, node_name, json.dumps({DN: data_name}), data_name=data_name)
+                return
+            self.node.addNonce(data_name, nonce)
+        self.node.recordRequest(data_name)
         # Has data -> reply with data
         if self.node.hasData(data_name):
             data_val, ttu = self.node.getData(data_name)
             data_val=self.encrypt_data_val(data_val)
-            content = json.dumps({DN: data_name, DV: data_val, TTU: ttu, LOC: NO_ADDR})
-            self.sendMsg(DATA, node_name, content)
+            content = json.dumps({DN: data_name, DV: data_val, TTU: ttu, LOC: NO_ADDR, HOP: 1, PATH: hops, BTW: btw})
+            self.traceEvent(EventTrace.PRODUCE, data_name, node_name, nonce)
+            self.sendMsg(DATA, node_name, content, data_name=data_name)
             return
-        elif self.node.hasCache(data_name):
+        elif self.node.hasCache(data_name) and self.node.getCache(data_name)[1] > min_ttu:
             data_val, ttu = self.node.getCache(data_name)
-            content = json.dumps({DN: data_name, DV: data_val, TTU: ttu, LOC: NO_ADDR})
-            self.sendMsg(DATA, node_name, content)
+            self.traceEvent(EventTrace.HIT, data_name, node_name, nonce)
+            content = json.dumps({DN: data_name, DV: data_val, TTU: ttu, LOC: NO_ADDR, HOP: 1, PATH: hops, BTW: btw})
+            self.sendMsg(DATA, node_name, content, data_name=data_name)
+            return
+        # Expired copy of a name being refreshed -> reply with the copy flagged as stale
+        elif min_ttu == 0 and self.node.getStale(data_name) is not None and self.refreshData(data_name):
+            data_val, ttu = self.node.getStale(data_name)
+            logging.info("[Serving stale %s to %s]", data_name, node_name)
+            self.traceEvent(EventTrace.STALE_HIT, data_name, node_name, nonce)
+            content = json.dumps({DN: data_name, DV: data_val, TTU: ttu, LOC: NO_ADDR, HOP: 1, PATH: hops, BTW: btw,
+                                  STALE: True})
+            self.sendMsg(DATA, node_name, content, data_name=data_name)
             return
         # Time to live has run out -> reply with fail
         elif ttl == 0:
             content = json.dumps({DN: data_name})
-            self.sendMsg(FAIL, node_name, content)
-        # Data name already in PIT -> do nothing
+            self.sendMsg(FAIL, node_name, content, data_name=data_name)
+        # Data name already in PIT -> wait for the data, also on behalf of this requester if it is
+        # not the one the entry was made for
         elif self.node.hasPITEntry(data_name):
+            if self.node.getPITDest(data_name) != node_name:
+                self.node.addPITRequester(data_name, node_name, ttw)
             return
         else:
             # Propagate request
             self.node.addToPIT(data_name, node_name, ttw)
-            content = json.dumps({DN: data_name, TTW: ttw})
+            btw = max(btw, CachePolicy.centrality(self.node))
+            content = json.dumps({DN: data_name, TTW: ttw, HOP: hops + 1, BTW: btw, MIN_TTU: min_ttu, NONCE: nonce})
+            route = self.node.getRoute(data_name)
+            # Refreshes need a copy fresher than the cached ones, so they are not sent to caches
+            cache_peer = self.node.getCachePeer(data_name, node_name) if min_ttu == 0 else None
             if self.node.hasLocation(data_name) and self.node.getLocation(data_name) in self.node.peers:
                 # Send to guaranteed node
-                self.sendMsg(REQUEST, self.node.getLocation(data_name), content, ttl)
+                self.sendRequest(self.node.getLocation(data_name), data_name, content, ttl, ttw, nonce)
+            elif cache_peer is not None:
+                # A peer's cache summary indicates it holds a copy
+                self.sendRequest(cache_peer, data_name, content, ttl, ttw, nonce)
+            elif route is not None and route.next_hop != node_name:
+                # Follow the route advertised for the name's prefix
+                self.sendRequest(route.next_hop, data_name, content, ttl, ttw, nonce)
             else:
                 # Send to all other peers
                 count = 1
@@ -162,9 +302,9 @@ class ICNProtocol:
                         continue
                     self.node.addToPIT(data_name, node_name, ttw, count)
                     count += 1
-                    self.sendMsg(REQUEST, n, content, ttl)
+                    self.sendRequest(n, data_name, content, ttl, ttw, nonce)
                 if count == 1:
-                    self.sendMsg(FAIL, node_name, content)
+                    self.sendMsg(FAIL, node_name, json.dumps({DN: data_name}), data_name=data_name)
 
     def handleFail(self, node_name, data_name):
         # Remove count of item from PIT
@@ -172,53 +312,223 @@ class ICNProtocol:
         # Data not in PIT -> do nothing
         if dest is None:
             return
-        logging.info(f"[Fail from {node_name} for {data_name}]")
+        logging.info("[Fail from %s for %s]", node_name, data_name)
+        upstream = self.node.getPITUpstream(data_name)
+        if r == 0:
+            self.node.removePITUpstream(data_name)
+        elif upstream is not None:
+            upstream[0].discard(node_name)
+        if r == 0:
+            for n in self.node.popPITRequesters(data_name):
+                self.sendMsg(FAIL, n, json.dumps({DN: data_name}), data_name=data_name)
         # If final count of item has been removed from PIT -> forward FAIL to destination
         if r == 0 and dest != self.node.name:
             content = json.dumps({DN: data_name})
-            self.sendMsg(FAIL, dest, content)
+            self.sendMsg(FAIL, dest, content, data_name=data_name)
         # If final count of item has been removed AND this node is the destination -> Data not found
+        elif r == 0 and dest == self.node.name and data_name in self.node.refreshing:
+            logging.info("[Refresh of %s failed]", data_name)
+            self.endRefresh(data_name)
         elif r == 0 and dest == self.node.name:
-            logging.warning(f"Data for {data_name} could not be found on network")
+            logging.warning("Data for %s could not be found on network", data_name)
+            self.traceEvent(EventTrace.FAILED, data_name, node_name)
             self.node.removeLocation(data_name)
+            if self.node.resolver is not None:
+                self.node.resolver.uncacheLocation(Routing.namePrefix(data_name))
+            self.node.dataFailed(data_name)
 
-    def handleData(self, node_name, data_name, data_val, ttu, location, dec=True):
+    def handleData(self, node_name, data_name, data_val, ttu, location, dec=True, hops=None, path=None, btw=None,
+                   stale=False):
         dest, r = self.node.removeFromPIT(data_name)
         # Data not in PIT -> do nothing
         if dest is None:
             return
+        self.node.removePITUpstream(data_name)
+        self.node.orphaned.pop(data_name, None)
+        # Other nodes whose requests were aggregated on the PIT entry get the data as well
+        for n in self.node.popPITRequesters(data_name):
+            if n != dest and n != self.node.name:
+                self.forwardData(n, node_name, data_name, data_val, ttu, location, hops, path, btw, stale)
+        # Refresh of a cached hot name -> recache and schedule the next refresh
+        if dest == self.node.name and data_name in self.node.refreshing:
+            upstream = self.node.upstream.get(data_name, node_name)
+            self.endRefresh(data_name)
+            self.node.cacheData(data_name, data_val, ttu)
+            self.scheduleRefresh(data_name, ttu, upstream)
         # Data in PIT, requested by this node -> update location for data & use data
-        if dest == self.node.name:
+        elif dest == self.node.name:
+            if stale:
+                logging.info("[Received stale copy of %s, expired at %s]", data_name, ttu)
             location = self.updateMessageLocation(node_name, location)
             self.addLocation(data_name, location)
             if dec:
                 data_val = self.decrypt_data_val(data_val)
-            self.node.useData(data_name, data_val)
-        # Data in PIT, requested by other node -> forward data + cache data
+            self.traceEvent(EventTrace.DELIVER, data_name, node_name)
+            self.node.useData(data_name, data_val, stale)
+        # Data in PIT, requested by other node -> forward data + cache data if the policy admits it
         else:
-            location = self.updateMessageLocation(node_name, location)
-            content = json.dumps({DN: data_name, DV: data_val, TTU: ttu, LOC: location})
-            self.sendMsg(DATA, dest, content)
-            self.node.cacheData(data_name, data_val, ttu)
+            self.forwardData(dest, node_name, data_name, data_val, ttu, location, hops, path, btw, stale)
+            if not stale and self.node.cache_policy.admit(self.node, data_name, hops, path, btw):
+                self.node.cacheData(data_name, data_val, ttu)
+                self.scheduleRefresh(data_name, ttu, node_name)
         if node_name not in self.node.peers:
             self.ip_node.removePeer(node_name)
 
-    def handleDirectRequest(self, node_name, data_name, ttw, port, source):
-        logging.info(f"[Direct Request received from {node_name}]")
+    # Forwards DATA received from node_name on to dest
+    def forwardData(self, dest, node_name, data_name, data_val, ttu, location, hops, path, btw, stale):
+        location = self.updateMessageLocation(node_name, location)
+        next_hops = hops + 1 if hops is not None else None
+        content = json.dumps({DN: data_name, DV: data_val, TTU: ttu, LOC: location, HOP: next_hops, PATH: path, BTW: btw,
+                              STALE: stale})
+        self.sendMsg(DATA, dest, content, data_name=data_name)
+
+    def handleDirectRequest(self, node_name, data_name, ttw, port, source, nonce=None):
+        logging.info("[Direct Request received from %s for %s]", node_name, data_name)
         self.ip_node.addNodeAddr(node_name, port, None, source)
         content = json.dumps({PRT: self.ip_node.getPort()})
 
         if self.node.hasData(data_name):
             data_val, ttu = self.node.getData(data_name)
             data_val=self.encrypt_data_val(data_val)
-            content = json.dumps({DN: data_name, DV: data_val, TTU: ttu, LOC: None})
-            self.sendMsg(DATA, node_name, content)
+            self.traceEvent(EventTrace.PRODUCE, data_name, node_name, nonce)
+            content = json.dumps({DN: data_name, DV: data_val, TTU: ttu, LOC: None, HOP: 1, PATH: 1, BTW: 0})
+            self.sendMsg(DATA, node_name, content, data_name=data_name)
         else:
             content = json.dumps({DN: data_name})
-            self.sendMsg(FAIL, node_name, content)
+            self.sendMsg(FAIL, node_name, content, data_name=data_name)
         if node_name not in self.node.peers:
             self.node.reactor.callLater(HANDSHAKE_TIME_LIMIT, self.ip_node.removePeer, node_name)
 
+    # Schedules a refresh of a cached hot name shortly before it expires, replacing the refresh
+    # scheduled for an older copy
+    def scheduleRefresh(self, data_name, ttu, upstream):
+        call = self.node.refresh_calls.pop(data_name, None)
+        if call is not None:
+            call.cancel()
+        if not self.node.isHot(data_name):
+            self.node.upstream.pop(data_name, None)
+            return
+        self.node.upstream[data_name] = upstream
+        self.node.refresh_calls[data_name] = self.node.reactor.callLater(max(0, ttu - time() - REFRESH_LEAD),
+                                                                         self.refreshDue, data_name)
+
+    # Calls still in refresh_calls have not run yet, so they can always be cancelled
+    def refreshDue(self, data_name):
+        self.node.refresh_calls.pop(data_name, None)
+        self.refreshData(data_name)
+
+    # Requests a fresher copy of a cached name from upstream unless it is no longer hot. Returns
+    # True if a refresh is in flight.
+    def refreshData(self, data_name):
+        if data_name in self.node.refreshing:
+            return True
+        if not self.node.isHot(data_name) or self.node.hasPITEntry(data_name):
+            return False
+        upstream = self.node.upstream.get(data_name)
+        if self.node.hasLocation(data_name) and self.node.getLocation(data_name) in self.node.peers:
+            upstream = self.node.getLocation(data_name)
+        if upstream not in self.node.peers:
+            return False
+        logging.info("[Refreshing %s from %s]", data_name, upstream)
+        ttw = time() + REFRESH_TTW
+        min_ttu = time()
+        if self.node.hasCache(data_name):
+            min_ttu = self.node.getCache(data_name)[1]
+        self.node.refreshing.add(data_name)
+        self.node.addToPIT(data_name, self.node.name, ttw)
+        self.node.reactor.callLater(REFRESH_TTW, self.endRefresh, data_name)
+        nonce = self.newNonce(data_name)
+        content = json.dumps({DN: data_name, TTW: ttw, HOP: 1, BTW: 0, MIN_TTU: min_ttu, NONCE: nonce})
+        self.sendRequest(upstream, data_name, content, REQUEST_TTL, ttw, nonce)
+        return True
+
+    # Startup time is measured until the first ACKNOWLEDGE is sent or received, i.e. until another
+    # node has answered or been answered, whichever end of the handshake this node is on
+    def recordStartup(self):
+        if self.node.startup_time is None:
+            self.node.startup_time = time() - self.node.start_time
+            logging.info(f"Time to first ACKNOWLEDGE: {self.node.startup_time * 1000:.1f} ms")
+
+    def traceEvent(self, event, data_name, node_name, nonce=None):
+        if self.node.trace is not None:
+            self.node.trace.record(event, None, data_name, node_name, 0, nonce)
+
+    # Forwards a request for a PIT entry, remembering where it went in case that peer fails
+    def sendRequest(self, node_name, data_name, content, ttl, ttw, nonce=None):
+        self.node.addPITUpstream(data_name, node_name, content, ttl, ttw)
+        self.sendMsg(REQUEST, node_name, content, ttl, data_name, nonce)
+
+    # Sends the pending requests that were only waiting on node_name, which failed, along another
+    # path, or once a new peer connects
+    def reroutePending(self, node_name):
+        for data_name in self.node.getPendingVia(node_name):
+            peers, content, ttl = self.node.getPITUpstream(data_name)
+            if len(peers) > 1:
+                # Other peers the request was flooded to may still answer
+                self.handleFail(node_name, data_name)
+                continue
+            self.node.removePITUpstream(data_name)
+            if self.node.hasPITEntry(data_name) and not self.resendRequest(data_name, content, ttl):
+                # Wait briefly for the failed peer's fallbacks to connect before giving up
+                self.node.orphaned[data_name] = (content, ttl)
+                self.node.reactor.callLater(FAILOVER_WAIT, self.failOrphaned, data_name, node_name)
+
+    # Sends a PIT entry's request again on the best path available, with a fresh nonce since nodes
+    # on the new path may have seen the old one. Returns whether there was a path.
+    def resendRequest(self, data_name, content, ttl):
+        dest, ttw = self.node.getPITEntry(data_name)
+        c = json.loads(content)
+        c[NONCE] = self.newNonce(data_name)
+        content = json.dumps(c)
+        route = self.node.getRoute(data_name)
+        cache_peer = self.node.getCachePeer(data_name, dest) if c.get(MIN_TTU, 0) == 0 else None
+        if route is not None and route.next_hop != dest:
+            next_hops = [route.next_hop]
+        elif cache_peer is not None:
+            next_hops = [cache_peer]
+        else:
+            next_hops = [n for n in self.node.peers if n != dest]
+        if not next_hops:
+            return False
+        logging.info("[Rerouting %s to %s]", data_name, next_hops)
+        self.node.addToPIT(data_name, dest, ttw, len(next_hops))
+        for n in next_hops:
+            self.sendRequest(n, data_name, content, ttl, ttw, c[NONCE])
+        return True
+
+    def resendOrphaned(self):
+        for data_name, (content, ttl) in list(self.node.orphaned.items()):
+            if not self.node.hasPITEntry(data_name) or self.resendRequest(data_name, content, ttl):
+                self.node.orphaned.pop(data_name)
+
+    def failOrphaned(self, data_name, node_name):
+        if self.node.orphaned.pop(data_name, None) is not None:
+            self.handleFail(node_name, data_name)
+
+    # Periodically sends every peer a heartbeat and fails over from peers the failure detector
+    # suspects, without waiting for TCP to notice
+    def heartbeat(self):
+        if not self.node.running:
+            return
+        t = time()
+        for n in self.node.peers:
+            if self.node.peers.suspect(n, t):
+                logging.warning("%s suspected to have failed, failing over", n)
+                self.ip_node.peerFailed(n)
+            else:
+                # A prebuilt frame sent without logging since this runs many times per second
+                self.ip_node.sendHeartbeat(n)
+        self.node.reactor.callLater(FailureDetector.HEARTBEAT_INTERVAL, self.heartbeat)
+
+    # Nonce for a request made by this node, remembered so the request is dropped if it loops back
+    def newNonce(self, data_name):
+        nonce = random.getrandbits(32)
+        self.node.addNonce(data_name, nonce)
+        return nonce
+
+    def endRefresh(self, data_name):
+        self.node.refreshing.discard(data_name)
+
     def addLocation(self, data_name, location):
         if location is not None and location != NO_ADDR:
             host, port, node_name = location.split(':')
@@ -244,42 +554,260 @@ class ICNProtocol:
             return f"{host}:{port}:{name}"
         return location
 
-    def requestData(self, data_name, ttw, ttl=5):
+    def requestData(self, data_name, ttw, ttl=REQUEST_TTL):
+        # A request from this node takes over a refresh in flight so the data is used when it arrives
+        self.endRefresh(data_name)
         # Add data to PIT
         self.node.addToPIT(data_name, self.node.name, ttw)
+        nonce = self.newNonce(data_name)
+        self.traceEvent(EventTrace.ISSUE, data_name, None, nonce)
         # If this node contains data, handle it
         if self.node.hasData(data_name):
             data_val, ttu = self.node.getData(data_name)
             self.handleData(self.node.name, data_name, data_val, ttu, self.ip_node.getPeerAddr(self.node.name), False)
+        # If this node knows location of data and it is a peer, request from it
+        elif self.node.hasLocation(data_name) and self.node.getLocation(data_name) in self.node.peers:
+            content = json.dumps({DN: data_name, TTW: ttw, HOP: 1, BTW: 0, NONCE: nonce})
+            self.sendRequest(self.node.getLocation(data_name), data_name, content, 1, ttw, nonce)
+        # If a peer's cache summary indicates it holds a copy, request from it
+        elif self.node.getCachePeer(data_name) is not None:
+            content = json.dumps({DN: data_name, TTW: ttw, HOP: 1, BTW: 0, NONCE: nonce})
+            self.sendRequest(self.node.getCachePeer(data_name), data_name, content, ttl, ttw, nonce)
+        # If the resolver overlay is used, look up the producer and request from it directly. This
+        # deliberately comes before the routes: it reaches the producer in one hop, and the routes
+        # are still followed if no producer is registered for the prefix.
+        elif self.node.resolver is not None and len(self.node.peers) > 0:
+            self.resolveData(data_name, ttw, ttl, nonce)
+        # If a producer advertised a prefix of the name, follow the route to it
+        elif self.node.getRoute(data_name) is not None:
+            self.followRoute(data_name, self.node.getRoute(data_name), ttw, ttl, nonce)
         # If this node knows location of data, request directly
         elif self.node.hasLocation(data_name):
-            node_name = self.node.getLocation(data_name)
-            if node_name in self.node.peers:
-                content = json.dumps({DN: data_name, TTW: ttw})
-                self.sendMsg(REQUEST, node_name, content, 1)
-            else:
-                content = json.dumps({DN: data_name, TTW: ttw, PRT: self.ip_node.getPort()})
-                self.sendMsg(DIR_REQUEST, self.node.getLocation(data_name), content, ttl)
+            content = json.dumps({DN: data_name, TTW: ttw, PRT: self.ip_node.getPort(), NONCE: nonce})
+            self.sendMsg(DIR_REQUEST, self.node.getLocation(data_name), content, ttl, data_name, nonce)
         # If this node has no peers, search for peers
         elif len(self.node.peers) < 1:
-            logging.warning(f"{self.node.name} has no peers for data request.")
-            self.handleFail(FAIL, self.node.name, data_name)
+            logging.warning("%s has no peers for data request.", self.node.name)
+            self.handleFail(self.node.name, data_name)
             # Search
-            self.ip_node.search()
+            self.ip_node.search(self.getAnnounce())
         # Otherwise send requests to all peers
         else:
-            content = json.dumps({DN: data_name, TTW: ttw})
-            count = 1
+            self.floodRequest(data_name, ttw, ttl, nonce)
+
+    def followRoute(self, data_name, route, ttw, ttl, nonce):
+        content = json.dumps({DN: data_name, TTW: ttw, HOP: 1, BTW: 0, NONCE: nonce})
+        self.sendRequest(route.next_hop, data_name, content, max(ttl, route.cost + 1), ttw, nonce)
+
+    def floodRequest(self, data_name, ttw, ttl, nonce):
+        content = json.dumps({DN: data_name, TTW: ttw, HOP: 1, BTW: 0, NONCE: nonce})
+        count = 1
+        for n in self.node.peers:
+            if n == self.node.name:
+                continue
+            self.node.addToPIT(data_name, self.node.name, ttw, count)
+            count += 1
+            self.sendRequest(n, data_name, content, ttl, ttw, nonce)
+
+    # Resolver overlay, see Resolver.py
+
+    def resolveData(self, data_name, ttw, ttl, nonce):
+        prefix = Routing.namePrefix(data_name)
+        location = self.node.resolver.getLocation(prefix)
+        if location is not None:
+            self.resolved(location, data_name, ttw, ttl, nonce)
+            return
+        self.lookup(Resolver.ringId(prefix), prefix, self.producerFound, data_name, ttw, ttl, nonce)
+
+    # Remembers the producer a lookup found, so further names under the prefix need no lookup
+    def producerFound(self, location, data_name, ttw, ttl, nonce, closest=None):
+        if location is not None:
+            self.node.resolver.cacheLocation(Routing.namePrefix(data_name), location)
+        self.resolved(location, data_name, ttw, ttl, nonce)
+
+    # Requests data from the producer found, or follows a route or floods the request if no
+    # producer is registered
+    def resolved(self, location, data_name, ttw, ttl, nonce):
+        if not self.node.hasPITEntry(data_name):
+            return
+        if location is None or location.split(':')[2] == self.node.name:
+            route = self.node.getRoute(data_name)
+            if route is not None:
+                self.followRoute(data_name, route, ttw, ttl, nonce)
+            else:
+                logging.info("[No producer registered for %s, flooding request]", data_name)
+                self.floodRequest(data_name, ttw, ttl, nonce)
+            return
+        self.addLocation(data_name, location)
+        content = json.dumps({DN: data_name, TTW: ttw, PRT: self.ip_node.getPort(), NONCE: nonce})
+        self.sendMsg(DIR_REQUEST, self.node.getLocation(data_name), content, ttl, data_name, nonce)
+
+    # Starts an iterative lookup of the nodes closest to key, and of the location registered for
+    # prefix unless it is None. Calls callback(location or None, *args, closest=closest nodes found).
+    def lookup(self, key, prefix, callback, *args):
+        lookup = self.node.resolver.newLookup(key, prefix, (callback, args))
+        self.queryLookup(lookup)
+
+    def queryLookup(self, lookup):
+        if lookup.finished():
+            self.finishLookup(lookup, None)
+            return
+        msg = self.sendMsg(FIND, None, json.dumps({LID: lookup.lid, LKEY: lookup.key, PFX: lookup.prefix,
+                                                   PRT: self.ip_node.getPort()}))
+        for n, addr in lookup.next():
+            self.ip_node.sendDirect(msg, addr, self.findConnected, lookup.lid, n)
+            self.node.reactor.callLater(Resolver.LOOKUP_TIMEOUT, self.lookupFailed, lookup.lid, n)
+
+    def findConnected(self, prot, lid, node_name):
+        if prot is None:
+            self.lookupFailed(lid, node_name)
+            return
+        lookup = self.node.resolver.lookups.get(lid)
+        if lookup is not None and node_name in lookup.pending:
+            lookup.connections[node_name] = prot
+        else:
+            # Connected after the query timed out
+            prot.disconnect()
+
+    def lookupFailed(self, lid, node_name):
+        lookup = self.node.resolver.lookups.get(lid)
+        if lookup is None or node_name not in lookup.pending:
+            return
+        logging.debug("[Lookup query to %s failed]", node_name)
+        prot = lookup.connections.get(node_name)
+        if prot is not None:
+            prot.disconnect()
+        lookup.remove(node_name)
+        self.node.resolver.contacts.remove(node_name)
+        self.queryLookup(lookup)
+
+    def finishLookup(self, lookup, location):
+        self.node.resolver.lookups.pop(lookup.lid, None)
+        logging.debug(f"[Lookup of {lookup.prefix or lookup.key} done after {lookup.queries} queries: {location}]")
+        callback, args = lookup.callback
+        callback(location, *args, closest=lookup.closest())
+
+    def handleFind(self, node_name, c, source):
+        resolver = self.node.resolver
+        resolver.contacts.add(node_name, f"{source.transport.getPeer().host}:{c[PRT]}")
+        location = resolver.getRecord(c[PFX]) if c[PFX] is not None else None
+        nodes = [[n, addr] for n, addr in resolver.contacts.closest(c[LKEY], Resolver.K + 1) if n != node_name]
+        content = json.dumps({LID: c[LID], LOC: location, NODES: nodes[:Resolver.K]})
+        self.ip_node.sendMsg(self.sendMsg(FOUND, None, content), None, source)
+        # The querying node closes the connection once answered or timed out. It is also closed
+        # here in case that node is gone, after the same timeout so the reply is not cut off on a
+        # paused or emulated link.
+        if source.peer_name is None:
+            self.node.reactor.callLater(Resolver.LOOKUP_TIMEOUT, self.closeTransient, source)
+
+    def closeTransient(self, source):
+        if source.connected:
+            source.disconnect()
+
+    def handleFound(self, node_name, c, source):
+        if source is not None and source.transient:
+            source.disconnect()
+        lookup = self.node.resolver.lookups.get(c[LID])
+        if lookup is None or node_name not in lookup.pending:
+            return
+        lookup.pending.discard(node_name)
+        lookup.connections.pop(node_name, None)
+        via = lookup.shortlist.get(node_name)
+        self.node.resolver.contacts.add(node_name, via)
+        nodes = [(n, self.ip_node.translateAddr(node_name, addr, via)) for n, addr in c[NODES] if n != self.node.name]
+        for n, addr in nodes:
+            self.node.resolver.contacts.add(n, addr)
+        if c[LOC] is not None and lookup.prefix is not None:
+            self.finishLookup(lookup, self.ip_node.translateAddr(node_name, c[LOC], via))
+            return
+        lookup.add(nodes)
+        self.queryLookup(lookup)
+
+    # Learns a new peer as a contact. The first one lets this node join the overlay: a lookup of
+    # its own id finds the nodes around it, then its prefixes are registered.
+    def joinResolver(self, node_name):
+        resolver = self.node.resolver
+        resolver.contacts.add(node_name, self.ip_node.getPeerAddr(node_name))
+        if not resolver.joined:
+            resolver.joined = True
+            self.lookup(resolver.contacts.id, None, self.registerPrefixes)
+
+    # Registers this node's prefixes on the nodes closest to each, repeated while it runs
+    def registerPrefixes(self, location=None, closest=None):
+        if not self.node.running:
+            return
+        for prefix in self.node.getPrefixes():
+            self.lookup(Resolver.ringId(prefix), None, self.register, prefix)
+        self.node.reactor.callLater(Resolver.REGISTER_INTERVAL, self.registerPrefixes)
+
+    def register(self, location, prefix, closest=None):
+        key = Resolver.ringId(prefix)
+        # This node may be one of the closest itself
+        candidates = sorted(closest + [(self.node.name, None)], key=lambda c: Resolver.ringId(c[0]) ^ key)
+        content = json.dumps({PFX: prefix, PRT: self.ip_node.getPort(), TTU: Resolver.RECORD_TTL})
+        for n, addr in candidates[:Resolver.REPLICAS]:
+            if addr is None:
+                self.node.resolver.addRecord(prefix, f"{self.ip_node.addr}:{self.ip_node.port}:{self.node.name}")
+            else:
+                self.ip_node.sendDirect(self.sendMsg(REGISTER, None, content), addr)
+
+    def handleRegister(self, node_name, c, source):
+        host = source.transport.getPeer().host
+        self.node.resolver.addRecord(c[PFX], f"{host}:{c[PRT]}:{node_name}", c[TTU])
+        self.node.resolver.contacts.add(node_name, f"{host}:{c[PRT]}")
+        if source.peer_name is None:
+            source.disconnect()
+
+    def handleAdvertise(self, node_name, routes, fallbacks=None):
+        if node_name not in self.node.peers:
+            return
+        if fallbacks is not None:
+            self.ip_node.updateFallbacks(node_name, fallbacks)
+        changed = False
+        for prefix, origin, seq, cost in routes:
+            if self.node.routes.update(prefix, origin, seq, cost + 1, node_name):
+                changed = True
+        # Triggered update so new routes spread without waiting for the next period
+        if changed:
+            logging.debug("Routes updated from %s: %s", node_name, self.node.routes)
+            for n in self.node.peers:
+                self.sendAdvertisement(n)
+
+    # Periodically advertises this node's prefixes, with a new sequence number, and its routes
+    def advertise(self):
+        if not self.node.running:
+            return
+        self.node.routes.seq += 1
+        for n in self.node.peers:
+            self.sendAdvertisement(n)
+        self.node.reactor.callLater(Routing.ADVERTISE_INTERVAL, self.advertise)
+
+    def sendAdvertisement(self, node_name):
+        routes = self.node.routes.advertisement(node_name, self.node.getPrefixes())
+        # Also tells the peer where to reconnect should this node fail
+        self.sendMsg(ADVERTISE, node_name, json.dumps({RTS: routes, FBS: self.ip_node.getFallbacks(node_name)}))
+
+    def handleSummary(self, node_name, content):
+        if node_name not in self.node.peers:
+            return
+        self.node.updatePeerSummary(node_name, content)
+
+    # Periodically sends peers the changes to this node's cache summary, or the full summary
+    # every CacheSummary.FULL_EVERY periods so peers that missed an update catch up
+    def sendSummaries(self):
+        if not self.node.running:
+            return
+        update = self.node.getSummaryUpdate()
+        if update is not None:
+            content = json.dumps(update)
             for n in self.node.peers:
-                if n == self.node.name:
-                    continue
-                self.node.addToPIT(data_name, self.node.name, ttw, count)
-                count += 1
-                self.sendMsg(REQUEST, n, content, ttl)
+                self.sendMsg(SUMMARY, n, content)
+        self.node.reactor.callLater(CacheSummary.SUMMARY_INTERVAL, self.sendSummaries)
 
     def getAnnounce(self):
-        return self.sendMsg(ANNOUNCE, None, json.dumps({PRT: self.ip_node.getPort()}), 2)
+        return self.sendMsg(ANNOUNCE, None, json.dumps({PRT: self.ip_node.getPort(), CMP: Compression.CODECS}), 2)
 
     def sendFallback(self, node_name, addr):
-        content = json.dumps({PRT: self.ip_node.getPort(), FB: self.ip_node.getFallback()})
+        content = json.dumps({PRT: self.ip_node.getPort(), FB: self.ip_node.getFallback(),
+                              CMP: self.ip_node.getCodec(node_name)})
         self.sendMsg(ACKNOWLEDGE, node_name, content, 1)
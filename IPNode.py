@@ -1,12 +1,10 @@
 # Dara, Milan
 
-from twisted.internet.protocol import Protocol, Factory
-from twisted.internet.endpoints import TCP4ServerEndpoint
-from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
-from twisted.internet import reactor
-from twisted.internet.error import ConnectionRefusedError
+from collections import deque
+import Compression
 import logging
 import random
+import struct
 
 LOCAL = ['localhost', '127.0.0.1']
 
@@ -19,28 +17,156 @@ NETWORKS = ["localhost", "127.0.0.1"]
 MIN_PORT = 33010
 MAX_PORT = 33016
 
-
-# Represents a connection (could be client -> server or server -> client)
-class NodeProtocol(Protocol):
+# Fallbacks announced to in parallel when a peer fails, and the most kept per peer
+FAILOVER_PARALLEL = 2
+MAX_FALLBACKS = 4
+
+# Every message is sent as a frame prefixed by its length, since TCP may merge or split writes
+FRAME_HEADER = struct.Struct('>I')
+# Longest frame accepted, a peer announcing a longer one is disconnected rather than buffered
+MAX_FRAME = 1 << 20
+# Heartbeat frames are this marker followed by the sender's name, so they need no JSON encoding
+# or decoding. JSON frames never start with it, nor do compressed ones (Compression.FRAME_MARKER).
+HEARTBEAT_MARKER = b'\x01'
+
+# Send priorities, lower first
+HIGH = 0
+NORMAL = 1
+LOW = 2
+# Frames queued per connection while the transport is paused, beyond this the lowest priority go
+MAX_QUEUE = 256
+
+
+# Bounded queue of frames waiting for a paused transport, served in priority order and FIFO
+# within a priority
+class SendQueue:
+    def __init__(self, size=MAX_QUEUE):
+        self.size = size
+        self.queues = [deque() for p in (HIGH, NORMAL, LOW)]
+        self.length = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.length
+
+    # Queues a frame, dropping the oldest frame of the lowest priority if full, which is the oldest
+    # frame of the new frame's own priority if none is lower. Returns False if it was the new
+    # frame that had to be dropped, i.e. all queued frames have a higher priority.
+    def push(self, priority, data):
+        if self.length >= self.size:
+            self.dropped += 1
+            lowest = max(p for p, q in enumerate(self.queues) if q)
+            if lowest < priority:
+                return False
+            self.queues[lowest].popleft()
+            self.length -= 1
+        self.queues[priority].append(data)
+        self.length += 1
+        return True
+
+    def pop(self):
+        for q in self.queues:
+            if q:
+                self.length -= 1
+                return q.popleft()
+        return None
+
+
+# Represents a connection (could be client -> server or server -> client). Independent of the
+# transport backend, which calls makeConnection, dataReceived and connectionLost.
+class NodeProtocol:
     def __init__(self, factory, incoming):
         self.id = factory.id
         self.factory = factory
         self.incoming = incoming
+        # Compression codec agreed with the peer during ANNOUNCE/ACKNOWLEDGE, None for raw frames
+        self.codec = None
+        # Name of the peer once the handshake completed
+        self.peer_name = None
+        self.connected = False
+        self.transport = None
+        # Received bytes not yet forming a complete frame
+        self.buffer = bytearray()
+        # Short lived connection for a single exchange with a node that need not be a peer
+        self.transient = False
+        # Set while the transport's write buffer is full, frames are then queued
+        self.paused = False
+        self.queue = SendQueue()
         logging.debug(f"[New node protocol]: {self.id}")
 
+    def makeConnection(self, transport):
+        self.transport = transport
+        self.connectionMade()
+
     def connectionMade(self):
+        self.connected = True
         logging.debug(f"[Connected]: {self.transport.getPeer()}")
 
     def connectionLost(self, reason):
+        self.connected = False
         logging.debug(f"[Disconnected]: {self.transport.getPeer()}")
-        self.factory.removeConnection(self.transport.getPeer())
+        self.factory.removeConnection(self)
 
     def dataReceived(self, data):
-        logging.debug(f"Data received: {data}")
+        self.buffer += data
+        start = 0
+        while len(self.buffer) - start >= FRAME_HEADER.size:
+            length, = FRAME_HEADER.unpack_from(self.buffer, start)
+            if length > MAX_FRAME:
+                logging.warning("[Frame of %d bytes from %s is too long, disconnecting]", length, self.transport.getPeer())
+                self.buffer = bytearray()
+                self.disconnect()
+                return
+            end = start + FRAME_HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            frame = bytes(self.buffer[start + FRAME_HEADER.size:end])
+            start = end
+            self.frameReceived(frame)
+        # Frames read are dropped from the buffer once per read, not once per frame
+        del self.buffer[:start]
+
+    def frameReceived(self, data):
+        if self.peer_name is not None:
+            self.factory.peers.recordIn(self.peer_name, len(data))
+        if data.startswith(HEARTBEAT_MARKER):
+            self.factory.peers.recordHeartbeat(data[1:].decode())
+            return
+        data = Compression.decompress(data)
+        logging.debug("Data received: %s", data)
         self.handleMsg(data)
 
-    def sendMsg(self, msg):
-        self.transport.write(msg.encode())
+    def sendMsg(self, msg, priority=NORMAL):
+        data = Compression.compress(msg.encode(), self.codec)
+        self.sendFrame(FRAME_HEADER.pack(len(data)) + data, priority)
+
+    def sendFrame(self, data, priority=NORMAL):
+        if self.paused or len(self.queue) > 0:
+            if not self.queue.push(priority, data):
+                logging.debug("[Send queue to %s full, dropping frame]", self.peer_name)
+            return
+        self.write(data)
+
+    def write(self, data):
+        if self.peer_name is not None:
+            self.factory.peers.recordOut(self.peer_name, len(data))
+        if self.factory.emulator is not None:
+            self.factory.emulator.send(self, data)
+        else:
+            self.transport.write(data)
+
+    # Producer interface, called by the transport as its write buffer fills up and drains
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        # Writing may pause the transport again
+        while not self.paused and len(self.queue) > 0:
+            self.write(self.queue.pop())
+
+    def stopProducing(self):
+        self.paused = True
 
     def handleMsg(self, data):
         self.factory.icn_protocol.handleMsg(data, self)
@@ -53,61 +179,74 @@ class NodeProtocol(Protocol):
 # Factory class used for persistent data since
 # protocol instance is created each time connection
 # is made
-class IPNode(Factory):
+class IPNode:
 
-    def __init__(self, icnp, node_id, port):
+    def __init__(self, icnp, node_id, port, reactor):
         # "Server"
         self.id = node_id
         self.port = port
-        self.connections = {}
-        self.IP_map = {}
+        # Connections and addresses of known nodes, shared with the Node
+        self.peers = icnp.node.peers
         self.icn_protocol = icnp
         self.fallback_address = None
+        # Ranked "host:port:name" addresses to reconnect to by peer, should that peer fail
         self.fallbacks = {}
+        # Optional LinkEmulator applied to all messages sent
+        self.emulator = None
 
-        endp = TCP4ServerEndpoint(reactor, port)
-        endp.listen(self)
+        # Transport backend, see Transport.getTransport
+        self.reactor = reactor
+        self.listener = self.reactor.listen(port, self)
 
         self.part_of_network = False
         self.isolated = True
+        # Set once the node is stopped, after which it must not search or fail over to fallbacks
+        self.stopped = False
 
         self.addr = "localhost"
+        # The same for every heartbeat, so it is only built once
+        heartbeat = HEARTBEAT_MARKER + node_id.encode()
+        self.heartbeat_frame = FRAME_HEADER.pack(len(heartbeat)) + heartbeat
 
     def buildProtocol(self, addr):
         protocol = NodeProtocol(self, False)
         protocol.factory = self
         return protocol
 
-    def client(self, port, addr="localhost", announce_msg=None):
+    def client(self, port, addr="localhost", announce_msg=None, callback=None, *args):
         # "Client"
-        try:
-            endp = TCP4ClientEndpoint(reactor, addr, port)
-            d = connectProtocol(endp, NodeProtocol(self, True))
-            d.addCallback(self.confirmConnection, announce_msg)
-            d.addErrback(self.errorHandler)
-            return d
-        except ConnectionRefusedError:
-            return d
+        return self.reactor.connect(addr, port, NodeProtocol(self, True), self.confirmConnection, announce_msg,
+                                    callback, args)
 
     def getConnection(self, node_id):
-        if node_id in self.connections:
-            return self.connections[node_id]
-        elif node_id in self.IP_map:
-            return None
-        else:
+        return self.peers.getConnection(node_id)
+
+    def getCodec(self, node_id):
+        connection = self.getConnection(node_id)
+        if connection is None:
             return None
+        return connection.codec
 
     def clientMsg(self, port, addr, msg):
-        try:
-            endp = TCP4ClientEndpoint(reactor, addr, port)
-            d = connectProtocol(endp, NodeProtocol(self, True))
-            d.addCallback(self.confirmMessage, msg)
-            d.addErrback(self.errorHandler)
-            return d
-        except ConnectionRefusedError:
-            return d
-
-    def sendMsg(self, msg, node_name, connection=None):
+        return self.reactor.connect(addr, port, NodeProtocol(self, True), self.confirmMessage, msg)
+
+    # Sends a message over a new transient connection to a "host:port" address. Its loss does
+    # not affect the peer at that address, if any. callback(protocol, *args) is called once
+    # connected, with None if the connection failed.
+    def sendDirect(self, msg, addr, callback=None, *args):
+        host, port = addr.split(':')
+        protocol = NodeProtocol(self, True)
+        protocol.transient = True
+        return self.reactor.connect(host, int(port), protocol, self.confirmDirect, msg, callback, args)
+
+    def confirmDirect(self, prot, msg, callback, args):
+        if prot is not None:
+            prot.sendMsg(msg)
+        if callback is not None:
+            callback(prot, *args)
+        return prot
+
+    def sendMsg(self, msg, node_name, connection=None, priority=NORMAL):
         if node_name is None:
             connection = connection
         else:
@@ -115,7 +254,7 @@ class IPNode(Factory):
         if connection is None:
             logging.warning(f"No connection found or established with {node_name}")
             try:
-                addr, port = self.IP_map[node_name].split(':')
+                addr, port = self.peers.getAddr(node_name).split(':')
                 port = int(port)
                 self.clientMsg(port, addr, msg)
             except Exception as e:
@@ -123,9 +262,16 @@ class IPNode(Factory):
                 logging.warning(f"Could not connect to {node_name}")
             finally:
                 return
-        connection.sendMsg(msg)
+        connection.sendMsg(msg, priority)
+
+    def sendHeartbeat(self, node_name):
+        connection = self.getConnection(node_name)
+        if connection is not None:
+            connection.sendFrame(self.heartbeat_frame, HIGH)
 
     def search(self, msg, port_iter=None, addr="localhost", addr_iter=None):
+        if self.stopped:
+            return
         if port_iter is None:
             ports_to_check = [*range(MIN_PORT, MAX_PORT + 1)]
             random.shuffle(ports_to_check)
@@ -145,20 +291,19 @@ class IPNode(Factory):
                 self.search(msg, None, addr, addr_iter)
                 return
             except StopIteration:
-                reactor.callLater(1, self.searchFailed, msg)
+                self.reactor.callLater(1, self.searchFailed, msg)
                 return
-        if len(self.connections) > 0:
+        if len(self.peers.connections) > 0:
             logging.debug(f"Stopping search")
             return
         logging.debug(f"Looking on: {addr}:{port}")
-        d = self.client(port, addr=addr, announce_msg=msg)
-        d.addCallback(self.continueSearch, msg, port_iter, addr, addr_iter)
+        self.client(port, addr, msg, self.continueSearch, msg, port_iter, addr, addr_iter)
 
     def continueSearch(self, prot, msg, port_iter, addr, addr_iter):
-        reactor.callLater(0.1, self.search, msg, port_iter, addr, addr_iter)
+        self.reactor.callLater(0.1, self.search, msg, port_iter, addr, addr_iter)
 
     def searchFailed(self, msg):
-        if len(self.connections) > 0:
+        if len(self.peers.connections) > 0:
             return
         elif self.isolated:
             logging.warning("No nodes found on network.")
@@ -167,21 +312,30 @@ class IPNode(Factory):
         else:
             logging.warning(f"Search failed.")
             self.isolated = True
-            reactor.callLater(5, self.search, msg)
+            self.reactor.callLater(5, self.search, msg)
 
     def addNodeConnection(self, node_name, source):
-        self.connections[node_name] = source
+        source.peer_name = node_name
+        self.peers.setConnection(node_name, source)
         self.part_of_network = True
 
     def addNodeAddr(self, node_name, port, host, source=None):
         if node_name == self.id:
             return
-        if node_name not in self.IP_map:
+        if not self.peers.hasAddr(node_name):
             logging.debug(f"{node_name} not in IP map, adding...")
             if source is not None:
                 host = source.transport.getPeer().host
             addr = f"{host}:{port}"
-            self.IP_map[node_name] = addr
+            self.peers.setAddr(node_name, addr)
+
+    # Stops accepting connections and drops all current ones
+    def stop(self):
+        self.stopped = True
+        self.fallbacks = {}
+        self.reactor.stopListening(self.listener)
+        for node_name in list(self.peers.connections):
+            self.removeNodeConnection(node_name)
 
     def getPort(self):
         return str(self.port)
@@ -189,41 +343,58 @@ class IPNode(Factory):
     def getPeerAddr(self, node_name):
         if node_name == self.id:
             return f"{self.addr}:{self.port}"
-        if node_name not in self.IP_map:
-            return None
-        else:
-            return self.IP_map[node_name]
+        return self.peers.getAddr(node_name)
 
     def removeNodeConnection(self, node_name):
-        p = self.connections.pop(node_name)
+        p = self.peers.popConnection(node_name)
         p.disconnect()
 
-    def confirmConnection(self, prot, msg):
-        self.sendMsg(msg, None, prot)
+    # Connection callbacks, prot is None if the connection failed
+    def confirmConnection(self, prot, msg, callback=None, args=()):
+        if prot is not None:
+            self.sendMsg(msg, None, prot)
+        if callback is not None:
+            callback(prot, *args)
         return prot
 
     def confirmMessage(self, prot, msg):
-        prot.sendMsg(msg)
+        if prot is not None:
+            prot.sendMsg(msg)
         return prot
 
     def verifyPeer(self, node_name):
-        if node_name in self.IP_map and node_name not in self.icn_protocol.node.peers:
+        if self.peers.hasAddr(node_name) and node_name not in self.peers:
             self.removePeer(node_name)
 
     def removePeer(self, node_name):
-        if node_name in self.connections:
+        if self.peers.hasConnection(node_name):
             self.removeNodeConnection(node_name)
-        # if node_name in self.IP_map:
-        #     self.IP_map.pop(node_name)
         self.icn_protocol.node.removePeer(node_name)
 
-    def removeConnection(self, peer):
-        addr = f"{peer.host}:{peer.port}"
-        for k, p in self.IP_map.items():
-            if addr == p:
-                self.removePeer(k)
-                self.fallbackDisconnect(k, addr)
-                break
+    # Called when a connection is lost. If it was a peer's registered connection, or a connection
+    # to a known node's listening address, that node is no longer a peer.
+    def removeConnection(self, protocol):
+        if self.emulator is not None:
+            self.emulator.removeConnection(protocol)
+        if protocol.transient:
+            return
+        node_name = protocol.peer_name
+        if node_name is None or self.peers.getConnection(node_name) is not protocol:
+            peer = protocol.transport.getPeer()
+            node_name = self.peers.nameAt(f"{peer.host}:{peer.port}")
+        if node_name is not None:
+            self.peerFailed(node_name)
+
+    # Drops a peer whose connection was lost or that the failure detector suspects, sends the
+    # requests pending on it elsewhere and reconnects to its fallbacks
+    def peerFailed(self, node_name):
+        addr = self.peers.getAddr(node_name)
+        self.removePeer(node_name)
+        self.peers.forget(node_name)
+        if self.stopped:
+            return
+        self.icn_protocol.reroutePending(node_name)
+        self.fallbackDisconnect(node_name, addr)
 
     def getFallback(self):
         return self.fallback_address
@@ -238,7 +409,7 @@ class IPNode(Factory):
                 host = source.transport.getPeer().host
             addr = f"{host}:{port}:{node_name}"
             self.fallback_address = addr
-            for p in self.icn_protocol.node.peers:
+            for p in self.peers:
                 if p == node_name:
                     continue
                 else:
@@ -247,23 +418,57 @@ class IPNode(Factory):
         else:
             return None
 
+    # The fallback a peer announced in its acknowledgement ranks first
     def updateFallback(self, node_name, addr):
-        self.fallbacks[node_name] = addr
-
+        ranked = self.fallbacks.get(node_name, [])
+        self.fallbacks[node_name] = [addr] + [f for f in ranked if f != addr][:MAX_FALLBACKS - 1]
+
+    # Ranked fallbacks advertised by a peer
+    def updateFallbacks(self, node_name, fallbacks):
+        ranked = [self.translateAddr(node_name, f) for f in fallbacks[:MAX_FALLBACKS]]
+        if ranked:
+            self.fallbacks[node_name] = ranked
+
+    # Address ("host:port" or "host:port:name") received from node_name as this node can reach
+    # it: addresses the sender knows as local are on the sender's host. via is the sender's
+    # address if it is not in the registry.
+    def translateAddr(self, node_name, addr, via=None):
+        host, rest = addr.split(':', 1)
+        if via is None:
+            via = self.peers.getAddr(node_name)
+        if host in LOCAL and via is not None:
+            host = via.split(':')[0]
+        return f"{host}:{rest}"
+
+    # Fallbacks this node advertises to a peer: its own fallback, then its other peers, longest
+    # connected first
+    def getFallbacks(self, node_name):
+        ranked = []
+        if self.fallback_address is not None and not self.fallback_address.endswith(f":{node_name}"):
+            ranked.append(self.fallback_address)
+        for n in self.peers:
+            addr = self.peers.getAddr(n)
+            if n != node_name and addr is not None and f"{addr}:{n}" not in ranked:
+                ranked.append(f"{addr}:{n}")
+        return ranked[:MAX_FALLBACKS]
+
+    # Announces to the best ranked fallbacks of a failed peer in parallel
     def fallbackDisconnect(self, node_name, addr):
-        host, port = addr.split(':')
-        addr = f"{host}:{port}:{node_name}"
-        if addr == self.fallback_address:
+        if self.stopped:
+            return
+        if addr is not None and f"{addr}:{node_name}" == self.fallback_address:
             self.fallback_address = None
         if node_name in self.fallbacks:
             logging.debug(f"{node_name} found in fallback table of {self.id}")
-            f = self.fallbacks.pop(node_name)
             msg = self.icn_protocol.getAnnounce()
-            host, port, n = f.split(':')
-            if n == self.id:
-                return
-            self.addNodeAddr(n, port, host)
-            self.sendMsg(msg, n)
+            tried = 0
+            for f in self.fallbacks.pop(node_name):
+                host, port, n = f.split(':')
+                if n == self.id or n in self.peers:
+                    continue
+                self.addNodeAddr(n, port, host)
+                self.sendMsg(msg, n)
+                tried += 1
+                if tried == FAILOVER_PARALLEL:
+                    break
 
-    def errorHandler(self, e):
-        e.trap(ConnectionRefusedError)
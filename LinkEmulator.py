@@ -0,0 +1,97 @@
+from RateLimit import TokenBucket
+from collections import deque
+from time import time
+import json
+import logging
+import random
+
+# Link settings: one way delay and jitter in seconds, loss probability, bandwidth in bytes per
+# second (None for unlimited) and burst size in bytes
+DEFAULT_LINK = {'delay': 0, 'jitter': 0, 'loss': 0, 'bandwidth': None, 'burst': 16384}
+
+
+class Link:
+    def __init__(self, delay=0, jitter=0, loss=0, bandwidth=None, burst=16384):
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+        self.bucket = TokenBucket(bandwidth, burst) if bandwidth else None
+        # Time the last message leaves the link, later messages never overtake it
+        self.last_departure = 0
+        # (departure time, protocol, data) of the messages held back, in the order sent
+        self.queue = deque()
+
+
+# Applies per-link delay, jitter, loss and bandwidth limits to the messages a node sends. Links
+# are looked up by the name of the peer at the other end; connections to peers without a link
+# of their own use the default settings.
+class LinkEmulator:
+    def __init__(self, reactor, node_name, default=None, links=None, seed=None):
+        self.reactor = reactor
+        self.node_name = node_name
+        self.default = dict(DEFAULT_LINK, **(default or {}))
+        # Settings by peer name
+        self.settings = links or {}
+        # Link state by peer name, or by protocol for connections to unnamed nodes, which is
+        # dropped with the connection
+        self.links = {}
+        self.random = random.Random(seed)
+
+    def getLink(self, protocol):
+        key = protocol.peer_name if protocol.peer_name is not None else protocol
+        if key not in self.links:
+            settings = dict(self.default, **self.settings.get(protocol.peer_name, {}))
+            self.links[key] = Link(**settings)
+        return self.links[key]
+
+    def removeConnection(self, protocol):
+        self.links.pop(protocol, None)
+
+    def send(self, protocol, data):
+        link = self.getLink(protocol)
+        if link.loss > 0 and self.random.random() < link.loss:
+            logging.debug("[Emulated loss of %d bytes to %s]", len(data), protocol.peer_name)
+            return
+        t = time()
+        wait = link.delay + self.random.uniform(-link.jitter, link.jitter)
+        if link.bucket is not None:
+            wait += link.bucket.reserve(len(data), t)
+        departure = max(t + max(0, wait), link.last_departure)
+        link.last_departure = departure
+        if departure <= t and not link.queue:
+            protocol.transport.write(data)
+            return
+        link.queue.append((departure, protocol, data))
+        # Only the oldest message held back is scheduled, so messages due at the same time
+        # still leave in the order they were sent
+        if len(link.queue) == 1:
+            self.reactor.callLater(departure - t, self.deliver, link)
+
+    def deliver(self, link):
+        departure, protocol, data = link.queue.popleft()
+        if protocol.transport is not None and protocol.connected:
+            protocol.transport.write(data)
+        if link.queue:
+            self.reactor.callLater(max(0, link.queue[0][0] - time()), self.deliver, link)
+
+
+# Loads the links of node_name from a topology file of the form
+# {"seed": 1, "default": {"delay": 0.02}, "links": [{"nodes": ["Pi1", "Pi2"], "delay": 0.05, "loss": 0.01}]}
+# Links are symmetric, both nodes apply the settings to the messages they send on them.
+def load(path, node_name, reactor):
+    with open(path) as f:
+        topology = json.load(f)
+    links = {}
+    for link in topology.get('links', []):
+        nodes = link['nodes']
+        if node_name not in nodes:
+            continue
+        settings = {k: v for k, v in link.items() if k != 'nodes'}
+        for n in nodes:
+            if n != node_name:
+                links[n] = settings
+    seed = topology.get('seed')
+    if seed is not None:
+        # Different but reproducible losses and jitter per node
+        seed = f"{seed}:{node_name}"
+    return LinkEmulator(reactor, node_name, topology.get('default'), links, seed)
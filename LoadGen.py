@@ -0,0 +1,114 @@
+from Node import SENSOR_TYPES
+from itertools import accumulate
+import Farm
+import json
+import random
+import struct
+
+# Request outcomes
+OK = 0
+STALE = 1
+FAIL = 2
+TIMEOUT = 3
+OUTCOMES = ['ok', 'stale', 'fail', 'timeout']
+
+UNIFORM = 'uniform'
+ZIPF = 'zipf'
+WORKLOADS = [UNIFORM, ZIPF]
+
+# Results file: magic line, JSON list of data names, then one record per request
+RESULTS_MAGIC = b'ICNRESULTS1\n'
+# Start time, latency (s), index of the data name, outcome
+RECORD = struct.Struct('<dfIB')
+
+
+# All <city>_<type> data names, cities defaulting to the datasets in temps/. With replicas > 1
+# the names of a producer farm's replicas (<city>1_<type>, ...) are included.
+def nameSpace(cities=None, types=None, replicas=1):
+    if cities is None:
+        cities = Farm.findDatasets()
+    if types is None:
+        types = list(SENSOR_TYPES)
+    return [f"{c}_{t}" for c in Farm.producerNames(cities, replicas) for t in types]
+
+
+# Yields (offset in seconds, data name) with Poisson arrivals at rate requests per second. Names
+# are drawn uniformly, or by a Zipf law of exponent s over a random ranking of the names.
+def generateWorkload(names, rate, duration, popularity=UNIFORM, s=1.0, seed=None):
+    rng = random.Random(seed)
+    names = list(names)
+    # Cumulative, so choices() need not sum the weights again for every request
+    cum_weights = None
+    if popularity == ZIPF:
+        rng.shuffle(names)
+        cum_weights = list(accumulate(1 / (rank ** s) for rank in range(1, len(names) + 1)))
+    elif popularity != UNIFORM:
+        raise ValueError(f"Unknown workload {popularity}, expected one of {WORKLOADS}")
+    offset = rng.expovariate(rate)
+    while offset < duration:
+        yield offset, rng.choices(names, cum_weights=cum_weights)[0]
+        offset += rng.expovariate(rate)
+
+
+# Yields (offset in seconds, data name) from a trace file with one "timestamp,name" per line,
+# offsets being relative to the first timestamp. Blank lines and lines starting with # are skipped.
+def readTrace(path):
+    first = None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            timestamp, name = line.split(',', 1)
+            timestamp = float(timestamp)
+            if first is None:
+                first = timestamp
+            yield timestamp - first, name.strip()
+
+
+# Outcome and latency of every request made by a load run
+class Results:
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+        self.records = []
+
+    def add(self, data_name, start, latency, outcome):
+        if data_name not in self.ids:
+            self.ids[data_name] = len(self.names)
+            self.names.append(data_name)
+        self.records.append((start, latency, self.ids[data_name], outcome))
+
+    def write(self, path):
+        with open(path, 'wb') as f:
+            f.write(RESULTS_MAGIC)
+            f.write(json.dumps(self.names).encode() + b'\n')
+            for r in self.records:
+                f.write(RECORD.pack(*r))
+
+    def summary(self):
+        counts = [0] * len(OUTCOMES)
+        latencies = []
+        for start, latency, name_id, outcome in self.records:
+            counts[outcome] += 1
+            if outcome in (OK, STALE):
+                latencies.append(latency)
+        s = f"{len(self.records)} requests: " + ", ".join(f"{n} {c}" for n, c in zip(OUTCOMES, counts))
+        if latencies:
+            latencies.sort()
+            p50 = latencies[len(latencies) // 2]
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            s += f"; latency p50 {p50 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms"
+        return s
+
+
+def readResults(path):
+    results = Results()
+    with open(path, 'rb') as f:
+        if f.readline() != RESULTS_MAGIC:
+            raise ValueError(f"{path} is not a results file")
+        results.names = json.loads(f.readline())
+        results.ids = {n: i for i, n in enumerate(results.names)}
+        data = f.read()
+    results.records = list(RECORD.iter_unpack(data))
+    return results
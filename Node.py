@@ -1,61 +1,115 @@
 # Dara
-from ICNProtocol import ICNProtocol
-from Sensor import Sensor, TempSensor, PerSensor, HumSensor, BarSensor, CloudSensor, SnowSensor, WaterSensor, WindSensor
-from twisted.internet import reactor
+from ICNProtocol import ICNProtocol, REQUEST_RATE, REQUEST_BURST
 from Tlru import TLRU_Table
+from Popularity import RequestRates
+from PeerRegistry import PeerRegistry
+from Routing import RoutingTable, namePrefix
+from Bloom import DeadNonceList
+import EventTrace
+from CacheSummary import CacheSummary, applySummary
+from Resolver import Resolver
+import CachePolicy
+import Transport
 import logging
 import argparse
 from time import time, sleep
-from threading import Thread
+from threading import Thread, Lock
+
+# Sensor classes (from Sensor.py) a producer serves as <data_n>_<type>. Sensors are only
+# constructed on the first request for their data or the first update tick.
+SENSOR_TYPES = {
+    'temp': 'TempSensor',
+    'per': 'PerSensor',
+    'hum': 'HumSensor',
+    'bar': 'BarSensor',
+    'cloud': 'CloudSensor',
+    'snow': 'SnowSensor',
+    'water': 'WaterSensor',
+    'wind': 'WindSensor',
+}
+# Time to use of sensor values, 60 since they update once per min
+SENSOR_TTU = 60
+# Seconds between sensor updates
+UPDATE_INTERVAL = 10
+# Names requested at least this often (per second) are refreshed before their cached copy expires
+HOT_RATE = 0.5
+# Seconds an expired cache entry may still be served, flagged as stale, while it is refreshed
+MAX_STALE = 10
+# Entries of the PIT and locations tables. Beyond this the least recently used entries are
+# evicted, so load runs with many names in flight need larger tables.
+PIT_SIZE = 3
 
 
 class Node:
 
-    def __init__(self, node_id=None, port=None, data_n=None, data_v=None):
+    def __init__(self, node_id=None, port=None, data_n=None, data_v=None, transport=None, cache_policy=CachePolicy.LCE,
+                 topology=None, trace_file=None, farm=None, farm_replicas=1, resolver=False, pit_size=PIT_SIZE,
+                 request_rate=REQUEST_RATE, request_burst=REQUEST_BURST):
         self.name = node_id
-        self.PIT = TLRU_Table(3)
-        self.cache = TLRU_Table(3)
-        self.locations = TLRU_Table(3)
-        self.peers = []
+        self.start_time = time()
+        # Seconds from start until the first ACKNOWLEDGE was sent or received, set by ICNProtocol
+        self.startup_time = None
+        # Transport backend (name or instance), nodes sharing one run on the same event loop
+        self.reactor = Transport.getTransport(transport)
+        self.PIT = TLRU_Table(pit_size)
+        # Further downstream nodes waiting on a PIT entry, besides the one it was made for
+        self.PIT_requesters = TLRU_Table(pit_size)
+        # Where each PIT entry's request was forwarded: (peers, request content, ttl), so it can be
+        # sent again elsewhere if those peers fail
+        self.PIT_upstream = TLRU_Table(pit_size)
+        # PIT entries whose upstream failed with no other path yet: name -> (request content, ttl)
+        self.orphaned = {}
+        # Nonces of recently seen requests, to drop requests that looped back
+        self.dead_nonces = DeadNonceList()
+        # Kept in step with the cache and sent to peers for cache-aware forwarding
+        self.cache_summary = CacheSummary()
+        self.cache = TLRU_Table(3, stale=MAX_STALE, listener=self.cache_summary)
+        # Names being refreshed from upstream and the peer each is refreshed from
+        self.refreshing = set()
+        self.upstream = {}
+        # Scheduled refresh of each hot cached name, at most one per name
+        self.refresh_calls = {}
+        # Decides whether data relayed by this node is cached
+        self.cache_policy = CachePolicy.getPolicy(cache_policy)
+        # Rates of the requests received for each data name
+        self.rates = RequestRates()
+        # Requests accepted from each node per second, and in a burst
+        self.request_rate = request_rate
+        self.request_burst = request_burst
+        self.locations = TLRU_Table(pit_size)
+        # Peers plus the connections, addresses and state of every known node
+        self.peers = PeerRegistry()
+        # Next hops towards the name prefixes advertised by producers
+        self.routes = RoutingTable(self.name)
+        # Consistent hashing overlay resolving name prefixes to producers, None if not used
+        self.resolver = Resolver(self.name) if resolver else None
         self.data = {}
         self.sensors = {}
+        # Registered sensors by data name: (sensor class name, dataset name)
+        self.sensor_types = {}
+        self.sensor_lock = Lock()
+        self.running = True
+        # Futures of pending fetch() calls by data name
+        self.pending = {}
+        # Binary event trace, "{name}" in the file name is replaced by the node name
+        self.trace = None
+        if trace_file is not None:
+            self.trace = EventTrace.EventRecorder(trace_file.format(name=self.name), self.name)
+            self.reactor.callLater(EventTrace.FLUSH_INTERVAL, self.flushTrace)
 
         self.icn = ICNProtocol(self, self.name, port)
+        if topology is not None:
+            import LinkEmulator
+            self.icn.ip_node.emulator = LinkEmulator.load(topology, self.name, self.reactor)
 
         if data_n is not None:
-            # Temperature sensor with a time to use of 60 (since it updates once per min)
-            self.sensors[data_n+"_temp"] = TempSensor(data_n, 60)
-            self.sensors[data_n+"_temp"].update()
-            self.data[data_n+"_temp"] = self.sensors[data_n+"_temp"].getValue()
-
-            self.sensors[data_n+"_per"] = PerSensor(data_n, 60)
-            self.sensors[data_n+"_per"].update()
-            self.data[data_n+"_per"] = self.sensors[data_n+"_per"].getValue()
-
-            self.sensors[data_n+"_hum"] = HumSensor(data_n, 60)
-            self.sensors[data_n+"_hum"].update()
-            self.data[data_n+"_hum"] = self.sensors[data_n+"_hum"].getValue()
-
-            self.sensors[data_n+"_bar"] = BarSensor(data_n, 60)
-            self.sensors[data_n+"_bar"].update()
-            self.data[data_n+"_bar"] = self.sensors[data_n+"_bar"].getValue()
-
-            self.sensors[data_n+"_cloud"] = CloudSensor(data_n, 60)
-            self.sensors[data_n+"_cloud"].update()
-            self.data[data_n+"_cloud"] = self.sensors[data_n+"_cloud"].getValue()
-
-            self.sensors[data_n+"_snow"] = SnowSensor(data_n, 60)
-            self.sensors[data_n+"_snow"].update()
-            self.data[data_n+"_snow"] = self.sensors[data_n+"_snow"].getValue()
-
-            self.sensors[data_n+"_water"] = WaterSensor(data_n, 60)
-            self.sensors[data_n+"_water"].update()
-            self.data[data_n+"_water"] = self.sensors[data_n+"_water"].getValue()
-
-            self.sensors[data_n+"_wind"] = WindSensor(data_n, 60)
-            self.sensors[data_n+"_wind"].update()
-            self.data[data_n+"_wind"] = self.sensors[data_n+"_wind"].getValue()
-
+            self.registerSensors(data_n)
+        # Virtual producers for the datasets matching a glob (or "all"), each serving every sensor type
+        self.farm = None
+        if farm is not None:
+            import Farm
+            self.farm = Farm.ProducerFarm(farm, farm_replicas, list(SENSOR_TYPES), SENSOR_TTU)
+            logging.info(f"Serving {len(self.farm)} names from {len(self.farm.producers)} virtual producers")
 
         th = Thread(target=self.updateData, daemon=True)
         th.start()
@@ -74,6 +128,58 @@ class Node:
     def hasPITEntry(self, data_name):
         return self.PIT.contains(data_name)
 
+    def getPITDest(self, data_name):
+        dest, ttw = self.PIT.get(data_name)
+        return dest
+
+    def getPITEntry(self, data_name):
+        dest, ttw = self.PIT.get(data_name)
+        return dest, ttw
+
+    def addPITRequester(self, data_name, node_name, ttw):
+        if self.PIT_requesters.contains(data_name):
+            requesters, t = self.PIT_requesters.get(data_name)
+            requesters.add(node_name)
+        else:
+            self.PIT_requesters.add(data_name, {node_name}, ttw)
+
+    def popPITRequesters(self, data_name):
+        requesters, r = self.PIT_requesters.remove(data_name)
+        if requesters is None:
+            return set()
+        return requesters
+
+    def addPITUpstream(self, data_name, node_name, content, ttl, ttw):
+        if self.PIT_upstream.contains(data_name):
+            (peers, c, t), ttu = self.PIT_upstream.get(data_name)
+            peers.add(node_name)
+        else:
+            self.PIT_upstream.add(data_name, ({node_name}, content, ttl), ttw)
+
+    def getPITUpstream(self, data_name):
+        if not self.PIT_upstream.contains(data_name):
+            return None
+        upstream, ttu = self.PIT_upstream.get(data_name)
+        return upstream
+
+    def removePITUpstream(self, data_name):
+        self.PIT_upstream.remove(data_name)
+
+    # Names of the PIT entries whose request was forwarded to node_name
+    def getPendingVia(self, node_name):
+        pending = []
+        for data_name in list(self.PIT_upstream):
+            upstream = self.getPITUpstream(data_name)
+            if upstream is not None and node_name in upstream[0]:
+                pending.append(data_name)
+        return pending
+
+    def seenNonce(self, data_name, nonce):
+        return f"{data_name}:{nonce}" in self.dead_nonces
+
+    def addNonce(self, data_name, nonce):
+        self.dead_nonces.add(f"{data_name}:{nonce}")
+
     def canRequestFrom(self, node_name):
         for d in self.PIT:
             print(d)
@@ -113,29 +219,110 @@ class Node:
         data, ttu = self.cache.get(data_name)
         return data, ttu
 
+    def getStale(self, data_name):
+        return self.cache.getStale(data_name)
+
+    # Content of the next summary update for peers, or None if the cache did not change
+    def getSummaryUpdate(self):
+        # Drops expired entries, which are not advertised
+        self.cache.evalutateTTU()
+        return self.cache_summary.update()
+
+    def updatePeerSummary(self, node_name, content):
+        state = self.peers.getState(node_name)
+        state.summary, state.summary_version = applySummary(state.summary, state.summary_version, content)
+
+    # A peer other than exclude whose cache summary contains the data name, or None
+    def getCachePeer(self, data_name, exclude=None):
+        for n in self.peers:
+            if n == exclude:
+                continue
+            summary = self.peers.getState(n).summary
+            if summary is not None and data_name in summary:
+                return n
+        return None
+
+    def recordRequest(self, data_name):
+        self.rates.record(data_name)
+
+    def isHot(self, data_name):
+        return self.rates.rate(data_name) >= HOT_RATE
+
     def addPeer(self, node_name):
-        if node_name not in self.peers:
-            self.peers.append(node_name)
+        self.peers.addPeer(node_name)
 
     def removePeer(self, node_name):
-        if node_name in self.peers:
-            self.peers.remove(node_name)
+        self.peers.removePeer(node_name)
+        self.routes.removeNextHop(node_name)
+
+    # Route for a data name whose next hop is a peer, or None
+    def getRoute(self, data_name):
+        route = self.routes.lookup(data_name)
+        if route is not None and route.next_hop in self.peers:
+            return route
+        return None
+
+    # Name prefixes of the data this node produces
+    def getPrefixes(self):
+        prefixes = {namePrefix(n) for n in list(self.sensor_types) + list(self.data)}
+        if self.farm is not None:
+            prefixes.update(self.farm.prefixes())
+        return sorted(prefixes)
 
     def hasData(self, data_name):
-        if data_name in self.data:
+        if data_name in self.data or data_name in self.sensor_types:
+            return True
+        elif self.farm is not None and data_name in self.farm:
             return True
         else:
             return False
 
+    def registerSensors(self, data_n):
+        for t, sensor_class in SENSOR_TYPES.items():
+            self.sensor_types[f"{data_n}_{t}"] = (sensor_class, data_n)
+
+    # Returns the sensor for a data name, constructing it on first use
+    def getSensor(self, data_name):
+        with self.sensor_lock:
+            if data_name not in self.sensors:
+                # Imported here since numpy is only needed once a sensor exists
+                import Sensor
+                sensor_class, data_n = self.sensor_types[data_name]
+                s = getattr(Sensor, sensor_class)(data_n, SENSOR_TTU)
+                s.update()
+                self.sensors[data_name] = s
+                self.data[data_name] = s.getValue()
+            return self.sensors[data_name]
+
     def run(self):
-        self.reactor = reactor
         self.reactor.run()
+        self.closeTrace()
+
+    def flushTrace(self):
+        if self.trace is not None and self.running:
+            self.trace.flush()
+            self.reactor.callLater(EventTrace.FLUSH_INTERVAL, self.flushTrace)
+
+    def closeTrace(self):
+        if self.trace is not None:
+            self.trace.close()
+
+    # Stops this node without stopping the event loop it shares with other nodes
+    def stop(self):
+        self.running = False
+        self.icn.ip_node.stop()
+        self.closeTrace()
 
     def getData(self, data_name):
+        if data_name not in self.data and data_name in self.sensor_types:
+            self.getSensor(data_name)
         if data_name in self.data:
             data_val, ttu = self.data[data_name]
             ttu += time()
             return data_val, ttu
+        elif self.farm is not None and data_name in self.farm:
+            data_val, ttu = self.farm.getValue(data_name)
+            return data_val, ttu + time()
         else:
             return None
 
@@ -143,20 +330,46 @@ class Node:
         ttw += time()
         self.icn.requestData(data_name, ttw)
 
-    def useData(self, data_name, data_val):
-        logging.info(f"Received {data_name} with a value of {data_val}")
+    # Requests data and waits for it, for use from coroutines running on the asyncio backend's loop
+    async def fetch(self, data_name, ttw=10):
+        import asyncio
+        future = asyncio.get_running_loop().create_future()
+        self.pending.setdefault(data_name, []).append(future)
+        self.requestData(data_name, ttw)
+        try:
+            return await asyncio.wait_for(future, ttw)
+        finally:
+            futures = self.pending.get(data_name, [])
+            if future in futures:
+                futures.remove(future)
+                if not futures:
+                    self.pending.pop(data_name)
+
+    def useData(self, data_name, data_val, stale=False):
+        logging.info("Received %s with a value of %s", data_name, data_val)
+        for future in self.pending.pop(data_name, []):
+            if not future.done():
+                future.set_result(data_val)
+
+    def dataFailed(self, data_name):
+        for future in self.pending.pop(data_name, []):
+            if not future.done():
+                future.set_exception(LookupError(f"Data for {data_name} could not be found on network"))
 
     # Update data sources loop
     def updateData(self):
-        while True:
-            for k, s in self.sensors.items():
+        while self.running:
+            sleep(UPDATE_INTERVAL)
+            if self.farm is not None:
+                self.farm.update()
+            for k in list(self.sensor_types):
+                s = self.getSensor(k)
                 s.update()
                 self.data[k] = s.getValue()
-            sleep(10)
 
     def __str__(self):
-        str = f"Name: {self.name}\nPIT:\n{self.PIT}\nCache:\n{self.cache}\nLocations:\n{self.locations}\nPeers:\n{self.peers}\n"
-        str += f"Data:\n{self.data}\nIP map:\n{self.icn.ip_node.IP_map}\nConnections:\n{self.icn.ip_node.connections}\nFallback:"
+        str = f"Name: {self.name}\nPIT:\n{self.PIT}\nCache:\n{self.cache}\nLocations:\n{self.locations}\nRoutes:\n{self.routes}\nPeers:\n{self.peers}\n"
+        str += f"Data:\n{self.data}\nIP map:\n{self.peers.addrMap()}\nConnections:\n{self.peers.connections}\nFallback:"
         return str + f"\n{self.icn.ip_node.fallback_address}\nFallbacks:\n{self.icn.ip_node.fallbacks}"
 
 
@@ -167,6 +380,16 @@ def main():
     parser.add_argument('--data-n', help='Data name for this node', type=str, default=None)
     parser.add_argument('--data-v', help='Data for the node', type=str, default="10")
     parser.add_argument('--logging-level', help='Logging level: 10 - Debug, 20 - Info, 30 - Warnings', type=int, default=20)
+    parser.add_argument('--transport', help='Transport backend', choices=Transport.BACKENDS, default=Transport.DEFAULT_BACKEND)
+    parser.add_argument('--cache-policy', help='On-path caching policy', choices=list(CachePolicy.POLICIES), default=CachePolicy.LCE)
+    parser.add_argument('--topology', help='Topology file of emulated link delays, losses and bandwidths', type=str, default=None)
+    parser.add_argument('--trace-file', help='Record a binary event trace to this file, see EventTrace.py', type=str, default=None)
+    parser.add_argument('--farm', help='Serve virtual producers for the datasets in temps/ matching this glob, or "all"', type=str, default=None)
+    parser.add_argument('--farm-replicas', help='Virtual producers per dataset of the farm', type=int, default=1)
+    parser.add_argument('--resolver', help='Take part in the resolver overlay mapping name prefixes to producers', action='store_true')
+    parser.add_argument('--pit-size', help='Entries of the PIT and locations tables', type=int, default=PIT_SIZE)
+    parser.add_argument('--request-rate', help='Requests accepted from each node per second', type=float, default=REQUEST_RATE)
+    parser.add_argument('--request-burst', help='Requests accepted from each node in a burst', type=int, default=REQUEST_BURST)
     args = parser.parse_args()
 
     if args.node_name is None:
@@ -179,7 +402,8 @@ def main():
 
     logging.basicConfig(level=args.logging_level, format='{0:8}%(levelname)-8s %(message)s'.format(args.node_name + ':'))
     logging.debug(f"Running node {args.node_name}")
-    n = Node(args.node_name, args.port, args.data_n, args.data_v)
+    n = Node(args.node_name, args.port, args.data_n, args.data_v, args.transport, args.cache_policy, args.topology, args.trace_file,
+             args.farm, args.farm_replicas, args.resolver, args.pit_size, args.request_rate, args.request_burst)
     n.run()
 
 
@@ -0,0 +1,163 @@
+from FailureDetector import PhiAccrualDetector
+from RateLimit import TokenBucket
+from time import time
+
+
+# What a node knows about another node: its connection, address, whether it is a peer
+# (handshake completed) and traffic statistics
+class PeerState:
+    def __init__(self, name):
+        self.name = name
+        self.connection = None
+        self.addr = None
+        self.alive = False
+        self.last_seen = None
+        # Failure detector fed by the peer's heartbeats, reset whenever it becomes a peer
+        self.detector = None
+        self.msgs_in = 0
+        self.msgs_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # Bloom filter of the peer's cache contents and the version it is at
+        self.summary = None
+        self.summary_version = None
+        # Token bucket limiting the requests accepted from the node, created on its first request
+        self.request_bucket = None
+        self.requests_dropped = 0
+
+    def __repr__(self):
+        return (f"PeerState({self.name}, addr={self.addr}, alive={self.alive}, connected={self.connection is not None}, "
+                f"last_seen={self.last_seen}, in={self.msgs_in}/{self.bytes_in}B, out={self.msgs_out}/{self.bytes_out}B)")
+
+
+# Indexes known nodes by name and by "host:port" address. Iterating, len() and `in` apply to
+# the peers only, in the order they were added, so the registry can be used like the list of
+# peer names it replaces.
+class PeerRegistry:
+    def __init__(self):
+        self.states = {}
+        # Address -> name
+        self.names = {}
+        # Name -> connection, for the nodes with an open connection
+        self.connections = {}
+        # Peer names, used as an ordered set
+        self.peers = {}
+
+    def getState(self, node_name):
+        if node_name not in self.states:
+            self.states[node_name] = PeerState(node_name)
+        return self.states[node_name]
+
+    # Peers
+    def addPeer(self, node_name):
+        state = self.getState(node_name)
+        state.alive = True
+        # The handshake just completed, so the peer counts as heard from now
+        state.last_seen = time()
+        state.detector = PhiAccrualDetector()
+        self.peers[node_name] = None
+
+    def removePeer(self, node_name):
+        if node_name in self.peers:
+            self.peers.pop(node_name)
+            self.states[node_name].alive = False
+            self.states[node_name].summary = None
+
+    def __contains__(self, node_name):
+        return node_name in self.peers
+
+    # Drops everything known about a node, e.g. once it failed, so the registry does not grow with
+    # every node ever seen
+    def forget(self, node_name):
+        self.removePeer(node_name)
+        state = self.states.pop(node_name, None)
+        if state is not None and self.names.get(state.addr) == node_name:
+            self.names.pop(state.addr)
+        self.connections.pop(node_name, None)
+
+    def __iter__(self):
+        # Copy, since sending to a peer may end up removing it
+        return iter(list(self.peers))
+
+    def __len__(self):
+        return len(self.peers)
+
+    # Connections
+    def setConnection(self, node_name, connection):
+        self.getState(node_name).connection = connection
+        self.connections[node_name] = connection
+
+    def getConnection(self, node_name):
+        return self.connections.get(node_name)
+
+    def hasConnection(self, node_name):
+        return node_name in self.connections
+
+    def popConnection(self, node_name):
+        connection = self.connections.pop(node_name)
+        self.states[node_name].connection = None
+        return connection
+
+    # Addresses
+    def setAddr(self, node_name, addr):
+        state = self.getState(node_name)
+        if state.addr is not None:
+            self.names.pop(state.addr, None)
+        state.addr = addr
+        self.names[addr] = node_name
+
+    def getAddr(self, node_name):
+        state = self.states.get(node_name)
+        if state is None:
+            return None
+        return state.addr
+
+    def hasAddr(self, node_name):
+        return self.getAddr(node_name) is not None
+
+    def nameAt(self, addr):
+        return self.names.get(addr)
+
+    # Statistics, only kept for known nodes
+    def recordIn(self, node_name, size):
+        state = self.states.get(node_name)
+        if state is None:
+            return
+        state.msgs_in += 1
+        state.bytes_in += size
+        state.last_seen = time()
+
+    def recordOut(self, node_name, size):
+        state = self.states.get(node_name)
+        if state is None:
+            return
+        state.msgs_out += 1
+        state.bytes_out += size
+
+    def recordHeartbeat(self, node_name):
+        state = self.states.get(node_name)
+        if state is not None and state.detector is not None:
+            state.detector.heartbeat(time())
+
+    # Whether the failure detector suspects that a peer has failed
+    def suspect(self, node_name, t=None):
+        state = self.states.get(node_name)
+        if state is None or state.detector is None:
+            return False
+        return state.detector.suspect(time() if t is None else t, state.last_seen)
+
+    # Takes a token from the node's request bucket, returns whether the request may be handled
+    def allowRequest(self, node_name, rate, burst):
+        state = self.getState(node_name)
+        if state.request_bucket is None:
+            state.request_bucket = TokenBucket(rate, burst)
+        if state.request_bucket.consume():
+            return True
+        state.requests_dropped += 1
+        return False
+
+    def addrMap(self):
+        return {n: a for a, n in self.names.items()}
+
+    def __str__(self):
+        return str(list(self.peers))
@@ -0,0 +1,36 @@
+from collections import OrderedDict
+from time import time
+import math
+
+# Time constant (seconds) of the request rate averages
+RATE_WINDOW = 30
+# Number of names tracked, least recently requested names are dropped first
+MAX_NAMES = 1024
+
+
+# Exponentially decaying request rate per data name, in requests per second
+class RequestRates:
+    def __init__(self, window=RATE_WINDOW, size=MAX_NAMES):
+        self.window = window
+        self.size = size
+        self.rates = OrderedDict()
+
+    def record(self, data_name, t=None):
+        if t is None:
+            t = time()
+        rate = self.rate(data_name, t)
+        self.rates[data_name] = (rate + 1 / self.window, t)
+        self.rates.move_to_end(data_name)
+        if len(self.rates) > self.size:
+            self.rates.popitem(last=False)
+
+    def rate(self, data_name, t=None):
+        if data_name not in self.rates:
+            return 0.0
+        if t is None:
+            t = time()
+        rate, last = self.rates[data_name]
+        return rate * math.exp(-(t - last) / self.window)
+
+    def __str__(self):
+        return str({k: round(self.rate(k), 3) for k in self.rates})
@@ -0,0 +1,32 @@
+from time import time
+
+
+# Token bucket refilled at rate tokens per second up to burst tokens
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time()
+
+    def refill(self, t=None):
+        if t is None:
+            t = time()
+        self.tokens = min(self.burst, self.tokens + (t - self.last) * self.rate)
+        self.last = t
+
+    # Takes n tokens if available, returns whether they were
+    def consume(self, n=1, t=None):
+        self.refill(t)
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+    # Takes n tokens, going into debt if needed, and returns the seconds until they are covered
+    def reserve(self, n, t=None):
+        self.refill(t)
+        self.tokens -= n
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
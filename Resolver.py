@@ -0,0 +1,162 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from time import time
+import random
+
+ID_BITS = 32
+# Contacts kept per bucket, and the number of closest nodes a lookup converges on
+K = 4
+# Queries a lookup keeps in flight
+ALPHA = 2
+# Seconds to wait for a query's answer
+LOOKUP_TIMEOUT = 1
+# Nodes each prefix is registered on
+REPLICAS = 2
+# Seconds between registrations of a producer's prefixes, records expire after three
+REGISTER_INTERVAL = 30
+RECORD_TTL = 3 * REGISTER_INTERVAL
+# Seconds a producer location found by a lookup is used for further names under its prefix
+CACHE_TTL = REGISTER_INTERVAL
+
+
+# Position of a node name or name prefix in the identifier space
+def ringId(key):
+    return int.from_bytes(blake2b(key.encode(), digest_size=ID_BITS // 8).digest(), 'big')
+
+
+# Value of a key in a table of (value, expiry time), None if absent or expired
+def unexpired(table, key):
+    entry = table.get(key)
+    if entry is None:
+        return None
+    value, expiry = entry
+    if time() > expiry:
+        table.pop(key)
+        return None
+    return value
+
+
+# Kademlia routing table: contacts in one bucket per XOR distance range, at most K each, so a
+# node knows many nodes near it and a few far away
+class Contacts:
+    def __init__(self, node_name):
+        self.node_name = node_name
+        self.id = ringId(node_name)
+        # Name -> (address, id), least recently seen first
+        self.buckets = [OrderedDict() for i in range(ID_BITS)]
+
+    def bucket(self, node_id):
+        return self.buckets[max(0, (self.id ^ node_id).bit_length() - 1)]
+
+    def add(self, node_name, addr):
+        if node_name == self.node_name or addr is None:
+            return
+        node_id = ringId(node_name)
+        b = self.bucket(node_id)
+        if node_name in b:
+            b.move_to_end(node_name)
+        elif len(b) >= K:
+            # Full buckets keep their longest known contacts, which are the likeliest to stay up
+            return
+        b[node_name] = (addr, node_id)
+
+    def remove(self, node_name):
+        self.bucket(ringId(node_name)).pop(node_name, None)
+
+    # Up to count (name, address) contacts closest to key
+    def closest(self, key, count=K):
+        contacts = [(node_id ^ key, n, addr) for b in self.buckets for n, (addr, node_id) in b.items()]
+        contacts.sort()
+        return [(n, addr) for d, n, addr in contacts[:count]]
+
+    def __len__(self):
+        return sum(len(b) for b in self.buckets)
+
+    def __str__(self):
+        return str({n: addr for b in self.buckets for n, (addr, node_id) in b.items()})
+
+
+# State of one iterative lookup: the closest nodes to the key found so far and which of them
+# have been queried. prefix is None when only the closest nodes are wanted (registration).
+class Lookup:
+    def __init__(self, lid, key, prefix, contacts, callback):
+        self.lid = lid
+        self.key = key
+        self.prefix = prefix
+        self.callback = callback
+        self.shortlist = dict(contacts.closest(key))
+        self.queried = set()
+        self.pending = set()
+        # Connections of the queries in flight, by node name
+        self.connections = {}
+        self.queries = 0
+
+    # The K closest (name, address) found so far
+    def closest(self):
+        return sorted(self.shortlist.items(), key=lambda c: ringId(c[0]) ^ self.key)[:K]
+
+    # Nodes to query next, keeping at most ALPHA queries in flight
+    def next(self):
+        nodes = []
+        for n, addr in self.closest():
+            if len(self.pending) + len(nodes) >= ALPHA:
+                break
+            if n not in self.queried:
+                nodes.append((n, addr))
+        for n, addr in nodes:
+            self.queried.add(n)
+            self.pending.add(n)
+            self.queries += 1
+        return nodes
+
+    def add(self, nodes):
+        for n, addr in nodes:
+            if n not in self.shortlist:
+                self.shortlist[n] = addr
+
+    def remove(self, node_name):
+        self.shortlist.pop(node_name, None)
+        self.pending.discard(node_name)
+        self.connections.pop(node_name, None)
+
+    def finished(self):
+        return not self.pending and all(n in self.queried for n, addr in self.closest())
+
+
+# Consistent hashing name resolution: each name prefix is registered on the REPLICAS nodes
+# whose ids are closest to the prefix's id, found by iterative Kademlia lookups in O(log n)
+# queries. Messages are sent by ICNProtocol.
+class Resolver:
+    def __init__(self, node_name):
+        self.contacts = Contacts(node_name)
+        self.lookups = {}
+        # Prefix -> (location "host:port:name", expiry time) of the producers registered here
+        self.records = {}
+        # Prefix -> (location, expiry time) found by this node's own lookups
+        self.cache = {}
+        self.joined = False
+
+    def newLookup(self, key, prefix, callback):
+        lid = random.getrandbits(32)
+        lookup = Lookup(lid, key, prefix, self.contacts, callback)
+        self.lookups[lid] = lookup
+        return lookup
+
+    def addRecord(self, prefix, location, ttl=RECORD_TTL):
+        self.records[prefix] = (location, time() + min(ttl, RECORD_TTL))
+
+    def getRecord(self, prefix):
+        return unexpired(self.records, prefix)
+
+    def cacheLocation(self, prefix, location, ttl=CACHE_TTL):
+        self.cache[prefix] = (location, time() + ttl)
+
+    def uncacheLocation(self, prefix):
+        self.cache.pop(prefix, None)
+
+    # Location of the producer of prefix if registered here or found by a recent lookup
+    def getLocation(self, prefix):
+        location = self.getRecord(prefix)
+        if location is None:
+            location = unexpired(self.cache, prefix)
+        return location
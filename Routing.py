@@ -0,0 +1,102 @@
+from time import time
+
+# Seconds between periodic advertisements
+ADVERTISE_INTERVAL = 10
+# Routes not re-advertised for this long are dropped
+ROUTE_TIMEOUT = 3 * ADVERTISE_INTERVAL
+# Routes this many hops long are unreachable
+MAX_COST = 16
+
+
+class Route:
+    def __init__(self, prefix, origin, seq, cost, next_hop):
+        self.prefix = prefix
+        self.origin = origin
+        self.seq = seq
+        self.cost = cost
+        self.next_hop = next_hop
+        self.updated = time()
+
+    def __repr__(self):
+        return f"Route({self.prefix} via {self.next_hop}, origin={self.origin}, seq={self.seq}, cost={self.cost})"
+
+
+# Name prefix a producer advertises for a data name: "dublin_temp" -> "dublin_"
+def namePrefix(data_name):
+    if '_' not in data_name:
+        return data_name
+    return data_name.rsplit('_', 1)[0] + '_'
+
+
+# Candidate prefixes of a data name, longest first: "a_b_c" -> "a_b_c", "a_b_", "a_"
+def prefixesOf(data_name):
+    prefixes = [data_name]
+    i = data_name.rfind('_', 0, len(data_name) - 1)
+    while i != -1:
+        prefixes.append(data_name[:i + 1])
+        i = data_name.rfind('_', 0, i)
+    return prefixes
+
+
+# Distance vector forwarding table built from the name prefixes producers advertise. Each
+# origin numbers its advertisements so that newer information always replaces older.
+class RoutingTable:
+    def __init__(self, node_name):
+        self.node_name = node_name
+        # Sequence number of this node's own advertisements
+        self.seq = 0
+        self.routes = {}
+
+    # Applies an advertised route received from next_hop, cost already including the hop to
+    # next_hop. Returns whether the table changed.
+    def update(self, prefix, origin, seq, cost, next_hop):
+        if origin == self.node_name or cost >= MAX_COST:
+            return False
+        r = self.routes.get(prefix)
+        if r is not None and time() - r.updated <= ROUTE_TIMEOUT:
+            if r.origin == origin:
+                newer = seq > r.seq or (seq == r.seq and cost < r.cost)
+                # The current next hop may also report a worse cost for the same advertisement
+                refresh = r.next_hop == next_hop and seq >= r.seq
+                if not newer and not refresh:
+                    return False
+            elif cost >= r.cost:
+                return False
+        changed = r is None or r.next_hop != next_hop or r.cost != cost
+        self.routes[prefix] = Route(prefix, origin, seq, cost, next_hop)
+        return changed
+
+    def expire(self):
+        t = time()
+        for prefix, r in list(self.routes.items()):
+            if t - r.updated > ROUTE_TIMEOUT:
+                self.routes.pop(prefix)
+
+    # Returns the next hop for the longest advertised prefix of a data name, or None
+    def lookup(self, data_name):
+        for prefix in prefixesOf(data_name):
+            r = self.routes.get(prefix)
+            if r is not None:
+                if time() - r.updated > ROUTE_TIMEOUT:
+                    self.routes.pop(prefix)
+                    continue
+                return r
+        return None
+
+    def removeNextHop(self, node_name):
+        for prefix, r in list(self.routes.items()):
+            if r.next_hop == node_name:
+                self.routes.pop(prefix)
+
+    # Entries [prefix, origin, seq, cost] to advertise to peer: this node's own prefixes at cost
+    # 0 and every route not learned from that peer (split horizon)
+    def advertisement(self, peer, own_prefixes):
+        self.expire()
+        entries = [[p, self.node_name, self.seq, 0] for p in own_prefixes]
+        for r in self.routes.values():
+            if r.next_hop != peer and r.prefix not in own_prefixes:
+                entries.append([r.prefix, r.origin, r.seq, r.cost])
+        return entries
+
+    def __str__(self):
+        return str(list(self.routes.values()))
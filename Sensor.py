@@ -7,6 +7,76 @@ import numpy as np
 import time
 import datetime
 import math
+from multiprocessing import shared_memory
+
+# Parsed historical data by dataset name, shared by every sensor of that dataset
+_datasets = {}
+# Shared memory blocks created or attached by this process and their array shapes, by dataset name
+_shared = {}
+_dates = None
+
+
+# Dates of the historical data, identical for every dataset
+def getDates():
+    global _dates
+    if _dates is None:
+        start = datetime.datetime(2012, 1, 1) #Retrieve historical weather data over the last 10 years
+        end = datetime.datetime(2021, 12, 31)
+        difference = end - start
+        numdays = difference.days
+        dates = [start + datetime.timedelta(days=x) for x in range(numdays)]
+        _dates = np.array(dates)
+    return _dates
+
+
+# Returns (dates, tavg, tmin, tmax) for a dataset in ./temps, parsing the CSV only once
+def loadDataset(name):
+    if name not in _datasets:
+        path = './temps/temperatures_' + name + '.csv'
+        df = np.genfromtxt(path, delimiter=',')
+        df = df[1:,:]
+        _datasets[name] = (getDates(), df[1:,1], df[1:,2], df[1:,3])
+    return _datasets[name]
+
+
+# Copies the historical values of datasets into shared memory so other processes can map them
+# with attachDatasets. Returns {dataset name: (shared memory block name, array shape)}.
+def shareDatasets(names):
+    shared = {}
+    for name in names:
+        if name not in _shared:
+            dates, tavg, tmin, tmax = loadDataset(name)
+            values = np.stack([tavg, tmin, tmax], axis=1)
+            shm = shared_memory.SharedMemory(create=True, size=values.nbytes)
+            np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf)[:] = values
+            _shared[name] = (shm, values.shape)
+            # The shared copy is the only one needed from now on
+            _datasets.pop(name)
+        shm, shape = _shared[name]
+        shared[name] = (shm.name, shape)
+    return shared
+
+
+# Maps datasets shared by another process into this process's dataset cache. A forked worker
+# inherits the creator's blocks, already mapped, but not the datasets themselves.
+def attachDatasets(shared):
+    for name, (shm_name, shape) in shared.items():
+        if name in _datasets:
+            continue
+        if name not in _shared:
+            _shared[name] = (shared_memory.SharedMemory(name=shm_name), shape)
+        shm, shape = _shared[name]
+        values = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        _datasets[name] = (getDates(), values[:,0], values[:,1], values[:,2])
+
+
+# Frees the shared memory blocks created by shareDatasets, once no process uses them
+def unlinkDatasets():
+    for name, (shm, shape) in _shared.items():
+        _datasets.pop(name, None)
+        shm.close()
+        shm.unlink()
+    _shared.clear()
 
 
 class Sensor:
@@ -16,19 +86,7 @@ class Sensor:
         self.name = name
         self.interval = interval
         self.last_update = 0
-        path = './temps/temperatures_' + self.name + '.csv'
-        df = np.genfromtxt(path, delimiter=',')
-        df = df[1:,:]
-        start = datetime.datetime(2012, 1, 1) #Retrieve historical weather data over the last 10 years
-        end = datetime.datetime(2021, 12, 31)
-        difference = end - start
-        numdays = difference.days
-        dates = [start + datetime.timedelta(days=x) for x in range(numdays)]
-        
-        self.time = np.array(dates)
-        self.tavg = df[1:,1]
-        self.tmin = df[1:,2]
-        self.tmax = df[1:,3]
+        self.time, self.tavg, self.tmin, self.tmax = loadDataset(self.name)
 
         self.lastvalue = self.get_longtermaverage()
     
@@ -200,4 +258,83 @@ class TempSensor(Sensor):
         std_dev = self.get_longtermstandarddev()/math.sqrt(24*60) #decrease daily std dev to a smaller value to represent noise in minute data
         prediction = np.random.normal(mean, std_dev) #simulate using a normal distr approximation
         self.lastvalue = prediction
-        return prediction
\ No newline at end of file
+        return prediction
+
+# Update rules of the sensor classes above as (scale, shift, out_scale, out_shift, post) so that
+# a SensorFarm can update many sensors at once: the new value is
+# out_scale * N(scale * mean + shift, scale * std_dev) + out_shift, then made positive ('abs') or
+# clipped at 0 ('clip')
+FARM_MODELS = {
+    'temp': (1, 0, 1, 0, None),
+    'per': (1, -4, 1 / 6, 0, 'abs'),
+    'hum': (1, 0, -1, 100, None),
+    'bar': (1, 0, 0.25, 250, None),
+    'cloud': (3, 0, -1, 100, None),
+    'snow': (1, -50, 1, 0, 'clip'),
+    'water': (1, 0, 0.5, 20, None),
+    'wind': (1, 30, 0.5, 0, None),
+}
+
+
+# Many sensors of the types in FARM_MODELS updated together with array operations. Producer i is
+# backed by dataset datasets[i] and has one sensor per type, values[i, j] being that of types[j].
+class SensorFarm:
+    def __init__(self, datasets, types, interval):
+        self.types = list(types)
+        self.interval = interval
+        self.last_update = 0
+        unique = sorted(set(datasets))
+        self.datasets = unique
+        ids = {name: i for i, name in enumerate(unique)}
+        self.rows = np.array([ids[name] for name in datasets])
+        models = np.array([FARM_MODELS[t][:4] for t in self.types], dtype=np.float64)
+        self.scale, self.shift, self.out_scale, self.out_shift = models.T
+        self.abs = np.array([FARM_MODELS[t][4] == 'abs' for t in self.types])
+        self.clip = np.array([FARM_MODELS[t][4] == 'clip' for t in self.types])
+        self.rng = np.random.default_rng()
+        self.stats_key = None
+        self.stats = None
+        average, corrected, std_dev = self.longTermStats()
+        # Sensors start at the long term average, as in Sensor
+        self.values = np.repeat(average[self.rows][:, None], len(self.types), axis=1)
+
+    # Long term average, average corrected for the hour and noise std dev of every dataset, as
+    # computed by Sensor. They only change with the hour so they are cached until then.
+    def longTermStats(self):
+        now = datetime.datetime.now()
+        key = (now.month, now.day, now.hour)
+        if key != self.stats_key:
+            dates = getDates()
+            mask = np.array([d.day == now.day and d.month == now.month for d in dates])
+            average, corrected, std_dev = [], [], []
+            for name in self.datasets:
+                d, tavg, tmin, tmax = loadDataset(name)
+                n = len(mask)
+                t = np.arange(1, mask.sum() + 1)
+                utilities = 1.5 * (1 - np.power(t, 2))
+                weights = utilities / utilities.sum()
+                weighted_tmin = weights @ tmin[:n][mask]
+                weighted_tmax = weights @ tmax[:n][mask]
+                average.append(weights @ tavg[:n][mask])
+                corrected.append(weighted_tmax - (weighted_tmax - weighted_tmin) / 12 * abs(now.hour - 12))
+                std_dev.append((weighted_tmax - weighted_tmin) / 4 / math.sqrt(24 * 60))
+            self.stats = (np.array(average), np.array(corrected), np.array(std_dev))
+            self.stats_key = key
+        return self.stats
+
+    def update(self):
+        t = time.time()
+        if t < self.last_update + self.interval:
+            return
+        self.last_update = t
+        average, corrected, std_dev = self.longTermStats()
+        mean = 0.2 * corrected[self.rows][:, None] + 0.8 * self.values
+        noise = self.rng.standard_normal(self.values.shape) * std_dev[self.rows][:, None]
+        values = self.out_scale * (self.scale * (mean + noise) + self.shift) + self.out_shift
+        values[:, self.abs] = np.abs(values[:, self.abs])
+        values[:, self.clip] = np.maximum(values[:, self.clip], 0)
+        # Replaced whole so that readers on other threads see either the old or the new values
+        self.values = values
+
+    def getValue(self, producer, type_index):
+        return (float(self.values[producer, type_index]), self.interval)
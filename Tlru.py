@@ -4,11 +4,16 @@ from collections import OrderedDict
 
 
 class TLRU_Table:
-    def __init__(self, size, count=1):
+    def __init__(self, size, count=1, stale=0, listener=None):
         self.vals = OrderedDict()
         self.times = {}
         self.counts = {}
         self.size = size
+        # Entries past their TTU are kept for this many seconds as stale copies
+        self.stale_time = stale
+        self.stale = OrderedDict()
+        # Told of names entering and leaving the table through added(name) and removed(name)
+        self.listener = listener
 
     def contains(self, data_name):
         self.evalutateTTU()
@@ -18,10 +23,26 @@ class TLRU_Table:
             return False
 
     def evalutateTTU(self):
+        t = time()
         for data_name, use_time in self.times.copy().items():
-            if time() > use_time:
-                self.vals.pop(data_name)
+            if t > use_time:
+                val = self.vals.pop(data_name)
                 self.times.pop(data_name)
+                self.notifyRemoved(data_name)
+                if self.stale_time > 0:
+                    self.stale[data_name] = (val, use_time)
+                    if len(self.stale) > self.size:
+                        self.stale.popitem(last=False)
+        for data_name, (val, use_time) in self.stale.copy().items():
+            if t > use_time + self.stale_time:
+                self.stale.pop(data_name)
+
+    # Returns the expired value and TTU of an entry still within its stale period, or None
+    def getStale(self, data_name):
+        self.evalutateTTU()
+        if data_name in self.stale:
+            return self.stale[data_name]
+        return None
 
     def get(self, data_name):
         self.vals.move_to_end(data_name)
@@ -31,6 +52,7 @@ class TLRU_Table:
         (k, v) = self.vals.popitem(last=False)
         self.times.pop(k)
         self.counts.pop(k)
+        self.notifyRemoved(k)
 
     def add(self, data_name, data_val, ttu=32500000000, count=1):
         if time() > ttu:
@@ -40,6 +62,9 @@ class TLRU_Table:
                 return
         elif len(self.vals) >= self.size:
             self.removeLRU()
+        if self.listener is not None and data_name not in self.vals:
+            self.listener.added(data_name)
+        self.stale.pop(data_name, None)
         self.times[data_name] = ttu
         self.vals[data_name] = data_val
         self.counts[data_name] = count
@@ -50,6 +75,7 @@ class TLRU_Table:
                 val = self.vals.pop(data_name)
                 self.times.pop(data_name)
                 self.counts.pop(data_name)
+                self.notifyRemoved(data_name)
                 return val, 0
             else:
                 self.counts[data_name] -= 1
@@ -61,10 +87,15 @@ class TLRU_Table:
             val = self.vals.pop(data_name)
             self.times.pop(data_name)
             self.counts.pop(data_name)
+            self.notifyRemoved(data_name)
             return val, 0
         else:
             return None, -1
 
+    def notifyRemoved(self, data_name):
+        if self.listener is not None:
+            self.listener.removed(data_name)
+
     def __str__(self):
         return str(self.vals) + '\n' + str(self.counts)
 
@@ -0,0 +1,35 @@
+from collections import namedtuple
+
+TWISTED = 'twisted'
+ASYNCIO = 'asyncio'
+BACKENDS = [TWISTED, ASYNCIO]
+DEFAULT_BACKEND = TWISTED
+
+# Peer address as returned by getPeer(), mirrors the host/port attributes of Twisted's IPv4Address
+Address = namedtuple('Address', ['host', 'port'])
+
+# One instance per backend so that every node in a process shares the same event loop
+_transports = {}
+
+
+# Returns the transport backend with the given name. Backends expose the subset of the Twisted
+# reactor API the nodes use (callLater, callFromThread, run, stop) plus listen/connect, and are
+# only imported when selected so an asyncio node never loads Twisted and vice versa.
+def getTransport(name=None, loop=None):
+    if name is None:
+        name = DEFAULT_BACKEND
+    elif not isinstance(name, str):
+        # Already a transport instance
+        return name
+    if name in _transports:
+        return _transports[name]
+    if name == TWISTED:
+        from TwistedTransport import TwistedTransport
+        transport = TwistedTransport()
+    elif name == ASYNCIO:
+        from AsyncioTransport import AsyncioTransport
+        transport = AsyncioTransport(loop)
+    else:
+        raise ValueError(f"Unknown transport backend {name}, expected one of {BACKENDS}")
+    _transports[name] = transport
+    return transport
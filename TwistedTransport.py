@@ -0,0 +1,86 @@
+from twisted.internet.protocol import Protocol, Factory
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implementer
+from twisted.internet.endpoints import TCP4ServerEndpoint
+from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
+from twisted.internet import reactor
+from twisted.internet.error import ConnectError, DNSLookupError
+import logging
+
+
+# Adapts a backend independent NodeProtocol to a Twisted protocol. Registered as the transport's
+# producer so the NodeProtocol is paused while the transport's write buffer is full.
+@implementer(IPushProducer)
+class _TwistedProtocol(Protocol):
+    def __init__(self, node_protocol):
+        self.node_protocol = node_protocol
+
+    def connectionMade(self):
+        self.transport.registerProducer(self, True)
+        self.node_protocol.makeConnection(self.transport)
+
+    def pauseProducing(self):
+        self.node_protocol.pauseProducing()
+
+    def resumeProducing(self):
+        self.node_protocol.resumeProducing()
+
+    def stopProducing(self):
+        self.node_protocol.stopProducing()
+
+    def dataReceived(self, data):
+        self.node_protocol.dataReceived(data)
+
+    def connectionLost(self, reason):
+        self.node_protocol.connectionLost(reason)
+
+
+class _TwistedFactory(Factory):
+    def __init__(self, factory):
+        self.factory = factory
+
+    def buildProtocol(self, addr):
+        return _TwistedProtocol(self.factory.buildProtocol(addr))
+
+
+class TwistedTransport:
+    name = 'twisted'
+
+    def __init__(self):
+        self.reactor = reactor
+
+    # Returns a listener handle for stopListening
+    def listen(self, port, factory):
+        endp = TCP4ServerEndpoint(self.reactor, port)
+        return endp.listen(_TwistedFactory(factory))
+
+    def stopListening(self, listener):
+        listener.addCallback(lambda port: port.stopListening())
+
+    # Calls callback(protocol, *args) once connected, or callback(None, *args) if the connection
+    # failed (refused, unreachable, timed out or the host name did not resolve)
+    def connect(self, addr, port, protocol, callback, *args):
+        endp = TCP4ClientEndpoint(self.reactor, addr, port)
+        d = connectProtocol(endp, _TwistedProtocol(protocol))
+        d.addCallback(lambda p: p.node_protocol)
+        d.addErrback(self.errorHandler)
+        d.addCallback(callback, *args)
+        return d
+
+    def errorHandler(self, e):
+        # DNSLookupError is not a ConnectError
+        e.trap(ConnectError, DNSLookupError)
+        logging.debug(f"Connection failed: {e.value}")
+        return None
+
+    def callLater(self, delay, f, *args, **kwargs):
+        return self.reactor.callLater(delay, f, *args, **kwargs)
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.reactor.callFromThread(f, *args, **kwargs)
+
+    def run(self, installSignalHandlers=True):
+        self.reactor.run(installSignalHandlers=installSignalHandlers)
+
+    def stop(self):
+        self.reactor.stop()
@@ -1,7 +1,9 @@
 # Dara
-from Node import Node
-from twisted.internet import reactor
+from Node import Node, PIT_SIZE, REQUEST_RATE, REQUEST_BURST
 from threading import Thread
+import CachePolicy
+import LoadGen
+import Transport
 import logging
 import argparse
 import time
@@ -9,6 +11,17 @@ import time
 
 class UserNode(Node):
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Load mode state, see runWorkload
+        self.results = None
+        self.results_path = None
+        self.workload = None
+        self.workload_start = None
+        self.workload_ttw = None
+        # Start times of the load mode requests waiting for data, by data name
+        self.outstanding = {}
+
     def readInput(self):
         inp = input("Data name or quit: \n")
         if inp == "quit":
@@ -21,8 +34,64 @@ class UserNode(Node):
         return True
 
     def run(self):
-        self.reactor = reactor
         self.reactor.run(installSignalHandlers=0)
+        self.closeTrace()
+
+    # Non-interactive load mode: issues the (offset, data name) requests of a workload at their
+    # offsets from now, records every outcome in results and writes them to results_path once
+    # the last request has completed or timed out.
+    def runWorkload(self, workload, results_path, ttw=10):
+        self.results = LoadGen.Results()
+        self.results_path = results_path
+        self.workload = iter(workload)
+        self.workload_start = time.time()
+        self.workload_ttw = ttw
+        self.scheduleNext()
+
+    def scheduleNext(self):
+        item = next(self.workload, None)
+        if item is None:
+            self.reactor.callLater(self.workload_ttw, self.finishWorkload)
+            return
+        offset, data_name = item
+        self.reactor.callLater(max(0, self.workload_start + offset - time.time()), self.issueRequest, data_name)
+
+    def issueRequest(self, data_name):
+        start = time.time()
+        self.outstanding.setdefault(data_name, []).append(start)
+        self.reactor.callLater(self.workload_ttw, self.timeoutRequest, data_name, start)
+        self.requestData(data_name, self.workload_ttw)
+        self.scheduleNext()
+
+    def completeRequests(self, data_name, outcome):
+        t = time.time()
+        for start in self.outstanding.pop(data_name, []):
+            self.results.add(data_name, start, t - start, outcome)
+
+    def timeoutRequest(self, data_name, start):
+        starts = self.outstanding.get(data_name, [])
+        if start in starts:
+            starts.remove(start)
+            self.results.add(data_name, start, self.workload_ttw, LoadGen.TIMEOUT)
+
+    def finishWorkload(self):
+        for data_name, starts in self.outstanding.items():
+            for start in starts:
+                self.results.add(data_name, start, self.workload_ttw, LoadGen.TIMEOUT)
+        self.outstanding = {}
+        self.results.write(self.results_path)
+        logging.warning(f"Load run finished, {self.results.summary()}. Results written to {self.results_path}")
+        self.reactor.stop()
+
+    def useData(self, data_name, data_val, stale=False):
+        super().useData(data_name, data_val, stale)
+        if self.results is not None:
+            self.completeRequests(data_name, LoadGen.STALE if stale else LoadGen.OK)
+
+    def dataFailed(self, data_name):
+        super().dataFailed(data_name)
+        if self.results is not None:
+            self.completeRequests(data_name, LoadGen.FAIL)
 
 
 def main():
@@ -32,6 +101,25 @@ def main():
     parser.add_argument('--data-n', help='Data name for this node', type=str, default=None)
     parser.add_argument('--data-v', help='Data for the node', type=str, default="10")
     parser.add_argument('--logging-level', help='Logging level: 10 - Debug, 20 - Info, 30 - Warnings', type=int, default=20)
+    parser.add_argument('--transport', help='Transport backend', choices=Transport.BACKENDS, default=Transport.DEFAULT_BACKEND)
+    parser.add_argument('--cache-policy', help='On-path caching policy', choices=list(CachePolicy.POLICIES), default=CachePolicy.LCE)
+    parser.add_argument('--topology', help='Topology file of emulated link delays, losses and bandwidths', type=str, default=None)
+    parser.add_argument('--resolver', help='Take part in the resolver overlay mapping name prefixes to producers', action='store_true')
+    parser.add_argument('--trace-file', help='Record a binary event trace to this file, see EventTrace.py', type=str, default=None)
+    parser.add_argument('--pit-size', help='Entries of the PIT and locations tables, raise for load runs with many names in flight', type=int, default=PIT_SIZE)
+    parser.add_argument('--request-rate', help='Requests accepted from each node per second', type=float, default=REQUEST_RATE)
+    parser.add_argument('--request-burst', help='Requests accepted from each node in a burst', type=int, default=REQUEST_BURST)
+    parser.add_argument('--workload', help='Run non-interactively, generating requests with this popularity model', choices=LoadGen.WORKLOADS, default=None)
+    parser.add_argument('--trace', help='Run non-interactively, replaying the "timestamp,name" requests in this file', type=str, default=None)
+    parser.add_argument('--rate', help='Generated requests per second', type=float, default=10)
+    parser.add_argument('--duration', help='Seconds of generated requests', type=float, default=60)
+    parser.add_argument('--zipf-s', help='Exponent of the Zipf popularity model', type=float, default=1.0)
+    parser.add_argument('--cities', help='Cities of the generated data names, defaults to all datasets in temps/', type=str, nargs='+', default=None)
+    parser.add_argument('--farm-replicas', help='Include the names of this many producer farm replicas per city', type=int, default=1)
+    parser.add_argument('--seed', help='Random seed of the generated workload', type=int, default=None)
+    parser.add_argument('--warmup', help='Seconds to wait for the network before starting the load', type=float, default=5)
+    parser.add_argument('--ttw', help='Time to wait for each request of the load', type=float, default=10)
+    parser.add_argument('--results', help='Results file of the load run', type=str, default='results.bin')
     args = parser.parse_args()
 
     if args.node_name is None:
@@ -43,12 +131,28 @@ def main():
         exit(1)
 
     logging.basicConfig(level=args.logging_level, format='{0:8}%(levelname)-8s %(message)s'.format(args.node_name + ':'))
-    n = UserNode(args.node_name, args.port, args.data_n, args.data_v)
+    n = UserNode(args.node_name, args.port, args.data_n, args.data_v, args.transport, args.cache_policy, args.topology, args.trace_file,
+                 resolver=args.resolver, pit_size=args.pit_size, request_rate=args.request_rate, request_burst=args.request_burst)
+
+    if args.trace is not None or args.workload is not None:
+        if args.trace is not None:
+            workload = LoadGen.readTrace(args.trace)
+        else:
+            workload = LoadGen.generateWorkload(LoadGen.nameSpace(args.cities, replicas=args.farm_replicas), args.rate, args.duration, args.workload,
+                                                args.zipf_s, args.seed)
+        n.reactor.callLater(args.warmup, n.runWorkload, workload, args.results, args.ttw)
+        n.reactor.run()
+        n.closeTrace()
+        return
+
     th = Thread(target=n.run, daemon=True)
     th.start()
     receive_input = True
     while receive_input:
         receive_input = n.readInput()
+    # The reactor thread still records events, so it closes the trace itself once stopped
+    n.reactor.callFromThread(n.reactor.stop)
+    th.join()
 
 
 if __name__ == "__main__":
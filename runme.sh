@@ -1,12 +1,9 @@
 #!/bin/sh
-python3 Node.py --node-name Pi1 --port 33011 --data-n dublin &
+python3 Host.py --node Pi1:33011:dublin --node Pi2:33012:beijing --node Pi3:33013:capetown --node Pi4:33014:doha &
 
-sleep 8
-
-python3 Node.py --node-name Pi2 --port 33012 --data-n beijing &
-
-python3 Node.py --node-name Pi3 --port 33013 --data-n capetown &
-
-python3 Node.py --node-name Pi4 --port 33014 --data-n doha &
+# The host starts Pi1 first and the others once it is the network root
+sleep 3
 
 python3 UserNode.py --node-name Pi5 --port 33015 --data-n amsterdam
+
+python3 Host.py --control stop
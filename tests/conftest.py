@@ -0,0 +1,22 @@
+import os
+import sys
+import pytest
+
+# The node modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import Bloom
+import Resolver
+import Routing
+
+# Modules whose expiry times the clock fixture controls
+CLOCKED = [Bloom, Resolver, Routing]
+
+
+# Fake time for the CLOCKED modules, starting at 1000 and moved by assigning to clock[0]
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    for module in CLOCKED:
+        monkeypatch.setattr(module, 'time', lambda: now[0])
+    return now
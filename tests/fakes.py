@@ -0,0 +1,207 @@
+from collections import deque
+from Transport import Address
+from time import time
+import json
+
+
+# Scheduled call of a FakeReactor, offering the cancel() of Twisted's DelayedCall and asyncio's TimerHandle
+class FakeCall:
+    def __init__(self, reactor, time, f, args, kwargs):
+        self.reactor = reactor
+        self.time = time
+        self.f = f
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.called = False
+
+    def cancel(self):
+        assert not self.called and not self.cancelled
+        self.cancelled = True
+
+    def active(self):
+        return not self.called and not self.cancelled
+
+
+# Transport backend that never touches the network. Its clock starts at the current time and
+# only moves on advance(), which runs the calls that have become due.
+class FakeReactor:
+    name = 'fake'
+
+    def __init__(self):
+        self.now = time()
+        self.calls = []
+        self.connects = []
+        # LoopbackNetwork that connections are made on, if any
+        self.network = None
+        self.stopped = False
+
+    def listen(self, port, factory):
+        return port
+
+    def stopListening(self, listener):
+        pass
+
+    def connect(self, addr, port, protocol, callback, *args):
+        self.connects.append((addr, port, protocol, callback, args))
+        if self.network is not None:
+            self.network.dial(port, protocol, callback, args)
+
+    def callLater(self, delay, f, *args, **kwargs):
+        call = FakeCall(self, self.now + delay, f, args, kwargs)
+        self.calls.append(call)
+        return call
+
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+    def pending(self, f=None):
+        return [c for c in self.calls if c.active() and (f is None or c.f == f)]
+
+    def seconds(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+        while True:
+            due = [c for c in self.pending() if c.time <= self.now]
+            if not due:
+                return
+            call = min(due, key=lambda c: c.time)
+            call.called = True
+            call.f(*call.args, **call.kwargs)
+
+    def stop(self):
+        self.stopped = True
+
+
+# FakeReactor used from another thread, such as a Host worker's command thread. Calls from
+# that thread are queued until runCalls(), as a running reactor would run them on its own thread.
+class ThreadedFakeReactor(FakeReactor):
+    def __init__(self):
+        super().__init__()
+        self.thread_calls = []
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.thread_calls.append((f, args, kwargs))
+
+    def runCalls(self):
+        while self.thread_calls:
+            f, args, kwargs = self.thread_calls.pop(0)
+            f(*args, **kwargs)
+
+
+# Peer connection recording the messages sent on it
+class FakeConnection:
+    def __init__(self, peer_name=None, host='127.0.0.1', port=33010):
+        self.peer_name = peer_name
+        self.codec = None
+        self.transient = False
+        self.connected = True
+        self.transport = self
+        self.address = Address(host, port)
+        self.sent = []
+        # Frames sent without a message, i.e. heartbeats
+        self.frames = []
+
+    def sendMsg(self, msg, priority=None):
+        self.sent.append(json.loads(msg))
+
+    def sendFrame(self, data, priority=None):
+        self.frames.append(data)
+
+    def getPeer(self):
+        return self.address
+
+    def disconnect(self):
+        self.connected = False
+
+    # (type, content) of the messages sent, optionally only those of one type
+    def messages(self, msg_type=None):
+        return [(m['type'], json.loads(m['content'])) for m in self.sent if msg_type is None or m['type'] == msg_type]
+
+
+def makeNode(name='Pi1', port=33011, **kwargs):
+    from Node import Node
+    node = Node(name, port, transport=FakeReactor(), **kwargs)
+    # Stops the sensor update thread
+    node.running = False
+    return node
+
+
+# Makes node_name a peer of node, connected through a FakeConnection
+def addPeer(node, node_name, port=33012):
+    connection = FakeConnection(node_name, port=port)
+    node.peers.setAddr(node_name, f"127.0.0.1:{port}")
+    node.peers.setConnection(node_name, connection)
+    node.addPeer(node_name)
+    return connection
+
+
+# Connects nodes through pairs of FakeConnections whose messages are queued until run()
+class LoopbackNetwork:
+    def __init__(self):
+        self.queue = deque()
+        # Nodes by listening port
+        self.nodes = {}
+        self.connections = []
+
+    def add(self, node):
+        node.reactor.network = self
+        self.nodes[node.icn.ip_node.port] = node
+
+    # Connection attempt by the IPNode owning protocol, refused unless a node listens on port
+    def dial(self, port, protocol, callback, args):
+        target = self.nodes.get(port)
+        if target is None:
+            callback(None, *args)
+            return
+        at_a, at_b = self.connect(protocol.factory.icn_protocol.node, target)
+        at_a.transient = protocol.transient
+        callback(at_a, *args)
+
+    # Returns the ends of a connection at a and at b
+    def connect(self, a, b):
+        at_a = LoopbackConnection(self, a, port=b.icn.ip_node.port)
+        at_b = LoopbackConnection(self, b, port=a.icn.ip_node.port)
+        at_a.remote, at_b.remote = at_b, at_a
+        self.connections += [at_a, at_b]
+        return at_a, at_b
+
+    def open(self):
+        return [c for c in self.connections if c.connected]
+
+    # Delivers queued messages, and those they trigger, in the order they were sent
+    def run(self):
+        while self.queue:
+            connection, msg = self.queue.popleft()
+            if connection.connected:
+                connection.node.icn.handleMsg(msg, connection)
+
+
+class LoopbackConnection(FakeConnection):
+    def __init__(self, network, node, port):
+        super().__init__(port=port)
+        self.network = network
+        self.node = node
+        self.remote = None
+
+    def sendMsg(self, msg, priority=None):
+        super().sendMsg(msg, priority)
+        self.network.queue.append((self.remote, msg))
+
+    # Closes both ends, like TCP
+    def disconnect(self):
+        self.connected = False
+        self.remote.connected = False
+
+
+# Makes a join the network through b, with a complete ANNOUNCE/ACKNOWLEDGE handshake
+def handshake(network, a, b):
+    network.add(a)
+    network.add(b)
+    b.icn.ip_node.part_of_network = True
+    at_a, at_b = network.connect(a, b)
+    at_a.sendMsg(a.icn.getAnnounce())
+    network.run()
+    return at_a, at_b
@@ -0,0 +1,28 @@
+import asyncio
+import socket
+from AsyncioTransport import AsyncioTransport
+
+
+def connectResult(addr, port):
+    loop = asyncio.new_event_loop()
+    transport = AsyncioTransport(loop)
+    results = []
+    try:
+        loop.run_until_complete(transport.startConnection(addr, port, object(), lambda p, *args: results.append((p, args)), 'x'))
+    finally:
+        loop.close()
+    return results
+
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_refused_connection_calls_back_with_none():
+    assert connectResult('127.0.0.1', freePort()) == [(None, ('x',))]
+
+
+def test_unresolvable_host_calls_back_with_none():
+    assert connectResult('256.256.256.256', 33010) == [(None, ('x',))]
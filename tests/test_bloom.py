@@ -0,0 +1,60 @@
+import json
+from Bloom import BloomFilter, DeadNonceList
+from fakes import makeNode, addPeer
+
+
+def test_bloom_filter_has_no_false_negatives():
+    f = BloomFilter(1 << 12, 4)
+    keys = [f"dublin_temp:{i}" for i in range(200)]
+    for k in keys:
+        f.add(k)
+    assert all(k in f for k in keys)
+    f.clear()
+    assert not any(k in f for k in keys)
+
+
+def test_bloom_filter_false_positive_rate():
+    # 500 keys in 2^16 bits with 4 hashes: expected rate about 1e-6
+    f = BloomFilter()
+    for i in range(500):
+        f.add(f"in:{i}")
+    false_positives = sum(f"out:{i}" in f for i in range(10000))
+    assert false_positives <= 5
+
+
+def test_dead_nonces_remembered_for_their_lifetime(clock):
+    nonces = DeadNonceList(lifetime=6, generations=2)
+    nonces.add('dublin_temp:1')
+    clock[0] += 5.9
+    assert 'dublin_temp:1' in nonces
+    assert 'dublin_temp:2' not in nonces
+    # Forgotten at the latest one rotation period after the lifetime
+    clock[0] += nonces.period + 0.2
+    assert 'dublin_temp:1' not in nonces
+
+
+def test_dead_nonces_cleared_after_idling(clock):
+    nonces = DeadNonceList(lifetime=6, generations=3)
+    nonces.add('dublin_temp:1')
+    clock[0] += 100
+    assert 'dublin_temp:1' not in nonces
+    nonces.add('dublin_temp:2')
+    assert 'dublin_temp:2' in nonces
+
+
+def request(node_name, data_name, nonce):
+    content = json.dumps({'data_name': data_name, 'time_to_wait': 1e12, 'hops': 1, 'betweenness': 0, 'nonce': nonce})
+    return json.dumps({'id': node_name, 'type': 'REQUEST', 'content': content, 'ttl': 5})
+
+
+def test_looped_request_is_failed():
+    node = makeNode()
+    pi2, pi3 = addPeer(node, 'Pi2', 33012), addPeer(node, 'Pi3', 33013)
+    node.icn.handleMsg(request('Pi2', 'dublin_temp', 7))
+    assert [c['nonce'] for t, c in pi3.messages('REQUEST')] == [7]
+    # The same request comes back from Pi3 after going round a loop
+    node.icn.handleMsg(request('Pi3', 'dublin_temp', 7))
+    assert [c['data_name'] for t, c in pi3.messages('FAIL')] == ['dublin_temp']
+    assert pi2.messages('FAIL') == []
+    # A new request for the name is not a loop
+    assert not node.seenNonce('dublin_temp', 8)
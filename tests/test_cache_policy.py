@@ -0,0 +1,65 @@
+import random
+from time import time
+import pytest
+import CachePolicy
+from Popularity import RequestRates
+
+
+class FakeNode:
+    def __init__(self, peers=(), rates=None):
+        self.peers = list(peers)
+        self.rates = rates or RequestRates()
+
+
+def test_base_policy_is_abstract():
+    with pytest.raises(TypeError):
+        CachePolicy.CachePolicy()
+
+
+def test_get_policy():
+    for name, cls in CachePolicy.POLICIES.items():
+        assert isinstance(CachePolicy.getPolicy(name), cls)
+    with pytest.raises(ValueError):
+        CachePolicy.getPolicy('lru')
+
+
+def test_leave_copy_everywhere():
+    assert CachePolicy.getPolicy(CachePolicy.LCE).admit(FakeNode(), 'dublin_temp', 3, 4, 0)
+
+
+def test_leave_copy_down_caches_one_hop_below_the_source():
+    lcd = CachePolicy.getPolicy(CachePolicy.LCD)
+    assert lcd.admit(FakeNode(), 'dublin_temp', 1, 4, 0)
+    assert not lcd.admit(FakeNode(), 'dublin_temp', 2, 4, 0)
+    # Data from peers that do not report hops
+    assert lcd.admit(FakeNode(), 'dublin_temp', None, None, None)
+
+
+def test_prob_cache_favours_relays_near_the_requester():
+    random.seed(1)
+    prob = CachePolicy.ProbCache(t_tw=2)
+    near_source = sum(prob.admit(FakeNode(), 'dublin_temp', 1, 4, 0) for i in range(2000))
+    near_requester = sum(prob.admit(FakeNode(), 'dublin_temp', 4, 4, 0) for i in range(2000))
+    assert near_source < near_requester
+    assert prob.admit(FakeNode(), 'dublin_temp', None, None, None)
+
+
+def test_betweenness_caches_at_the_most_central_relay():
+    btw = CachePolicy.getPolicy(CachePolicy.BTW)
+    node = FakeNode(['Pi1', 'Pi2', 'Pi3'])
+    assert CachePolicy.centrality(node) == 3
+    assert btw.admit(node, 'dublin_temp', 1, 2, 3)
+    assert not btw.admit(node, 'dublin_temp', 1, 2, 4)
+
+
+def test_popularity_caches_names_requested_often():
+    rates = RequestRates(window=10)
+    t = time()
+    for i in range(10):
+        rates.record('dublin_temp', t - 9 + i)
+    rates.record('doha_temp', t)
+    pop = CachePolicy.Popularity(min_rate=0.5)
+    node = FakeNode(rates=rates)
+    assert pop.admit(node, 'dublin_temp', 1, 1, 0)
+    assert not pop.admit(node, 'doha_temp', 1, 1, 0)
+    assert not pop.admit(node, 'beijing_temp', 1, 1, 0)
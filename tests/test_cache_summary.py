@@ -0,0 +1,104 @@
+from time import time
+import CacheSummary
+from Bloom import CountingBloomFilter
+from CacheSummary import applySummary
+from Tlru import TLRU_Table
+from fakes import makeNode, LoopbackNetwork, handshake
+
+
+def test_counting_bloom_filter_removes_keys():
+    f = CountingBloomFilter(1 << 10, 3)
+    f.add('dublin_temp')
+    f.add('doha_temp')
+    f.add('doha_temp')
+    f.remove('dublin_temp')
+    assert 'dublin_temp' not in f
+    # Added twice, so still present after one removal
+    f.remove('doha_temp')
+    assert 'doha_temp' in f
+    f.remove('doha_temp')
+    assert 'doha_temp' not in f
+    assert not any(f.counters)
+
+
+def test_counting_bloom_filter_saturates():
+    f = CountingBloomFilter(8, 1)
+    for i in range(300):
+        f.add('dublin_temp')
+    for i in range(300):
+        f.remove('dublin_temp')
+    # A saturated counter no longer knows how many keys it counts, so it stays set
+    assert 'dublin_temp' in f
+
+
+def test_counting_bloom_filter_to_bloom_filter():
+    f = CountingBloomFilter(1 << 10, 3)
+    for k in ['dublin_temp', 'doha_temp']:
+        f.add(k)
+    plain = f.toBloomFilter()
+    assert 'dublin_temp' in plain and 'doha_temp' in plain
+    assert sum(bin(b).count('1') for b in plain.bits) == sum(1 for c in f.counters if c)
+
+
+def test_updates_carry_only_changed_bits():
+    summary = CacheSummary.CacheSummary()
+    held, version = applySummary(None, None, summary.full())
+    summary.added('dublin_temp')
+    update = summary.update()
+    assert CacheSummary.BITS not in update
+    assert 0 < len(update[CacheSummary.SET]) <= CacheSummary.SUMMARY_HASHES and update[CacheSummary.CLR] == []
+    held, version = applySummary(held, version, update)
+    assert 'dublin_temp' in held and version == summary.version
+    summary.removed('dublin_temp')
+    held, version = applySummary(held, version, summary.update())
+    assert 'dublin_temp' not in held
+
+
+def test_unchanged_cache_sends_nothing_but_periodic_full_summaries():
+    summary = CacheSummary.CacheSummary()
+    updates = [summary.update() for i in range(CacheSummary.FULL_EVERY)]
+    assert updates[:-1] == [None] * (CacheSummary.FULL_EVERY - 1)
+    assert CacheSummary.BITS in updates[-1]
+
+
+def test_missed_update_is_rejected_until_the_next_full_summary():
+    summary = CacheSummary.CacheSummary()
+    held, version = applySummary(None, None, summary.full())
+    summary.added('dublin_temp')
+    summary.update()
+    summary.added('doha_temp')
+    # The previous update never arrived
+    assert applySummary(held, version, summary.update()) == (None, None)
+    # Nor do changes apply before a full summary was received
+    summary.added('tokyo_temp')
+    assert applySummary(None, None, summary.update()) == (None, None)
+    while True:
+        update = summary.update()
+        if update is not None and CacheSummary.BITS in update:
+            break
+    held, version = applySummary(None, None, update)
+    assert all(n in held for n in ['dublin_temp', 'doha_temp', 'tokyo_temp'])
+
+
+def test_cache_table_keeps_summary_in_step():
+    summary = CacheSummary.CacheSummary()
+    cache = TLRU_Table(2, listener=summary)
+    cache.add('dublin_temp', 'v', time() + 30)
+    cache.add('doha_temp', 'v', time() + 30)
+    # Evicts dublin_temp
+    cache.add('tokyo_temp', 'v', time() + 30)
+    assert 'dublin_temp' not in summary.counts
+    assert 'doha_temp' in summary.counts and 'tokyo_temp' in summary.counts
+    cache.remove('doha_temp')
+    assert 'doha_temp' not in summary.counts
+
+
+def test_full_summary_exchanged_during_handshake():
+    network = LoopbackNetwork()
+    cache, relay = makeNode('Pi1', 33011), makeNode('Pi2', 33012)
+    cache.cacheData('dublin_temp', 'v', time() + 30)
+    cache.getSummaryUpdate()
+    handshake(network, cache, relay)
+    # The accepting end holds the other's summary straight away, not only after FULL_EVERY periods
+    assert relay.getCachePeer('dublin_temp') == 'Pi1'
+    assert cache.peers.getState('Pi2').summary is not None
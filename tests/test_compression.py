@@ -0,0 +1,56 @@
+import json
+import os
+import pytest
+import Compression
+
+
+def message(n=20):
+    content = json.dumps({'data_name': 'dublin_temp', 'data_val': 'gAAAAAB' + 'x' * n, 'time_to_use': 1700000000.5})
+    return json.dumps({'id': 'Pi1', 'type': 'DATA', 'content': content, 'ttl': 1}).encode()
+
+
+@pytest.mark.parametrize('codec', Compression.CODECS)
+def test_round_trip(codec):
+    data = message(200)
+    frame = Compression.compress(data, codec)
+    assert frame.startswith(Compression.FRAME_MARKER + Compression.CODEC_IDS[codec])
+    assert len(frame) < len(data)
+    assert Compression.decompress(frame) == data
+
+
+def test_dictionary_codec_beats_plain_zlib_on_messages():
+    data = message(0)
+    assert len(Compression.compress(data, Compression.ZLIB_DICT)) < len(Compression.compress(data, Compression.ZLIB))
+
+
+def test_short_frames_stay_raw():
+    data = b'{"id": "Pi1"}'
+    assert len(data) < Compression.COMPRESS_THRESHOLD
+    assert Compression.compress(data, Compression.ZLIB) == data
+    assert Compression.decompress(data) == data
+
+
+def test_incompressible_frames_stay_raw():
+    data = os.urandom(Compression.COMPRESS_THRESHOLD * 2)
+    assert Compression.compress(data, Compression.ZLIB) == data
+
+
+def test_no_codec_sends_raw():
+    data = message(200)
+    assert Compression.compress(data, None) == data
+
+
+def test_unknown_codec_id_raises():
+    with pytest.raises(ValueError):
+        Compression.decompress(Compression.FRAME_MARKER + b'\x7f' + b'payload')
+
+
+def test_negotiate():
+    assert Compression.negotiate(None) is None
+    assert Compression.negotiate([]) is None
+    assert Compression.negotiate(['lz4', 'brotli']) is None
+    # The first supported codec in the offer wins
+    assert Compression.negotiate(['lz4', Compression.ZLIB, Compression.ZLIB_DICT]) == Compression.ZLIB
+    assert Compression.negotiate(Compression.CODECS) == Compression.ZLIB_DICT
+    # A single codec, as confirmed in an ACKNOWLEDGE
+    assert Compression.negotiate(Compression.ZLIB) == Compression.ZLIB
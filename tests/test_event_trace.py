@@ -0,0 +1,89 @@
+from time import time
+from fakes import makeNode, addPeer
+import EventTrace
+
+
+def test_records_round_trip(tmp_path):
+    path = str(tmp_path / 'Pi1.trace')
+    recorder = EventTrace.EventRecorder(path, 'Pi1', capacity=2)
+    recorder.record(EventTrace.ISSUE, data_name='dublin_temp', nonce=7)
+    # Fills the buffer, so the first chunk is written here
+    recorder.record(EventTrace.SEND, 'REQUEST', 'dublin_temp', 'Pi2', 120, 7)
+    recorder.record(EventTrace.RECV, 'DATA', 'dublin_temp', 'Pi2', 200, 7)
+    recorder.record(EventTrace.DELIVER, data_name='cork_temp')
+    recorder.close()
+    header, events = EventTrace.readEvents(path)
+    assert header['node'] == 'Pi1'
+    assert [e[1:] for e in events] == [(EventTrace.ISSUE, None, 'dublin_temp', '', 0, 7),
+                                       (EventTrace.SEND, 'REQUEST', 'dublin_temp', 'Pi2', 120, 7),
+                                       (EventTrace.RECV, 'DATA', 'dublin_temp', 'Pi2', 200, 7),
+                                       (EventTrace.DELIVER, None, 'cork_temp', '', 0, 0)]
+    assert [e[0] for e in events] == sorted(e[0] for e in events)
+
+
+def test_partial_chunk_is_ignored(tmp_path):
+    path = str(tmp_path / 'Pi1.trace')
+    recorder = EventTrace.EventRecorder(path, 'Pi1')
+    for i in range(3):
+        recorder.record(EventTrace.SEND, 'REQUEST', 'dublin_temp', 'Pi2', 100, i)
+    recorder.close()
+    # A crash part way through writing the last record
+    with open(path, 'r+b') as f:
+        f.truncate(len(f.read()) - 5)
+    header, events = EventTrace.readEvents(path)
+    assert [e[6] for e in events] == [0, 1]
+
+
+def test_analysis_follows_request_across_nodes(tmp_path):
+    traces = []
+    for name, events in (('Pi1', [(EventTrace.ISSUE, None, 'dublin_temp', None, 0),
+                                  (EventTrace.SEND, 'REQUEST', 'dublin_temp', 'Pi2', 100),
+                                  (EventTrace.DELIVER, None, 'dublin_temp', None, 0)]),
+                         ('Pi2', [(EventTrace.RECV, 'REQUEST', 'dublin_temp', 'Pi1', 100),
+                                  (EventTrace.HIT, None, 'dublin_temp', 'Pi1', 0)])):
+        path = str(tmp_path / f'{name}.trace')
+        recorder = EventTrace.EventRecorder(path, name)
+        for event, msg_type, data_name, peer, size in events:
+            recorder.record(event, msg_type, data_name, peer, size, 42)
+        recorder.close()
+        traces.append(EventTrace.readEvents(path))
+    [(t, node, data_name, hops, served, outcome)] = EventTrace.TraceAnalysis(traces).requests()
+    assert (node, data_name) == ('Pi1', 'dublin_temp')
+    [(sender, receiver, latency)] = hops
+    assert (sender, receiver) == ('Pi1', 'Pi2') and latency is not None
+    assert [(n, e) for _, n, e in served] == [('Pi2', EventTrace.HIT)]
+    assert outcome[1] == EventTrace.DELIVER
+
+
+def test_sent_request_is_traced_with_name_and_nonce(tmp_path):
+    path = str(tmp_path / 'Pi1.trace')
+    node = makeNode(trace_file=path)
+    connection = addPeer(node, 'Pi2')
+    node.icn.requestData('dublin_temp', 10)
+    node.closeTrace()
+    [(msg_type, content)] = connection.messages('REQUEST')
+    header, events = EventTrace.readEvents(path)
+    sends = [e for e in events if e[1] == EventTrace.SEND]
+    assert [(e[2], e[3], e[4], e[6]) for e in sends] == [('REQUEST', 'dublin_temp', 'Pi2', content['nonce'])]
+
+
+def test_resolver_types_keep_existing_ids():
+    assert EventTrace.MSG_TYPES[:8] == ['ANNOUNCE', 'ACKNOWLEDGE', 'REQUEST', 'DIRECT_REQUEST', 'FAIL', 'DATA', 'ADVERTISE',
+                                       'SUMMARY']
+    for msg_type in ('FIND', 'FOUND', 'REGISTER'):
+        assert msg_type in EventTrace.MSG_TYPE_IDS
+
+
+def test_direct_request_is_traced_with_nonce(tmp_path):
+    path = str(tmp_path / 'Pi1.trace')
+    node = makeNode(trace_file=path, resolver=True)
+    addPeer(node, 'Pi2')
+    node.resolver.cacheLocation('dublin_', '127.0.0.1:33020:Pi9')
+    node.icn.requestData('dublin_temp', time() + 10)
+    node.closeTrace()
+    header, events = EventTrace.readEvents(path)
+    [issue] = [e for e in events if e[1] == EventTrace.ISSUE]
+    [send] = [e for e in events if e[1] == EventTrace.SEND]
+    assert send[2:5] == ('DIRECT_REQUEST', 'dublin_temp', 'Pi9') and send[6] == issue[6] != 0
+    [(t, node_name, data_name, hops, served, outcome)] = EventTrace.TraceAnalysis([(header, events)]).requests()
+    assert [(s, r) for s, r, latency in hops] == [('Pi1', 'Pi9')]
@@ -0,0 +1,137 @@
+from time import time
+from fakes import makeNode, addPeer
+from FailureDetector import PhiAccrualDetector, HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, MIN_SAMPLES
+from IPNode import NodeProtocol, HEARTBEAT_MARKER
+import pytest
+import ICNProtocol
+import PeerRegistry
+
+
+def regular(detector, count, interval=HEARTBEAT_INTERVAL):
+    for i in range(count):
+        detector.heartbeat(i * interval)
+    return (count - 1) * interval
+
+
+def test_fixed_timeout_until_enough_samples():
+    detector = PhiAccrualDetector()
+    assert not detector.suspect(100)
+    last = regular(detector, MIN_SAMPLES)
+    assert detector.phi(last + 0.5) is None
+    assert not detector.suspect(last + HEARTBEAT_TIMEOUT)
+    assert detector.suspect(last + HEARTBEAT_TIMEOUT + 0.01)
+    # Any message from the peer counts as heard from
+    assert not detector.suspect(last + HEARTBEAT_TIMEOUT + 0.01, last_seen=last + 0.5)
+
+
+def test_phi_grows_with_silence():
+    detector = PhiAccrualDetector()
+    last = regular(detector, 20)
+    phis = [detector.phi(last + d) for d in (0, 0.1, 0.2, 0.3, 0.5)]
+    assert phis == sorted(phis)
+    # On time, or a little late, is not suspicious
+    assert phis[1] < 1
+    assert not detector.suspect(last + 0.2)
+    assert detector.suspect(last + 0.5)
+
+
+def test_irregular_peer_gets_more_slack():
+    regular_peer = PhiAccrualDetector()
+    last = regular(regular_peer, 20)
+    irregular_peer = PhiAccrualDetector()
+    for i in range(20):
+        irregular_peer.heartbeat(i * 0.1 + (0.15 if i % 2 else 0))
+    assert irregular_peer.phi(last + 0.4) < regular_peer.phi(last + 0.4)
+
+
+def test_window_totals_follow_evictions():
+    detector = PhiAccrualDetector()
+    regular(detector, detector.intervals.maxlen + 50, 0.2)
+    assert detector.total == pytest.approx(sum(detector.intervals))
+    assert detector.total_sq == pytest.approx(sum(i * i for i in detector.intervals))
+
+
+def test_heartbeat_frame_is_recorded():
+    node = makeNode()
+    addPeer(node, 'Pi2')
+    protocol = NodeProtocol(node.icn.ip_node, False)
+    protocol.frameReceived(HEARTBEAT_MARKER + b'Pi2')
+    assert node.peers.getState('Pi2').detector.last_heartbeat is not None
+    assert node.icn.ip_node.heartbeat_frame[4:] == HEARTBEAT_MARKER + b'Pi1'
+
+
+@pytest.fixture
+def node(monkeypatch):
+    node = makeNode()
+    # Peer registry and heartbeats on the fake clock
+    monkeypatch.setattr(PeerRegistry, 'time', node.reactor.seconds)
+    monkeypatch.setattr(ICNProtocol, 'time', node.reactor.seconds)
+    node.running = True
+    return node
+
+
+def test_heartbeats_sent_to_every_peer(node):
+    connections = [addPeer(node, n, 33012 + i) for i, n in enumerate(['Pi2', 'Pi3'])]
+    node.reactor.advance(HEARTBEAT_INTERVAL)
+    for c in connections:
+        assert c.frames == [node.icn.ip_node.heartbeat_frame] and c.sent == []
+
+
+def test_silent_peer_is_dropped_and_request_rerouted(node):
+    addPeer(node, 'Pi2')
+    node.icn.requestData('nowhere_temp', time() + 10)
+    pi3 = addPeer(node, 'Pi3', 33013)
+    for i in range(12):
+        node.peers.recordHeartbeat('Pi3')
+        node.reactor.advance(HEARTBEAT_INTERVAL)
+    # Pi2 never sent a heartbeat, so the fixed timeout applies
+    assert 'Pi2' not in node.peers and 'Pi3' in node.peers
+    [(msg_type, content)] = pi3.messages('REQUEST')
+    assert content['data_name'] == 'nowhere_temp'
+    assert node.getPITUpstream('nowhere_temp')[0] == {'Pi3'}
+
+
+def test_request_flooded_to_others_is_not_resent(node):
+    addPeer(node, 'Pi2')
+    pi3 = addPeer(node, 'Pi3', 33013)
+    node.icn.requestData('nowhere_temp', time() + 10)
+    node.icn.ip_node.peerFailed('Pi2')
+    assert len(pi3.messages('REQUEST')) == 1
+    assert node.hasPITEntry('nowhere_temp') and node.orphaned == {}
+
+
+def test_orphaned_request_goes_to_next_peer(node):
+    addPeer(node, 'Pi2')
+    node.icn.requestData('nowhere_temp', time() + 10)
+    node.icn.ip_node.peerFailed('Pi2')
+    assert 'nowhere_temp' in node.orphaned
+    pi3 = addPeer(node, 'Pi3', 33013)
+    node.icn.resendOrphaned()
+    assert node.orphaned == {}
+    [(msg_type, content)] = pi3.messages('REQUEST')
+    node.reactor.advance(ICNProtocol.FAILOVER_WAIT)
+    assert node.hasPITEntry('nowhere_temp')
+
+
+def test_orphaned_request_fails_after_wait(node):
+    addPeer(node, 'Pi2')
+    node.icn.requestData('nowhere_temp', time() + 10)
+    node.icn.ip_node.peerFailed('Pi2')
+    node.reactor.advance(ICNProtocol.FAILOVER_WAIT)
+    assert node.orphaned == {}
+    assert not node.hasPITEntry('nowhere_temp')
+
+
+def test_stopped_node_does_not_fail_over(node):
+    connections = [addPeer(node, n, 33012 + i) for i, n in enumerate(['Pi2', 'Pi3'])]
+    node.icn.ip_node.updateFallback('Pi2', '127.0.0.1:33014:Pi4')
+    node.icn.ip_node.updateFallback('Pi3', '127.0.0.1:33015:Pi5')
+    node.reactor.connects.clear()
+    node.stop()
+    # The transport reports the connections closed by stop()
+    for c in connections:
+        node.icn.ip_node.removeConnection(c)
+    node.icn.ip_node.search(node.icn.getAnnounce())
+    node.reactor.advance(10)
+    assert len(node.peers) == 0
+    assert node.reactor.connects == []
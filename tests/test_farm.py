@@ -0,0 +1,62 @@
+import os
+import pytest
+import Farm
+
+REPO = os.path.join(os.path.dirname(__file__), '..')
+TYPES = ['temp', 'hum', 'snow']
+
+
+@pytest.fixture
+def temps(tmp_path, monkeypatch):
+    (tmp_path / 'temps').mkdir()
+    for name in ['dublin', 'doha', 'tokyo']:
+        (tmp_path / 'temps' / f'temperatures_{name}.csv').write_text('')
+    (tmp_path / 'temps' / 'other.csv').write_text('')
+    monkeypatch.chdir(tmp_path)
+
+
+def test_producer_names():
+    assert Farm.producerNames(['dublin', 'doha']) == ['dublin', 'doha']
+    assert Farm.producerNames(['dublin', 'doha'], 3) == ['dublin', 'dublin1', 'dublin2', 'doha', 'doha1', 'doha2']
+
+
+def test_find_datasets(temps):
+    assert Farm.findDatasets() == ['doha', 'dublin', 'tokyo']
+    assert Farm.findDatasets('d*') == ['doha', 'dublin']
+    assert Farm.findDatasets('cork') == []
+
+
+def test_farm_names(temps):
+    farm = Farm.ProducerFarm('d*', 2, TYPES, 60)
+    assert farm.producers == ['doha', 'doha1', 'dublin', 'dublin1']
+    assert farm.prefixes() == ['doha_', 'doha1_', 'dublin_', 'dublin1_']
+    assert len(farm) == 12 and 'dublin1_snow' in farm and 'tokyo_temp' not in farm
+    assert farm.names['dublin1_snow'] == (3, 2)
+    # Sensors are only built, and numpy imported, on first use
+    assert farm.sensors is None
+
+
+def test_no_matching_datasets(temps):
+    with pytest.raises(ValueError):
+        Farm.ProducerFarm('cork', 1, TYPES, 60)
+
+
+def test_vectorised_update(monkeypatch):
+    pytest.importorskip('numpy')
+    monkeypatch.chdir(REPO)
+    farm = Farm.ProducerFarm('d*', 2, TYPES, 60)
+    value, ttu = farm.getValue('dublin_temp')
+    assert isinstance(value, float) and ttu == 60
+    sensors = farm.getSensors()
+    assert sensors.values.shape == (len(farm.producers), len(TYPES))
+    # Replicas of a dataset start from the same long term average
+    assert farm.getValue('dublin1_temp')[0] == value
+    before = sensors.values
+    sensors.last_update = 0
+    farm.update()
+    assert sensors.values is not before and sensors.values.shape == before.shape
+    assert (sensors.values[:, TYPES.index('snow')] >= 0).all()
+    # Not updated again within the interval
+    after = sensors.values
+    farm.update()
+    assert sensors.values is after
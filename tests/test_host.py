@@ -0,0 +1,91 @@
+from multiprocessing import Pipe
+from threading import Thread
+import pytest
+import Host
+from fakes import ThreadedFakeReactor
+
+
+class FakeNode:
+    def __init__(self, name):
+        self.name = name
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+
+def worker(nodes):
+    host_end, worker_end = Pipe()
+    reactor = ThreadedFakeReactor()
+    th = Thread(target=Host.serveWorker, args=(worker_end, nodes, reactor, {}), daemon=True)
+    th.start()
+    return host_end, reactor, th
+
+
+def send(conn, reactor, cmd, arg=None):
+    conn.send((cmd, arg))
+    # Nothing is replied until the reactor has made the change
+    assert not conn.poll(0.2)
+    reactor.runCalls()
+    assert conn.poll(1)
+    return conn.recv()
+
+
+def test_parse_spec():
+    assert Host.parseSpec('Pi1:33011:dublin') == Host.NodeSpec('Pi1', 33011, 'dublin')
+    assert Host.parseSpec('Pi1:33011') == Host.NodeSpec('Pi1', 33011, None)
+    assert Host.parseSpec('Pi1:33011:') == Host.NodeSpec('Pi1', 33011, None)
+    with pytest.raises(ValueError):
+        Host.parseSpec('Pi1')
+
+
+def test_stop_replies_once_the_node_is_stopped():
+    node = FakeNode('Pi1')
+    nodes = {'Pi1': node}
+    conn, reactor, th = worker(nodes)
+    assert send(conn, reactor, Host.STOP, 'Pi1') is True
+    assert node.stopped and 'Pi1' not in nodes
+    assert send(conn, reactor, Host.STOP, 'Pi1') is False
+    assert send(conn, reactor, Host.SHUTDOWN) is True
+    th.join(1)
+
+
+def test_shutdown_stops_every_node():
+    nodes = {n: FakeNode(n) for n in ['Pi1', 'Pi2']}
+    stopped = list(nodes.values())
+    conn, reactor, th = worker(nodes)
+    assert send(conn, reactor, Host.SHUTDOWN) is True
+    th.join(1)
+    assert not th.is_alive()
+    assert reactor.stopped and nodes == {}
+    assert all(n.stopped for n in stopped)
+
+
+def attachedValue(shared, conn):
+    import Sensor
+    Sensor.attachDatasets(shared)
+    conn.send(float(Sensor.loadDataset('testcity')[1][0]))
+
+
+def test_forked_worker_reads_datasets_from_shared_memory(tmp_path, monkeypatch):
+    pytest.importorskip('numpy')
+    import multiprocessing
+    import Sensor
+    (tmp_path / 'temps').mkdir()
+    csv = tmp_path / 'temps' / 'temperatures_testcity.csv'
+    csv.write_text('date,tavg,tmin,tmax\n' + ''.join(f'{i},{i}.5,{i},{i + 1}\n' for i in range(5)))
+    monkeypatch.chdir(tmp_path)
+    shared = Sensor.shareDatasets(['testcity'])
+    try:
+        shm, shape = Sensor._shared['testcity']
+        # Only a worker reading the shared block sees this value, and there is no CSV to fall back on
+        Sensor.np.ndarray(shape, dtype=Sensor.np.float64, buffer=shm.buf)[0, 0] = -99
+        csv.unlink()
+        parent, child = multiprocessing.Pipe()
+        p = multiprocessing.get_context('fork').Process(target=attachedValue, args=(shared, child))
+        p.start()
+        assert parent.poll(10)
+        assert parent.recv() == -99
+        p.join(5)
+    finally:
+        Sensor.unlinkDatasets()
@@ -0,0 +1,155 @@
+from IPNode import NodeProtocol, SendQueue, FRAME_HEADER, MAX_FRAME, HIGH, NORMAL, LOW
+from PeerRegistry import PeerRegistry
+from Transport import Address
+import Compression
+import json
+
+
+class FakeTransport:
+    def __init__(self):
+        self.written = []
+        self.closed = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def getPeer(self):
+        return Address('127.0.0.1', 33010)
+
+    def loseConnection(self):
+        self.closed = True
+
+
+class FakeICNProtocol:
+    def __init__(self):
+        self.received = []
+
+    def handleMsg(self, data, source=None):
+        self.received.append(data)
+
+
+class FakeFactory:
+    def __init__(self):
+        self.id = 'Pi1'
+        self.peers = PeerRegistry()
+        self.emulator = None
+        self.icn_protocol = FakeICNProtocol()
+
+    def removeConnection(self, protocol):
+        pass
+
+
+def connection(codec=None):
+    p = NodeProtocol(FakeFactory(), True)
+    p.codec = codec
+    p.makeConnection(FakeTransport())
+    return p
+
+
+def messages():
+    big = json.dumps({'id': 'Pi2', 'type': 'DATA', 'content': json.dumps({'data_val': 'gAAAAAB' + 'y' * 300}), 'ttl': 1})
+    return ['{"id": "Pi2", "type": "HEARTBEAT", "content": "{}", "ttl": 1}', big]
+
+
+def test_frames_survive_split_and_merged_reads():
+    sender = connection(Compression.ZLIB_DICT)
+    for m in messages():
+        sender.sendMsg(m)
+    stream = b''.join(sender.transport.written)
+    receiver = connection()
+    # One byte per read, then everything in one read
+    for i in range(len(stream)):
+        receiver.dataReceived(stream[i:i + 1])
+    receiver.dataReceived(stream)
+    assert [d.decode() for d in receiver.factory.icn_protocol.received] == messages() * 2
+    assert receiver.buffer == b''
+
+
+def test_partial_frame_waits_for_the_rest():
+    sender = connection()
+    sender.sendMsg(messages()[0])
+    frame = sender.transport.written[0]
+    receiver = connection()
+    receiver.dataReceived(frame[:-1])
+    assert receiver.factory.icn_protocol.received == []
+    receiver.dataReceived(frame[-1:])
+    assert len(receiver.factory.icn_protocol.received) == 1
+
+
+def test_many_frames_in_one_read():
+    sender = connection()
+    for i in range(5000):
+        sender.sendMsg(json.dumps({'n': i}))
+    receiver = connection()
+    stream = b''.join(sender.transport.written)
+    receiver.dataReceived(stream[:-3])
+    receiver.dataReceived(stream[-3:])
+    assert [json.loads(d)['n'] for d in receiver.factory.icn_protocol.received] == list(range(5000))
+    assert receiver.buffer == b''
+
+
+def test_oversized_frame_disconnects():
+    receiver = connection()
+    receiver.dataReceived(FRAME_HEADER.pack(MAX_FRAME + 1) + b'{"id"')
+    assert receiver.transport.closed
+    assert receiver.buffer == b'' and receiver.factory.icn_protocol.received == []
+
+
+def test_send_queue_serves_priorities_in_order():
+    queue = SendQueue(size=8)
+    for priority, data in ((LOW, b'l1'), (NORMAL, b'n1'), (HIGH, b'h1'), (NORMAL, b'n2'), (HIGH, b'h2')):
+        assert queue.push(priority, data)
+    assert [queue.pop() for i in range(6)] == [b'h1', b'h2', b'n1', b'n2', b'l1', None]
+    assert len(queue) == 0
+
+
+def test_full_send_queue_drops_lowest_priority_first():
+    queue = SendQueue(size=3)
+    queue.push(LOW, b'l1')
+    queue.push(LOW, b'l2')
+    queue.push(NORMAL, b'n1')
+    # Replaces the oldest LOW frame
+    assert queue.push(HIGH, b'h1')
+    # Nothing of a lower priority left to drop for a LOW frame
+    queue.push(NORMAL, b'n2')
+    assert not queue.push(LOW, b'l3')
+    assert queue.dropped == 3
+    assert [queue.pop() for i in range(3)] == [b'h1', b'n1', b'n2']
+
+
+def test_full_send_queue_replaces_oldest_of_equal_priority():
+    queue = SendQueue(size=2)
+    queue.push(NORMAL, b'n1')
+    queue.push(NORMAL, b'n2')
+    assert queue.push(NORMAL, b'n3')
+    assert queue.dropped == 1
+    assert [queue.pop(), queue.pop()] == [b'n2', b'n3']
+
+
+def test_paused_connection_queues_until_resumed():
+    p = connection()
+    p.sendMsg(messages()[0])
+    p.pauseProducing()
+    p.sendMsg('{"low": 1}', LOW)
+    p.sendMsg('{"high": 1}', HIGH)
+    assert len(p.transport.written) == 1
+    p.resumeProducing()
+    assert [w[FRAME_HEADER.size:] for w in p.transport.written[1:]] == [b'{"high": 1}', b'{"low": 1}']
+    # Sent straight away again once the queue has drained
+    p.sendMsg('{"normal": 1}')
+    assert len(p.transport.written) == 4 and len(p.queue) == 0
+
+
+def test_resume_stops_when_transport_pauses_again():
+    p = connection()
+    p.pauseProducing()
+    for i in range(3):
+        p.sendMsg(json.dumps({'n': i}))
+    written = p.transport.written
+    p.transport.write = lambda data: (written.append(data), p.pauseProducing())
+    p.resumeProducing()
+    assert len(written) == 1 and len(p.queue) == 2
+    # Frames sent meanwhile keep their place behind the queued ones
+    p.paused = False
+    p.sendMsg(json.dumps({'n': 3}))
+    assert len(written) == 1 and len(p.queue) == 3
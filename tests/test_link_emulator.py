@@ -0,0 +1,102 @@
+import os
+import pytest
+import LinkEmulator
+import RateLimit
+from fakes import FakeReactor
+
+TOPOLOGY = os.path.join(os.path.dirname(__file__), '..', 'topologies', 'pi.json')
+
+
+# The emulator runs on the fake reactor's clock
+@pytest.fixture(autouse=True)
+def reactor(monkeypatch):
+    reactor = FakeReactor()
+    monkeypatch.setattr(LinkEmulator, 'time', reactor.seconds)
+    monkeypatch.setattr(RateLimit, 'time', reactor.seconds)
+    return reactor
+
+
+class Connection:
+    def __init__(self, peer_name=None):
+        self.peer_name = peer_name
+        self.connected = True
+        self.transport = self
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+
+def test_no_delay_writes_immediately(reactor):
+    emulator = LinkEmulator.LinkEmulator(reactor, 'Pi1')
+    c = Connection('Pi2')
+    emulator.send(c, b'x')
+    assert c.written == [b'x']
+
+
+def test_delay_holds_messages_in_order(reactor):
+    emulator = LinkEmulator.LinkEmulator(reactor, 'Pi1', {'delay': 0.05, 'jitter': 0.04}, seed=1)
+    c = Connection('Pi2')
+    for i in range(10):
+        emulator.send(c, bytes([i]))
+    assert c.written == []
+    reactor.advance(0.1)
+    # Jitter never lets a message overtake an earlier one
+    assert c.written == [bytes([i]) for i in range(10)]
+
+
+def test_loss(reactor):
+    emulator = LinkEmulator.LinkEmulator(reactor, 'Pi1', links={'Pi2': {'loss': 1}})
+    lossy, other = Connection('Pi2'), Connection('Pi3')
+    emulator.send(lossy, b'x')
+    emulator.send(other, b'x')
+    reactor.advance(1)
+    assert lossy.written == [] and other.written == [b'x']
+
+
+def test_bandwidth_spaces_messages(reactor):
+    emulator = LinkEmulator.LinkEmulator(reactor, 'Pi1', {'bandwidth': 1000, 'burst': 100})
+    c = Connection('Pi2')
+    for i in range(3):
+        emulator.send(c, bytes(100))
+    # The burst covers the first message, the others wait for tokens
+    assert len(c.written) == 1
+    reactor.advance(0.15)
+    assert len(c.written) == 2
+    reactor.advance(0.1)
+    assert len(c.written) == 3
+
+
+def test_delivery_skipped_once_disconnected(reactor):
+    emulator = LinkEmulator.LinkEmulator(reactor, 'Pi1', {'delay': 0.05})
+    c = Connection('Pi2')
+    emulator.send(c, b'x')
+    c.connected = False
+    reactor.advance(1)
+    assert c.written == []
+
+
+def test_unnamed_links_are_dropped_with_their_connection(reactor):
+    emulator = LinkEmulator.LinkEmulator(reactor, 'Pi1', {'bandwidth': 1000})
+    a, b = Connection(), Connection()
+    emulator.send(a, bytes(10))
+    emulator.send(b, bytes(10))
+    assert emulator.getLink(a) is not emulator.getLink(b)
+    emulator.removeConnection(a)
+    emulator.removeConnection(b)
+    assert emulator.links == {}
+    # Named links outlive a connection, so reconnecting keeps the link's state
+    named = Connection('Pi2')
+    link = emulator.getLink(named)
+    emulator.removeConnection(named)
+    assert emulator.getLink(Connection('Pi2')) is link
+
+
+def test_load_topology(reactor):
+    emulator = LinkEmulator.load(TOPOLOGY, 'Pi1', reactor)
+    to_pi2 = emulator.getLink(Connection('Pi2'))
+    assert (to_pi2.delay, to_pi2.loss, to_pi2.bucket.rate) == (0.02, 0.01, 125000)
+    # Links are symmetric, unlisted peers use the default
+    assert emulator.getLink(Connection('Pi3')).delay == 0.01
+    assert emulator.getLink(Connection('Pi5')).delay == 0.005
+    assert LinkEmulator.load(TOPOLOGY, 'Pi3', reactor).getLink(Connection('Pi1')).delay == 0.01
@@ -0,0 +1,62 @@
+from collections import Counter
+import pytest
+import LoadGen
+
+NAMES = [f"city{i}_temp" for i in range(10)]
+
+
+def test_name_space():
+    assert LoadGen.nameSpace(['dublin', 'cork'], ['temp', 'hum']) == ['dublin_temp', 'dublin_hum', 'cork_temp', 'cork_hum']
+    assert LoadGen.nameSpace(['dublin'], ['temp'], replicas=3) == ['dublin_temp', 'dublin1_temp', 'dublin2_temp']
+
+
+def test_uniform_workload():
+    workload = list(LoadGen.generateWorkload(NAMES, 100, 50, seed=1))
+    offsets = [o for o, n in workload]
+    assert offsets == sorted(offsets) and 0 < offsets[0] and offsets[-1] < 50
+    # Poisson arrivals at 100 per second
+    assert 4500 < len(workload) < 5500
+    counts = Counter(n for o, n in workload)
+    assert set(counts) == set(NAMES)
+    assert max(counts.values()) < 1.3 * min(counts.values())
+    assert workload == list(LoadGen.generateWorkload(NAMES, 100, 50, seed=1))
+
+
+def test_zipf_workload():
+    workload = list(LoadGen.generateWorkload(NAMES, 100, 50, LoadGen.ZIPF, s=1.0, seed=2))
+    ranked = [c for n, c in Counter(n for o, n in workload).most_common()]
+    # The most popular name gets 1 / H(10) of the requests, about twice the second
+    assert 0.30 < ranked[0] / len(workload) < 0.38
+    assert 1.6 < ranked[0] / ranked[1] < 2.4
+    assert workload == list(LoadGen.generateWorkload(NAMES, 100, 50, LoadGen.ZIPF, s=1.0, seed=2))
+
+
+def test_unknown_workload():
+    with pytest.raises(ValueError):
+        next(LoadGen.generateWorkload(NAMES, 100, 50, 'bursty'))
+
+
+def test_trace_replay(tmp_path):
+    path = tmp_path / 'trace.csv'
+    path.write_text("# timestamp,name\n1000.5,dublin_temp\n\n1001.0, cork_hum\n1003.25,dublin_temp\n")
+    assert list(LoadGen.readTrace(str(path))) == [(0, 'dublin_temp'), (0.5, 'cork_hum'), (2.75, 'dublin_temp')]
+
+
+def test_results_round_trip(tmp_path):
+    results = LoadGen.Results()
+    results.add('dublin_temp', 1000.0, 0.25, LoadGen.OK)
+    results.add('cork_hum', 1000.5, 0.5, LoadGen.STALE)
+    results.add('dublin_temp', 1001.0, 10.0, LoadGen.TIMEOUT)
+    path = str(tmp_path / 'results.bin')
+    results.write(path)
+    read = LoadGen.readResults(path)
+    assert read.names == ['dublin_temp', 'cork_hum']
+    assert read.records == [(1000.0, 0.25, 0, LoadGen.OK), (1000.5, 0.5, 1, LoadGen.STALE), (1001.0, 10.0, 0, LoadGen.TIMEOUT)]
+    assert read.summary() == "3 requests: ok 1, stale 1, fail 0, timeout 1; latency p50 500.0 ms, p99 500.0 ms"
+
+
+def test_not_a_results_file(tmp_path):
+    path = tmp_path / 'results.bin'
+    path.write_bytes(b'ICNTRACE1\n')
+    with pytest.raises(ValueError):
+        LoadGen.readResults(str(path))
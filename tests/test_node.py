@@ -0,0 +1,23 @@
+import os
+import pytest
+from fakes import makeNode, LoopbackNetwork, handshake
+
+REPO = os.path.join(os.path.dirname(__file__), '..')
+
+
+def test_sensors_built_on_first_use(monkeypatch):
+    pytest.importorskip('numpy')
+    monkeypatch.chdir(REPO)
+    node = makeNode(data_n='dublin')
+    assert 'dublin_temp' in node.sensor_types and node.sensors == {}
+    assert node.getData('dublin_temp') is not None
+    assert list(node.sensors) == ['dublin_temp']
+
+
+def test_startup_timed_to_first_acknowledge():
+    network = LoopbackNetwork()
+    a = makeNode('Pi1', 33011)
+    b = makeNode('Pi2', 33012)
+    assert a.startup_time is None and b.startup_time is None
+    handshake(network, a, b)
+    assert a.startup_time is not None and b.startup_time is not None
@@ -0,0 +1,70 @@
+from fakes import makeNode, addPeer, FakeConnection
+from PeerRegistry import PeerRegistry
+
+
+def test_behaves_like_list_of_peer_names():
+    peers = PeerRegistry()
+    for n in ['Pi3', 'Pi1', 'Pi2']:
+        peers.addPeer(n)
+    # Known but not a peer
+    peers.setAddr('Pi4', '127.0.0.1:33014')
+    assert list(peers) == ['Pi3', 'Pi1', 'Pi2'] and len(peers) == 3
+    assert 'Pi1' in peers and 'Pi4' not in peers
+    # Iterating over a copy, so peers may be removed meanwhile
+    for n in peers:
+        peers.removePeer(n)
+    assert len(peers) == 0 and not peers.getState('Pi1').alive
+
+
+def test_address_index_follows_changes():
+    peers = PeerRegistry()
+    peers.setAddr('Pi2', '127.0.0.1:33012')
+    assert peers.nameAt('127.0.0.1:33012') == 'Pi2'
+    peers.setAddr('Pi2', '10.0.0.2:33012')
+    assert peers.nameAt('127.0.0.1:33012') is None and peers.nameAt('10.0.0.2:33012') == 'Pi2'
+    assert peers.getAddr('Pi2') == '10.0.0.2:33012' and peers.getAddr('Pi9') is None
+    assert peers.addrMap() == {'Pi2': '10.0.0.2:33012'}
+
+
+def test_connections():
+    peers = PeerRegistry()
+    connection = FakeConnection('Pi2')
+    peers.setConnection('Pi2', connection)
+    assert peers.hasConnection('Pi2') and peers.getConnection('Pi2') is connection
+    assert peers.popConnection('Pi2') is connection
+    assert not peers.hasConnection('Pi2') and peers.getState('Pi2').connection is None
+
+
+def test_statistics_only_for_known_nodes():
+    peers = PeerRegistry()
+    peers.addPeer('Pi2')
+    peers.recordIn('Pi2', 100)
+    peers.recordOut('Pi2', 40)
+    peers.recordOut('Pi2', 60)
+    state = peers.getState('Pi2')
+    assert (state.msgs_in, state.bytes_in, state.msgs_out, state.bytes_out) == (1, 100, 2, 100)
+    for n in ['Pi8', 'Pi9']:
+        peers.recordIn(n, 10)
+        peers.recordHeartbeat(n)
+    assert set(peers.states) == {'Pi2'}
+    assert not peers.suspect('Pi9')
+
+
+def test_forget_drops_every_index():
+    peers = PeerRegistry()
+    peers.setAddr('Pi2', '127.0.0.1:33012')
+    peers.setConnection('Pi2', FakeConnection('Pi2'))
+    peers.addPeer('Pi2')
+    peers.forget('Pi2')
+    assert 'Pi2' not in peers and not peers.hasConnection('Pi2')
+    assert peers.states == {} and peers.names == {}
+
+
+def test_failed_peers_are_forgotten():
+    node = makeNode()
+    addPeer(node, 'Pi2')
+    node.icn.ip_node.updateFallback('Pi2', '127.0.0.1:33014:Pi4')
+    node.icn.ip_node.peerFailed('Pi2')
+    assert 'Pi2' not in node.peers.states
+    # Its fallback is contacted in its place
+    assert node.peers.getAddr('Pi4') == '127.0.0.1:33014'
@@ -0,0 +1,68 @@
+from fakes import makeNode, addPeer, FakeConnection
+from PeerRegistry import PeerRegistry
+from RateLimit import TokenBucket
+import json
+import RateLimit
+
+
+def test_bucket_allows_burst_then_rate():
+    bucket = TokenBucket(10, 5)
+    t = bucket.last = 0.0
+    assert all(bucket.consume(1, t) for i in range(5))
+    assert not bucket.consume(1, t)
+    # 0.1 s refills one token
+    assert bucket.consume(1, t + 0.125)
+    assert not bucket.consume(1, t + 0.125)
+    # Never more than the burst, however long it was idle
+    assert bucket.consume(5, t + 100)
+    assert not bucket.consume(1, t + 100)
+
+
+def test_reserve_returns_wait_for_debt():
+    bucket = TokenBucket(10, 5)
+    t = bucket.last = 0.0
+    assert bucket.reserve(5, t) == 0
+    assert abs(bucket.reserve(2, t) - 0.2) < 1e-9
+    # The debt is paid back before new tokens can be taken
+    assert not bucket.consume(1, t + 0.2)
+    assert bucket.consume(1, t + 0.325)
+
+
+def test_requests_limited_per_peer(monkeypatch):
+    t = 1000.0
+    monkeypatch.setattr(RateLimit, 'time', lambda: t)
+    peers = PeerRegistry()
+    assert all(peers.allowRequest('Pi2', 10, 3) for i in range(3))
+    assert not peers.allowRequest('Pi2', 10, 3)
+    # Another peer has a bucket of its own
+    assert peers.allowRequest('Pi3', 10, 3)
+    assert peers.getState('Pi2').requests_dropped == 1
+    t += 0.2
+    assert peers.allowRequest('Pi2', 10, 3)
+
+
+def request(node, connection, msg_type, node_name, i):
+    content = {'data_name': f'cork{i}_temp', 'time_to_wait': 10, 'nonce': i + 1, 'port': '33019'}
+    node.icn.handleMsg(json.dumps({'id': node_name, 'type': msg_type, 'ttl': 1, 'content': json.dumps(content)}), connection)
+
+
+def test_requests_over_the_limit_fail(monkeypatch):
+    monkeypatch.setattr(RateLimit, 'time', lambda: 1000.0)
+    node = makeNode(request_rate=1, request_burst=5)
+    connection = addPeer(node, 'Pi2')
+    for i in range(6):
+        request(node, connection, 'REQUEST', 'Pi2', i)
+    # Requests for unknown names at ttl 1 fail either way; only the last one was never looked up
+    assert len(connection.messages('FAIL')) == 6
+    assert node.peers.getState('Pi2').requests_dropped == 1
+
+
+def test_direct_requests_are_limited(monkeypatch):
+    monkeypatch.setattr(RateLimit, 'time', lambda: 1000.0)
+    node = makeNode(request_rate=1, request_burst=2)
+    # Not a peer, so only the excess is answered on the request's connection
+    connection = FakeConnection()
+    for i in range(3):
+        request(node, connection, 'DIRECT_REQUEST', 'Pi9', i)
+    assert [c['data_name'] for t, c in connection.messages('FAIL')] == ['cork2_temp']
+    assert node.peers.getState('Pi9').requests_dropped == 1
@@ -0,0 +1,46 @@
+from time import time
+from fakes import makeNode, addPeer
+import Node
+
+
+def makeHot(node, data_name):
+    for i in range(20):
+        node.recordRequest(data_name)
+    assert node.isHot(data_name)
+
+
+def test_one_refresh_per_hot_name():
+    node = makeNode()
+    addPeer(node, 'Pi2')
+    makeHot(node, 'dublin_temp')
+    icn = node.icn
+    # The same hot name cached again and again before its refresh is due
+    for i in range(5):
+        icn.scheduleRefresh('dublin_temp', time() + 30 + i, 'Pi2')
+    calls = node.reactor.pending(icn.refreshDue)
+    assert len(calls) == 1
+    assert node.refresh_calls['dublin_temp'] is calls[0]
+
+
+def test_refresh_cancelled_once_name_is_no_longer_hot():
+    node = makeNode()
+    addPeer(node, 'Pi2')
+    makeHot(node, 'dublin_temp')
+    node.icn.scheduleRefresh('dublin_temp', time() + 30, 'Pi2')
+    node.rates = Node.RequestRates()
+    node.icn.scheduleRefresh('dublin_temp', time() + 30, 'Pi2')
+    assert node.reactor.pending(node.icn.refreshDue) == []
+    assert 'dublin_temp' not in node.refresh_calls and 'dublin_temp' not in node.upstream
+
+
+def test_due_refresh_requests_from_upstream():
+    node = makeNode()
+    connection = addPeer(node, 'Pi2')
+    makeHot(node, 'dublin_temp')
+    node.cacheData('dublin_temp', 'token', time() + 30)
+    node.icn.scheduleRefresh('dublin_temp', time() + 30, 'Pi2')
+    node.reactor.advance(30)
+    assert 'dublin_temp' not in node.refresh_calls
+    assert 'dublin_temp' in node.refreshing
+    [(msg_type, content)] = connection.messages('REQUEST')
+    assert content['data_name'] == 'dublin_temp' and content['min_time_to_use'] > 0
@@ -0,0 +1,138 @@
+from time import time
+from fakes import makeNode, addPeer, LoopbackNetwork
+from Resolver import Contacts, Lookup, Resolver as ResolverState, ringId, K, RECORD_TTL, CACHE_TTL, LOOKUP_TIMEOUT
+
+NAMES = [f"Pi{i}" for i in range(64)]
+
+
+def test_contacts_closest_by_xor_distance():
+    contacts = Contacts('Pi0')
+    for i, n in enumerate(NAMES):
+        contacts.add(n, f"127.0.0.1:{33000 + i}")
+    assert 'Pi0' not in [n for b in contacts.buckets for n in b]
+    assert all(len(b) <= K for b in contacts.buckets)
+    key = ringId('dublin_')
+    closest = contacts.closest(key, 3)
+    known = sorted((ringId(n) ^ key, n) for b in contacts.buckets for n in b)
+    assert [n for n, addr in closest] == [n for d, n in known[:3]]
+    contacts.remove(closest[0][0])
+    assert closest[0] not in contacts.closest(key, 3)
+
+
+def test_full_bucket_keeps_known_contacts():
+    contacts = Contacts('Pi0')
+    for i, n in enumerate(NAMES):
+        contacts.add(n, f"127.0.0.1:{33000 + i}")
+    b = max(contacts.buckets, key=len)
+    first = next(iter(b))
+    newcomer = next(n for n in (f"Pi{i}" for i in range(64, 10000)) if contacts.bucket(ringId(n)) is b)
+    contacts.add(newcomer, '127.0.0.1:1')
+    assert newcomer not in b and first in b
+
+
+def test_lookup_converges_on_closest_nodes():
+    network = {}
+    for n in NAMES:
+        network[n] = Contacts(n)
+        for i, m in enumerate(NAMES):
+            network[n].add(m, f"127.0.0.1:{33000 + i}")
+    key = ringId('dublin_')
+    start = Contacts('Pi0')
+    # Starts from a few contacts far from the key
+    for n in sorted(NAMES[1:], key=lambda n: ringId(n) ^ key, reverse=True)[:3]:
+        start.add(n, 'addr')
+    lookup = Lookup(1, key, 'dublin_', start, None)
+    while not lookup.finished():
+        for n, addr in lookup.next():
+            lookup.pending.discard(n)
+            lookup.add([c for c in network[n].closest(key, K + 1) if c[0] != 'Pi0'])
+    expected = sorted(NAMES[1:], key=lambda n: ringId(n) ^ key)[:K]
+    assert [n for n, addr in lookup.closest()] == expected
+    assert lookup.queries < len(NAMES) // 2
+
+
+def test_records_expire(clock):
+    resolver = ResolverState('Pi1')
+    resolver.addRecord('dublin_', '127.0.0.1:33012:Pi2')
+    # A longer TTL than the record lifetime is capped
+    resolver.addRecord('cork_', '127.0.0.1:33013:Pi3', 10 * RECORD_TTL)
+    clock[0] += RECORD_TTL - 1
+    assert resolver.getRecord('dublin_') == '127.0.0.1:33012:Pi2'
+    clock[0] += 2
+    assert resolver.getRecord('dublin_') is None and resolver.getRecord('cork_') is None
+    assert resolver.records == {}
+
+
+def test_cached_locations_expire(clock):
+    resolver = ResolverState('Pi1')
+    resolver.cacheLocation('dublin_', '127.0.0.1:33012:Pi2')
+    resolver.addRecord('cork_', '127.0.0.1:33013:Pi3')
+    assert resolver.getLocation('dublin_') == '127.0.0.1:33012:Pi2'
+    assert resolver.getLocation('cork_') == '127.0.0.1:33013:Pi3'
+    clock[0] += CACHE_TTL + 1
+    assert resolver.getLocation('dublin_') is None
+    assert resolver.getLocation('cork_') == '127.0.0.1:33013:Pi3'
+
+
+def routedNode():
+    node = makeNode(resolver=True)
+    connection = addPeer(node, 'Pi2')
+    node.routes.update('dublin_', 'Pi9', 1, 2, 'Pi2')
+    # Leaves out the search for peers on start
+    node.reactor.connects.clear()
+    return node, connection
+
+
+def test_resolver_takes_precedence_over_routes():
+    node, connection = routedNode()
+    node.resolver.cacheLocation('dublin_', '127.0.0.1:33020:Pi9')
+    node.icn.requestData('dublin_temp', time() + 10)
+    assert connection.messages() == []
+    # DIRECT_REQUEST over a new connection to the producer
+    assert [c[1] for c in node.reactor.connects] == [33020]
+    assert node.getLocation('dublin_temp') == 'Pi9'
+
+
+def test_route_followed_when_no_producer_registered():
+    node, connection = routedNode()
+    # No contacts, so the lookup ends at once without a location
+    node.icn.requestData('dublin_temp', time() + 10)
+    [(msg_type, content)] = connection.messages('REQUEST')
+    assert content['data_name'] == 'dublin_temp'
+    assert node.resolver.lookups == {}
+
+
+def test_found_producer_is_cached_for_prefix():
+    node, connection = routedNode()
+    lookup = node.resolver.newLookup(ringId('dublin_'), 'dublin_', None)
+    node.addToPIT('dublin_temp', node.name, time() + 10)
+    node.icn.producerFound('127.0.0.1:33020:Pi9', 'dublin_temp', time() + 10, 5, 1, closest=lookup.closest())
+    assert node.resolver.getLocation('dublin_') == '127.0.0.1:33020:Pi9'
+    # Another name under the prefix goes straight to the producer
+    node.icn.requestData('dublin_hum', time() + 10)
+    assert node.resolver.lookups == {lookup.lid: lookup}
+    assert [c[1] for c in node.reactor.connects] == [33020, 33020]
+    # Forgotten once requests to it fail
+    node.icn.handleFail('Pi9', 'dublin_hum')
+    assert node.resolver.getLocation('dublin_') is None
+
+
+def test_lookup_connections_are_closed():
+    network = LoopbackNetwork()
+    # Pi4 does not take part in the overlay, so queries to it time out
+    nodes = [makeNode(f"Pi{i}", 33010 + i, resolver=i != 4) for i in range(1, 5)]
+    for n in nodes:
+        network.add(n)
+    a = nodes[0]
+    for n in nodes[1:]:
+        a.resolver.contacts.add(n.name, f"127.0.0.1:{n.icn.ip_node.port}")
+    found = []
+    a.icn.lookup(ringId('dublin_'), 'dublin_', lambda location, closest=None: found.append(closest))
+    network.run()
+    assert found == [] and len(network.open()) > 0
+    for i in range(3):
+        for n in nodes:
+            n.reactor.advance(LOOKUP_TIMEOUT)
+        network.run()
+    assert len(found) == 1 and 'Pi4' not in [n for n, addr in found[0]]
+    assert network.open() == []
@@ -0,0 +1,98 @@
+import pytest
+import Routing
+from Routing import RoutingTable, namePrefix, prefixesOf
+from fakes import makeNode, LoopbackNetwork, handshake
+
+
+def test_name_prefixes():
+    assert namePrefix('dublin_temp') == 'dublin_'
+    assert namePrefix('dublin') == 'dublin'
+    assert prefixesOf('a_b_c') == ['a_b_c', 'a_b_', 'a_']
+
+
+def test_newer_advertisements_replace_older(clock):
+    t = RoutingTable('Pi1')
+    assert t.update('dublin_', 'Pi9', 1, 3, 'Pi2')
+    # Same origin and sequence number: only a shorter path wins
+    assert not t.update('dublin_', 'Pi9', 1, 4, 'Pi3')
+    assert t.update('dublin_', 'Pi9', 1, 2, 'Pi3')
+    assert t.lookup('dublin_temp').next_hop == 'Pi3'
+    # A newer advertisement wins even over a longer path
+    assert t.update('dublin_', 'Pi9', 2, 5, 'Pi2')
+    assert not t.update('dublin_', 'Pi9', 1, 1, 'Pi3')
+    assert t.lookup('dublin_temp').cost == 5
+
+
+def test_current_next_hop_may_report_a_worse_cost(clock):
+    t = RoutingTable('Pi1')
+    t.update('dublin_', 'Pi9', 1, 2, 'Pi2')
+    assert t.update('dublin_', 'Pi9', 1, 4, 'Pi2')
+    assert t.lookup('dublin_temp').cost == 4
+
+
+def test_other_origins_only_replace_with_a_shorter_path(clock):
+    t = RoutingTable('Pi1')
+    t.update('dublin_', 'Pi9', 1, 3, 'Pi2')
+    assert not t.update('dublin_', 'Pi8', 7, 3, 'Pi3')
+    assert t.update('dublin_', 'Pi8', 7, 2, 'Pi3')
+    assert t.lookup('dublin_temp').origin == 'Pi8'
+
+
+def test_own_and_unreachable_routes_ignored(clock):
+    t = RoutingTable('Pi1')
+    assert not t.update('dublin_', 'Pi1', 1, 1, 'Pi2')
+    assert not t.update('dublin_', 'Pi9', 1, Routing.MAX_COST, 'Pi2')
+    assert t.lookup('dublin_temp') is None
+
+
+def test_longest_prefix_match(clock):
+    t = RoutingTable('Pi1')
+    t.update('dublin_', 'Pi9', 1, 1, 'Pi2')
+    t.update('dublin_temp', 'Pi8', 1, 1, 'Pi3')
+    assert t.lookup('dublin_temp').next_hop == 'Pi3'
+    assert t.lookup('dublin_hum').next_hop == 'Pi2'
+    assert t.lookup('doha_temp') is None
+
+
+def test_routes_expire(clock):
+    t = RoutingTable('Pi1')
+    t.update('dublin_', 'Pi9', 1, 1, 'Pi2')
+    clock[0] += Routing.ROUTE_TIMEOUT + 1
+    assert t.lookup('dublin_temp') is None
+    # An expired route no longer blocks worse ones
+    t.update('doha_', 'Pi9', 1, 1, 'Pi2')
+    clock[0] += Routing.ROUTE_TIMEOUT + 1
+    assert t.update('doha_', 'Pi8', 1, 5, 'Pi3')
+
+
+def test_remove_next_hop(clock):
+    t = RoutingTable('Pi1')
+    t.update('dublin_', 'Pi9', 1, 1, 'Pi2')
+    t.update('doha_', 'Pi8', 1, 1, 'Pi3')
+    t.removeNextHop('Pi2')
+    assert t.lookup('dublin_temp') is None and t.lookup('doha_temp') is not None
+
+
+def test_advertisement_split_horizon(clock):
+    t = RoutingTable('Pi1')
+    t.seq = 4
+    t.update('dublin_', 'Pi9', 1, 2, 'Pi2')
+    t.update('doha_', 'Pi8', 3, 1, 'Pi3')
+    to_pi2 = t.advertisement('Pi2', ['tokyo_'])
+    assert to_pi2 == [['tokyo_', 'Pi1', 4, 0], ['doha_', 'Pi8', 3, 1]]
+    assert ['dublin_', 'Pi9', 1, 2] in t.advertisement('Pi3', ['tokyo_'])
+
+
+@pytest.mark.parametrize('relay_produces', [False, True])
+def test_routes_learned_during_handshake(relay_produces):
+    network = LoopbackNetwork()
+    producer, relay = makeNode('Pi1', 33011), makeNode('Pi2', 33012)
+    producer.data['dublin_temp'] = ('10', 60)
+    if relay_produces:
+        relay.data['doha_temp'] = ('20', 60)
+    handshake(network, producer, relay)
+    assert 'Pi2' in producer.peers and 'Pi1' in relay.peers
+    # Both ends learn the other's prefixes without waiting for a periodic advertisement
+    assert relay.getRoute('dublin_temp').next_hop == 'Pi1'
+    if relay_produces:
+        assert producer.getRoute('doha_temp').next_hop == 'Pi2'
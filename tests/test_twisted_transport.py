@@ -0,0 +1,18 @@
+import pytest
+
+pytest.importorskip('twisted')
+
+from twisted.internet import defer
+from twisted.internet.error import ConnectionRefusedError, DNSLookupError
+import TwistedTransport
+
+
+@pytest.mark.parametrize('error', [ConnectionRefusedError(), DNSLookupError('nowhere.invalid')])
+def test_failed_connection_calls_back_with_none(monkeypatch, error):
+    monkeypatch.setattr(TwistedTransport, 'connectProtocol', lambda endpoint, protocol: defer.fail(error))
+    results = []
+    d = TwistedTransport.TwistedTransport().connect('nowhere.invalid', 33010, object(),
+                                                   lambda p, *args: results.append((p, args)), 'x')
+    assert results == [(None, ('x',))]
+    # Nothing left unhandled
+    assert d.result is None